@@ -7,16 +7,41 @@
 import configparser
 import argparse
 import collections
+import hashlib
+import math
 import os
+import random
 import re
+import signal
+import shutil
+import sqlite3
 import subprocess
 import sys
 import syslog
 import tempfile
+import threading
 import time
 import localFunctions
+import mirrorFunctions
 import systemCleanup
 
+SNAPSHOT_NAME_FORMAT = "%Y-%m-%d_%H%M"
+INCOMPLETE_SUFFIX = ".incomplete"
+MANIFEST_DIRECTORY = "/var/lib/mirror/manifest"
+# the file list in the manifest is rebuilt from the destination this often
+MANIFEST_REFRESH_INTERVAL = 7 * 24 * 3600
+# bytes of the verify budget charged for each directory entry read while
+# rebuilding the file list
+MANIFEST_ENTRY_COST = 4096
+# report the fraction of files checked within this period (100 / 2% = 50 nights)
+AUDIT_CYCLE_DAYS = 50
+HASH_BLOCK_SIZE = 2 ** 20
+IO_PRESSURE_FILENAME = "/proc/pressure/io"
+# seconds between load checks while rsync runs during school hours
+THROTTLE_CHECK_INTERVAL = 5
+# resume a paused rsync when the pressure falls below this part of the limit
+THROTTLE_RESUME_FRACTION = 0.5
+
 # The initial logfile name used before the successful read of the configuration
 # file. The filename from the logfile is normally the same.
 InitialLogFileName = "/var/log/mirror/mirror.log"
@@ -204,10 +229,35 @@ class Rsyncer:
         self.unmount_dest = task["unmount_dest"]
         self.disk_to_spindown = task["disk_to_spindown"]
         self.max_percent_full = task["max_percent_full"]
+        self.use_change_journal = task["use_change_journal"]
+        self.change_list_text = ""
+        self.verifier = None
+        if task["verify_percent"] > 0:
+            self.verifier = MirrorVerifier(self.name, task["verify_percent"],
+                                           task["verify_budget_mb"])
+        self.snapshot_manager = None
+        if task["snapshot_daily"] or task["snapshot_weekly"]:
+            self.snapshot_manager = SnapshotManager(self.dest_dir,
+                                                    task["snapshot_daily"],
+                                                    task["snapshot_weekly"])
         self.stderr_file = tempfile.TemporaryFile()
         self.status_text = ""
         self.sync_successful = False
         self.filesystemManager = FilesystemManager(task)
+        self.progress = {"task": self.name, "source_dir": self.source_dir,
+                         "dest_dir": self.dest_dir, "pid": os.getpid(),
+                         "state": "starting", "start_time": time.time(),
+                         "bytes_transferred": 0, "percent_done": 0, "rate": 0.0,
+                         "eta": 0}
+        self.io_throttle = None
+        if task["throttle_io_pressure"] > 0:
+            try:
+                self.io_throttle = IoThrottle(self.name, self.progress,
+                                              task["throttle_io_pressure"],
+                                              task["school_hours"], task["school_days"])
+            except ValueError:
+                syslog.syslog("Mirror %s: school_hours '%s' is not HH:MM-HH:MM. "
+                              "I/O is not throttled." % (self.name, task["school_hours"]))
 
     # ----------------------------------------------------------------------
     def clean_dest_dir_before_rsync(self):
@@ -244,8 +294,22 @@ class Rsyncer:
         if self.filesystemManager.mount_filesystems():
             used_space = get_used_space(self.source_dir)
             dest_fs_percent_used_start = get_used_space(self.dest_dir)
-            self.clean_dest_dir_before_rsync()
-            if used_space < self.max_percent_full:
+            rsync_dest = self.dest_dir
+            link_dest_command = ""
+            if self.snapshot_manager:
+                # the previous generations are kept so nothing is cleaned
+                rsync_dest, previous_snapshot = \
+                    self.snapshot_manager.prepare_snapshot()
+                if previous_snapshot:
+                    link_dest_command = "--link-dest=%s" % previous_snapshot
+            else:
+                self.clean_dest_dir_before_rsync()
+            rsync_source, files_from_command, full_walk_start = \
+                self.prepare_change_list()
+            if not rsync_dest:
+                self.status_text = self.snapshot_manager.get_status_text()
+                self.sync_successful = False
+            elif used_space < self.max_percent_full:
                 try:
                     exclude_command = ""
                     delete_command = ""
@@ -272,13 +336,19 @@ class Rsyncer:
                     if os.path.exists(log_filename):
                         os.remove(log_filename)
                     rsync_command = \
-                        "%s /usr/bin/rsync -axH  --log-file=%s %s %s %s %s" \
+                        "%s /usr/bin/rsync -axH --info=progress2,stats2 --log-file=%s %s %s %s %s %s %s" \
                         % (command_prefix, log_filename, delete_command,
-                           exclude_command, self.source_dir, self.dest_dir)
-                    subprocess.check_output(
-                        rsync_command, stderr=subprocess.PIPE, shell=True)
+                           exclude_command, link_dest_command, files_from_command,
+                           rsync_source, rsync_dest)
+                    self.run_rsync(rsync_command)
                     self.sync_successful = True
                     self.status_text = process_rsync_log(log_filename)
+                    self.status_text += self.get_throughput_text()
+                    self.status_text += self.change_list_text
+                    if self.snapshot_manager:
+                        self.sync_successful = self.snapshot_manager.complete_snapshot()
+                        self.snapshot_manager.prune_snapshots()
+                        self.status_text += self.snapshot_manager.get_status_text()
                     self.status_text += "   %s start %d%% full  finish %d%% full\n" \
                                         % (self.dest_dir, dest_fs_percent_used_start,
                                            get_used_space(self.dest_dir))
@@ -287,6 +357,13 @@ class Rsyncer:
                     if text.find("vanish") == -1:
                         self.status_text = text
                         self.sync_successful = False
+                self.progress["state"] = "completed" if self.sync_successful else "failed"
+                mirrorFunctions.write_mirror_status(self.name, self.progress)
+                if self.sync_successful and self.verifier:
+                    self.run_verification(rsync_dest)
+                if self.use_change_journal:
+                    mirrorFunctions.finish_journal(self.name, self.sync_successful,
+                                                   full_walk_start)
             else:
                 # not enough space, nothing done
                 self.status_text = "The source directory (%s) was too full. (%d%%)" \
@@ -299,6 +376,643 @@ class Rsyncer:
         self.status_text += self.filesystemManager.get_status_text()
         return self.sync_successful, self.status_text
 
+    # ----------------------------------------------------------------------
+    def run_verification(self, rsync_dest):
+        """
+        Check a sample of the mirrored files while the filesystems are still
+        mounted.
+        :param rsync_dest: the directory rsync wrote to
+        """
+        if FilesystemManager.split_remote_filesystem_info(self.source_dir)[0] or \
+                FilesystemManager.split_remote_filesystem_info(self.dest_dir)[0]:
+            self.verifier = None
+            return
+        if self.io_throttle and self.io_throttle.in_school_hours():
+            # the extra reads are left for a night run
+            self.verifier = None
+            return
+        if self.snapshot_manager:
+            snapshot_names = self.snapshot_manager.get_snapshot_names()
+            if not snapshot_names:
+                self.verifier = None
+                return
+            rsync_dest = os.path.join(self.dest_dir, snapshot_names[0])
+        # "dir/" is copied into the destination, "dir" as a subdirectory of it
+        if self.source_dir.endswith("/"):
+            dest_base = rsync_dest
+        else:
+            dest_base = os.path.join(rsync_dest, os.path.basename(self.source_dir))
+        self.verifier.verify(self.source_dir, dest_base,
+                             self.progress["start_time"])
+
+    # ----------------------------------------------------------------------
+    def prepare_change_list(self):
+        """
+        If the change journal daemon has recorded every change since the last
+        full walk, write the changed paths to a file for rsync --files-from so
+        that rsync does not stat the whole tree. Otherwise a full walk is made.
+        Snapshots always need a full walk to create a complete generation.
+        :return: (rsync source argument, rsync files-from options,
+            start time of a full walk or 0)
+        """
+        if not self.use_change_journal or self.snapshot_manager or \
+                FilesystemManager.split_remote_filesystem_info(self.source_dir)[0]:
+            return self.source_dir, "", 0
+        try:
+            usable, reason = mirrorFunctions.journal_usable(self.name)
+            full_walk_start = time.time()
+            changed_paths = mirrorFunctions.take_journal(self.name)
+            if not usable:
+                self.change_list_text = "   Full walk: %s\n" % reason
+                return self.source_dir, "", full_walk_start
+            # "dir/" copies the contents of dir, "dir" copies dir itself
+            if self.source_dir.endswith("/"):
+                base_dir, path_prefix = self.source_dir, ""
+            else:
+                base_dir = os.path.dirname(self.source_dir) or "/"
+                path_prefix = os.path.basename(self.source_dir) + "/"
+            files_from_filename = "/tmp/rsync-files-%s.txt" % self.name
+            with open(files_from_filename, "w") as f:
+                f.writelines([path_prefix + p + "\n" for p in changed_paths])
+            self.change_list_text = "   Changed paths from journal: %d\n" \
+                                    % len(changed_paths)
+            return base_dir, "--files-from=%s -r --delete-missing-args --force" \
+                   % files_from_filename, 0
+        except OSError as err:
+            self.change_list_text = "   Full walk: change journal unreadable: %s\n" % err
+            return self.source_dir, "", time.time()
+
+    # ----------------------------------------------------------------------
+    def run_rsync(self, rsync_command):
+        """
+        Run rsync reading the progress output from a pipe as it is produced
+        and publish it to the mirror status file. The progress lines are
+        separated by carriage returns, the final statistics by newlines.
+        Raises subprocess.CalledProcessError like check_output if rsync fails.
+        :param rsync_command:
+        :return:
+        """
+        self.stderr_file.seek(0)
+        self.stderr_file.truncate()
+        self.progress["state"] = "running"
+        self.progress["start_time"] = time.time()
+        mirrorFunctions.write_mirror_status(self.name, self.progress)
+        last_update = 0.0
+        # a separate process group so that the throttle can pause every
+        # process of the command together
+        process = subprocess.Popen(rsync_command, stdout=subprocess.PIPE,
+                                   stderr=self.stderr_file, shell=True,
+                                   start_new_session=True)
+        if self.io_throttle:
+            self.io_throttle.start_watching(process)
+        pending = b""
+        while True:
+            chunk = process.stdout.read1(4096)
+            if not chunk:
+                break
+            lines = re.split(rb'[\r\n]', pending + chunk)
+            pending = lines.pop()
+            for raw_line in lines:
+                line = raw_line.decode(sys.getfilesystemencoding(), "replace")
+                values = mirrorFunctions.parse_progress_line(line)
+                if values:
+                    self.progress.update(values)
+                    continue
+                stat_value = mirrorFunctions.parse_stats_line(line)
+                if stat_value:
+                    self.progress[stat_value[0]] = stat_value[1]
+            if time.time() - last_update > mirrorFunctions.STATUS_UPDATE_INTERVAL:
+                last_update = time.time()
+                mirrorFunctions.write_mirror_status(self.name, self.progress)
+        return_code = process.wait()
+        if self.io_throttle:
+            self.io_throttle.stop_watching()
+            self.progress["paused_time"] = self.io_throttle.paused_time
+        self.progress["elapsed"] = time.time() - self.progress["start_time"]
+        if return_code:
+            self.stderr_file.seek(0)
+            raise subprocess.CalledProcessError(return_code, rsync_command,
+                                                stderr=self.stderr_file.read())
+
+    # ----------------------------------------------------------------------
+    def get_throughput_text(self):
+        """
+        A line for the mirror log so that the throughput of each run is kept.
+        A steady drop over weeks for the same task may show a failing disk.
+        """
+        transferred = self.progress.get("total_transferred_file_size",
+                                        self.progress["bytes_transferred"])
+        paused_time = self.progress.get("paused_time", 0)
+        # time paused for the school's load is not counted
+        elapsed = max(self.progress.get("elapsed", 0) - paused_time, 1)
+        text = "\n   Throughput: %.2f MB/s  transferred %d KB in %d s (%s)\n" \
+               % (transferred / elapsed / 2 ** 20, transferred // 1024, elapsed,
+                  mirrorFunctions.format_duration(elapsed))
+        if paused_time:
+            text += "   Paused %s for server load\n" \
+                    % mirrorFunctions.format_duration(paused_time)
+        return text
+
+
+class IoThrottle:
+    """
+    Keep a mirror from slowing the server while the school is using it.
+    During school hours a thread checks the server I/O pressure every few
+    seconds. When it is above the limit the whole rsync process group is
+    paused with SIGSTOP and it is continued with SIGCONT when the pressure
+    has dropped to half of the limit or school hours end. Outside school
+    hours nothing is done.
+    The pressure is the "some avg10" value of /proc/pressure/io: the percent
+    of time that some task was waiting for I/O. If the kernel does not provide
+    it the percent of cpu time in iowait is used.
+    """
+
+    def __init__(self, task_name, progress, max_pressure, school_hours, school_days):
+        """
+        :param task_name:
+        :param progress: the Rsyncer progress dictionary, updated with the state
+        :param max_pressure: percent
+        :param school_hours: "HH:MM-HH:MM"
+        :param school_days: day names, e.g. "Mon Tue Wed Thu Fri"
+        """
+        self.task_name = task_name
+        self.progress = progress
+        self.max_pressure = max_pressure
+        start_text, end_text = school_hours.split("-")
+        self.school_start = self.minutes_from_text(start_text)
+        self.school_end = self.minutes_from_text(end_text)
+        self.school_days = [day[:3].lower() for day in school_days.split()]
+        self.process = None
+        self.paused = False
+        self.pause_start = 0.0
+        self.paused_time = 0.0
+        self.prior_cpu_times = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def minutes_from_text(time_text):
+        hours, minutes = time_text.strip().split(":")
+        return int(hours) * 60 + int(minutes)
+
+    def in_school_hours(self):
+        now = time.localtime()
+        minutes = now.tm_hour * 60 + now.tm_min
+        return time.strftime("%a", now).lower() in self.school_days and \
+               self.school_start <= minutes < self.school_end
+
+    def read_io_pressure(self):
+        """
+        :return: percent of time waiting for I/O
+        """
+        try:
+            with open(IO_PRESSURE_FILENAME, "r") as f:
+                for line in f:
+                    if line.startswith("some"):
+                        return float(re.search(r'avg10=([\d.]+)', line).group(1))
+        except (OSError, AttributeError, ValueError):
+            pass
+        # older kernel: iowait share of cpu time since the last check
+        try:
+            with open("/proc/stat", "r") as f:
+                cpu_times = [int(v) for v in f.readline().split()[1:]]
+            pressure = 0.0
+            if self.prior_cpu_times:
+                deltas = [c - p for c, p in zip(cpu_times, self.prior_cpu_times)]
+                if sum(deltas) > 0:
+                    pressure = 100.0 * deltas[4] / sum(deltas)
+            self.prior_cpu_times = cpu_times
+            return pressure
+        except (OSError, ValueError, IndexError):
+            return 0.0
+
+    def send_signal(self, signal_number):
+        try:
+            os.killpg(self.process.pid, signal_number)
+            return True
+        except (ProcessLookupError, PermissionError):
+            return False
+
+    def pause(self, pressure):
+        if self.send_signal(signal.SIGSTOP):
+            self.paused = True
+            self.pause_start = time.time()
+            self.progress["state"] = "paused"
+            syslog.syslog("Mirror %s paused: I/O pressure %.1f%%"
+                          % (self.task_name, pressure))
+            mirrorFunctions.write_mirror_status(self.task_name, self.progress)
+
+    def resume(self):
+        self.send_signal(signal.SIGCONT)
+        self.paused = False
+        self.paused_time += time.time() - self.pause_start
+        self.progress["state"] = "running"
+        mirrorFunctions.write_mirror_status(self.task_name, self.progress)
+
+    def watch(self):
+        while not self.stop_event.wait(THROTTLE_CHECK_INTERVAL):
+            if not self.in_school_hours():
+                if self.paused:
+                    self.resume()
+                continue
+            pressure = self.read_io_pressure()
+            if not self.paused and pressure > self.max_pressure:
+                self.pause(pressure)
+            elif self.paused and \
+                    pressure < self.max_pressure * THROTTLE_RESUME_FRACTION:
+                self.resume()
+
+    def start_watching(self, process):
+        self.process = process
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.watch,
+                                       name="throttle-" + self.task_name,
+                                       daemon=True)
+        self.thread.start()
+
+    def stop_watching(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        if self.paused:
+            self.resume()
+
+
+class MirrorVerifier:
+    """
+    Confirm that the mirror copy can be read back and matches the source.
+    A manifest of the files in the copy (path, size, mtime, content hash and
+    time last verified) is kept for each task. Each night a sample of the
+    files that were verified longest ago, verify_percent of them, is hashed
+    on both the source and the copy, limited to budget_mb megabytes read
+    from each side. With 2% a full audit takes about 50 nights.
+    The weekly rebuild of the file list is charged against the same budget
+    and is continued the next night if the budget runs out.
+    """
+
+    def __init__(self, task_name, verify_percent, budget_mb,
+                 manifest_directory=MANIFEST_DIRECTORY):
+        self.task_name = task_name
+        self.verify_percent = verify_percent
+        self.budget = budget_mb * 2 ** 20
+        self.manifest_filename = os.path.join(manifest_directory,
+                                              task_name + ".sqlite")
+        self.verify_successful = True
+        self.status_text = ""
+        self.problems = []
+        self.last_stat = {}
+
+    def open_manifest(self):
+        os.makedirs(os.path.dirname(self.manifest_filename), 0o755, exist_ok=True)
+        connection = sqlite3.connect(self.manifest_filename)
+        connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, "
+                           "size INTEGER, mtime REAL, hash TEXT, "
+                           "last_verified REAL DEFAULT 0, seen INTEGER DEFAULT 0)")
+        connection.execute("CREATE INDEX IF NOT EXISTS verified_index "
+                           "ON files (last_verified)")
+        connection.execute("CREATE TABLE IF NOT EXISTS info (name TEXT PRIMARY KEY, "
+                           "value REAL)")
+        return connection
+
+    @staticmethod
+    def get_info(connection, name, default=0):
+        row = connection.execute("SELECT value FROM info WHERE name = ?",
+                                 (name,)).fetchone()
+        return row[0] if row else default
+
+    def refresh_needed(self, connection):
+        return self.get_info(connection, "refresh_cursor", None) is not None or \
+            time.time() - self.get_info(connection, "last_refresh") > \
+            MANIFEST_REFRESH_INTERVAL
+
+    @staticmethod
+    def walk_copy(dest_base, cursor=None):
+        """
+        Walk the copy in sorted order, so that a walk can be continued in a
+        later run, starting after the directory cursor.
+        :param cursor: relative path of the last directory already read or
+            None to start at the top
+        :return: generator of (relative directory path, number of entries,
+            list of (relative path, lstat) of the regular files)
+        """
+        cursor_parts = cursor.split("/") if cursor else []
+        directories = [""]
+        while directories:
+            relative_dir = directories.pop()
+            parts = relative_dir.split("/") if relative_dir else []
+            wanted = cursor is None or parts > cursor_parts
+            try:
+                entries = sorted(os.scandir(os.path.join(dest_base, relative_dir)),
+                                 key=lambda e: e.name)
+            except OSError:
+                entries = []
+            files = []
+            subdirectories = []
+            for entry in entries:
+                relative_path = os.path.join(relative_dir, entry.name)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(relative_path)
+                    elif wanted and entry.is_file(follow_symlinks=False):
+                        files.append((relative_path, entry.stat(follow_symlinks=False)))
+                except OSError:
+                    continue
+            if wanted:
+                yield relative_dir, len(entries), files
+            for subdirectory in reversed(subdirectories):
+                subdirectory_parts = subdirectory.split("/")
+                # below the cursor only its own ancestors are entered again
+                if cursor is None or subdirectory_parts > cursor_parts or \
+                        cursor_parts[:len(subdirectory_parts)] == subdirectory_parts:
+                    directories.append(subdirectory)
+
+    def refresh_manifest(self, connection, dest_base, budget):
+        """
+        Rebuild the list of files from the copy. Entries for files that are
+        still present keep their hash and verification time. Each entry read
+        is charged MANIFEST_ENTRY_COST. When the budget is used up the place
+        reached is saved and the walk goes on in the next run. Files that
+        are gone are removed only when the walk is complete.
+        :return: the bytes of the budget used
+        """
+        cursor = self.get_info(connection, "refresh_cursor", None)
+        refresh_id = int(self.get_info(connection, "refresh_id"))
+        if cursor is None:
+            refresh_id += 1
+        else:
+            # saved with a leading "/" so that sqlite never makes it a number
+            cursor = str(cursor)[1:]
+        used = 0
+        for relative_dir, entry_count, files in self.walk_copy(dest_base, cursor):
+            rows = [(path, file_stat.st_size, file_stat.st_mtime, refresh_id)
+                    for path, file_stat in files]
+            connection.executemany("INSERT OR IGNORE INTO files (path, size, mtime, seen) "
+                                   "VALUES (?, ?, ?, ?)", rows)
+            connection.executemany("UPDATE files SET seen = ? WHERE path = ?",
+                                   [(row[3], row[0]) for row in rows])
+            used += (entry_count + 1) * MANIFEST_ENTRY_COST
+            if used >= budget:
+                connection.executemany("INSERT OR REPLACE INTO info VALUES (?, ?)",
+                                       [("refresh_id", refresh_id),
+                                        ("refresh_cursor", "/" + relative_dir)])
+                connection.commit()
+                return used
+        connection.execute("DELETE FROM files WHERE seen != ?", (refresh_id,))
+        connection.execute("DELETE FROM info WHERE name = 'refresh_cursor'")
+        connection.executemany("INSERT OR REPLACE INTO info VALUES (?, ?)",
+                               [("refresh_id", refresh_id),
+                                ("last_refresh", time.time())])
+        connection.commit()
+        return used
+
+    @staticmethod
+    def hash_file(filename):
+        file_hash = hashlib.sha256()
+        with open(filename, "rb") as f:
+            while True:
+                block = f.read(HASH_BLOCK_SIZE)
+                if not block:
+                    break
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def verify_file(self, source_base, dest_base, path, stored_hash, mirror_start):
+        """
+        :return: (result, hash to store, bytes read). The result is "removed"
+            if the file no longer exists, "skipped" if it changed after the
+            mirror started, otherwise "checked"
+        """
+        source_file = os.path.join(source_base, path)
+        dest_file = os.path.join(dest_base, path)
+        try:
+            source_stat = os.lstat(source_file)
+            dest_stat = os.lstat(dest_file)
+        except OSError:
+            # removed since the file list was made
+            return "removed", stored_hash, 0
+        if source_stat.st_mtime >= mirror_start:
+            # it will be checked another night
+            return "skipped", stored_hash, 0
+        if source_stat.st_size != dest_stat.st_size or \
+                int(source_stat.st_mtime) != int(dest_stat.st_mtime):
+            self.problems.append("size or time differs: %s" % path)
+            return "checked", stored_hash, 0
+        try:
+            dest_hash = self.hash_file(dest_file)
+        except OSError as err:
+            self.problems.append("copy unreadable: %s (%s)" % (path, err.strerror))
+            return "checked", stored_hash, dest_stat.st_size
+        try:
+            source_hash = self.hash_file(source_file)
+        except OSError as err:
+            self.problems.append("source unreadable: %s (%s)" % (path, err.strerror))
+            return "checked", stored_hash, 2 * dest_stat.st_size
+        if source_hash != dest_hash:
+            self.problems.append("contents differ: %s" % path)
+        elif stored_hash and len(stored_hash) == len(source_hash) and \
+                stored_hash != source_hash and \
+                self.last_stat.get(path) == (source_stat.st_size, source_stat.st_mtime):
+            self.problems.append("contents changed without a new time: %s" % path)
+        return "checked", source_hash, 2 * dest_stat.st_size
+
+    def verify(self, source_base, dest_base, mirror_start):
+        """
+        :param source_base: directory that corresponds to dest_base
+        :param dest_base: directory in the copy holding the mirrored files
+        :param mirror_start: the time the rsync started
+        :return: (verify_successful, status_text)
+        """
+        self.problems = []
+        self.last_stat = {}
+        bytes_read = 0
+        verified_count = 0
+        try:
+            connection = self.open_manifest()
+            budget = self.budget
+            if self.refresh_needed(connection):
+                budget -= self.refresh_manifest(connection, dest_base, budget)
+            file_count = connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            sample_size = int(math.ceil(file_count * self.verify_percent / 100.0))
+            sample = connection.execute("SELECT path, size, mtime, hash FROM files "
+                                        "ORDER BY last_verified LIMIT ?",
+                                        (sample_size,)).fetchall()
+            random.shuffle(sample)
+            for path, size, mtime, stored_hash in sample:
+                if bytes_read + 2 * size > budget and verified_count:
+                    continue
+                self.last_stat[path] = (size, mtime)
+                result, new_hash, file_bytes = self.verify_file(
+                    source_base, dest_base, path, stored_hash, mirror_start)
+                bytes_read += file_bytes
+                if result == "removed":
+                    connection.execute("DELETE FROM files WHERE path = ?", (path,))
+                    continue
+                elif result == "skipped":
+                    continue
+                verified_count += 1
+                try:
+                    file_stat = os.lstat(os.path.join(dest_base, path))
+                    size, mtime = file_stat.st_size, file_stat.st_mtime
+                except OSError:
+                    pass
+                connection.execute("UPDATE files SET hash = ?, size = ?, mtime = ?, "
+                                   "last_verified = ? WHERE path = ?",
+                                   (new_hash, size, mtime, time.time(), path))
+            connection.commit()
+            cycle_start = time.time() - AUDIT_CYCLE_DAYS * 24 * 3600
+            recent_count = connection.execute("SELECT COUNT(*) FROM files WHERE "
+                                              "last_verified > ?",
+                                              (cycle_start,)).fetchone()[0]
+            connection.close()
+            self.status_text = "\n   Verified %d files (%s read). %d problems. " \
+                               "%.1f%% of %d files verified in the last %d days.\n" \
+                               % (verified_count,
+                                  localFunctions.convert_to_readable(bytes_read // 1024)
+                                  or "0 KB",
+                                  len(self.problems),
+                                  100.0 * recent_count / max(file_count, 1),
+                                  file_count, AUDIT_CYCLE_DAYS)
+            for problem in self.problems[:50]:
+                self.status_text += "     %s\n" % problem
+            if len(self.problems) > 50:
+                self.status_text += "     ... %d more\n" % (len(self.problems) - 50)
+            self.verify_successful = not self.problems
+        except (OSError, sqlite3.Error) as err:
+            self.status_text = "\n   Verification failed: %s\n" % err
+            self.verify_successful = False
+        return self.verify_successful, self.status_text
+
+
+class SnapshotManager:
+    """
+    Keep several generations of a mirror as dated directories under the
+    destination directory. Each new generation is rsynced with --link-dest to
+    the previous one so unchanged files are hard links and use no extra space.
+    A generation is written as NAME.incomplete and renamed only when the rsync
+    succeeds, so a failed or damaged run never replaces a good copy.
+    The newest generation of each of the last daily_count days and of each
+    of the last weekly_count weeks is kept.
+    """
+
+    def __init__(self, snapshot_root, daily_count, weekly_count):
+        self.snapshot_root = snapshot_root
+        self.daily_count = daily_count
+        self.weekly_count = weekly_count
+        self.snapshot_name = time.strftime(SNAPSHOT_NAME_FORMAT)
+        self.incomplete_dir = ""
+        self.status_text = ""
+
+    def get_snapshot_names(self):
+        """
+        :return: list of the completed generation names, newest first
+        """
+        names = []
+        try:
+            for name in os.listdir(self.snapshot_root):
+                try:
+                    time.strptime(name, SNAPSHOT_NAME_FORMAT)
+                    if os.path.isdir(os.path.join(self.snapshot_root, name)):
+                        names.append(name)
+                except ValueError:
+                    pass
+        except OSError:
+            pass
+        names.sort(reverse=True)
+        return names
+
+    def prepare_snapshot(self):
+        """
+        Create the directory for the new generation. A generation left
+        incomplete by an earlier failed run is reused so the files already
+        copied are not copied again.
+        :return: (directory to rsync into, previous generation directory or "")
+        """
+        if FilesystemManager.split_remote_filesystem_info(self.snapshot_root)[0]:
+            self.status_text = "   Snapshots require a local destination: %s\n" \
+                               % self.snapshot_root
+            return "", ""
+        self.incomplete_dir = os.path.join(self.snapshot_root,
+                                           self.snapshot_name + INCOMPLETE_SUFFIX)
+        try:
+            for name in os.listdir(self.snapshot_root):
+                full_name = os.path.join(self.snapshot_root, name)
+                if name.endswith(INCOMPLETE_SUFFIX) and full_name != self.incomplete_dir:
+                    os.rename(full_name, self.incomplete_dir)
+                    break
+            os.makedirs(self.incomplete_dir, exist_ok=True)
+        except OSError as err:
+            self.status_text = "   Failed to create snapshot %s: %s\n" \
+                               % (self.incomplete_dir, err)
+            return "", ""
+        previous_snapshot = ""
+        snapshot_names = self.get_snapshot_names()
+        if snapshot_names:
+            previous_snapshot = os.path.join(self.snapshot_root, snapshot_names[0])
+        return self.incomplete_dir + "/", previous_snapshot
+
+    def complete_snapshot(self):
+        try:
+            os.rename(self.incomplete_dir,
+                      os.path.join(self.snapshot_root, self.snapshot_name))
+            return True
+        except OSError as err:
+            self.status_text += "   Failed to complete snapshot %s: %s\n" \
+                                % (self.snapshot_name, err)
+            return False
+
+    def select_snapshots_to_keep(self, snapshot_names):
+        """
+        :param snapshot_names: generation names, newest first
+        :return: set of names to keep
+        """
+        keep = set(snapshot_names[:1])
+        days_seen = []
+        weeks_seen = []
+        for name in snapshot_names:
+            snapshot_time = time.strptime(name, SNAPSHOT_NAME_FORMAT)
+            day = time.strftime("%Y-%m-%d", snapshot_time)
+            week = time.strftime("%G-%V", snapshot_time)
+            if day not in days_seen and len(days_seen) < self.daily_count:
+                days_seen.append(day)
+                keep.add(name)
+            if week not in weeks_seen and len(weeks_seen) < self.weekly_count:
+                weeks_seen.append(week)
+                keep.add(name)
+        return keep
+
+    def prune_snapshots(self):
+        """
+        Remove the generations no longer needed. The space used by each
+        generation takes a walk of its whole tree to find, so it is only
+        reported on request, see get_space_text.
+        """
+        snapshot_names = self.get_snapshot_names()
+        keep = self.select_snapshots_to_keep(snapshot_names)
+        for name in snapshot_names:
+            if name not in keep:
+                try:
+                    shutil.rmtree(os.path.join(self.snapshot_root, name))
+                    self.status_text += "   Snapshot %s removed.\n" % name
+                except OSError as err:
+                    self.status_text += "   Failed to remove snapshot %s: %s\n" \
+                                        % (name, err)
+        self.status_text += "   %d snapshots kept.\n" % len(self.get_snapshot_names())
+
+    def get_space_text(self):
+        """
+        :return: the space used only by each generation, as text
+        """
+        space_text = ""
+        for name in self.get_snapshot_names():
+            unique_size = get_unique_space(os.path.join(self.snapshot_root, name))
+            space_text += "   Snapshot %s unique space %s\n" \
+                          % (name, localFunctions.convert_to_readable(
+                              unique_size) or "0 KB")
+        return space_text
+
+    def get_status_text(self):
+        return self.status_text
+
 
 # ----------------------------------------------------------------------
 
@@ -485,26 +1199,41 @@ class PasswdBackup:
 # ----------------------------------------------------------------------
 def get_used_space(dirname):
     """
-    determine free space on file partition
+    determine the percent used of the file partition. It is read fresh
+    because the destination is checked again after the rsync.
     :param dirname:
     :return:
     """
     used_space_percent = 1
-    try:
-        if os.path.ismount(dirname):
-            command = '/bin/df %s' % dirname
-            result = localFunctions.run_command(command, reraise_error=True,
-                                                merge_stderr=False)
-            found_values = re.findall(r'(\d+)%', result[1])
-            # confirm valid number
-            used_space_value = int(found_values[0])
-            if 1 < used_space_value < 101:
-                used_space_percent = used_space_value
-    except (subprocess.CalledProcessError, ValueError, IndexError):
-        pass
+    if os.path.ismount(dirname):
+        space = localFunctions.get_filesystem_space(dirname, max_age=0)
+        # confirm valid number
+        if space and 1 < space.percent_used < 101:
+            used_space_percent = space.percent_used
     return used_space_percent
 
 
+# ----------------------------------------------------------------------
+def get_unique_space(dirname):
+    """
+    Determine the space used by files that are not hard linked into any
+    other generation, i.e. the space freed if this generation were removed.
+    :param dirname:
+    :return: size in KB
+    """
+    unique_blocks = 0
+    for dirpath, dirnames, filenames in os.walk(dirname):
+        for filename in filenames:
+            try:
+                file_stat = os.lstat(os.path.join(dirpath, filename))
+                if file_stat.st_nlink == 1:
+                    unique_blocks += file_stat.st_blocks
+            except OSError:
+                pass
+    # st_blocks is in 512 byte units
+    return unique_blocks // 2
+
+
 # ----------------------------------------------------------------------
 def process_rsync_log(logfile_name):
     """
@@ -620,6 +1349,159 @@ def rotate_mirror_log(mirror_logfile="/var/log/mirror/mirror.log"):
     except IOError:
         pass
 
+def find_fstab_device(dirname, fstab_filename="/etc/fstab"):
+    """
+    Find the device that is mounted at the deepest mountpoint in fstab that
+    contains dirname. Used for filesystems that are not mounted yet.
+    :param dirname:
+    :param fstab_filename:
+    :return: the device specification or "" if none is found
+    """
+    device = ""
+    best_mountpoint = ""
+    try:
+        with open(fstab_filename, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 2 or fields[0].startswith("#"):
+                    continue
+                mountpoint = fields[1].rstrip("/") + "/"
+                if (dirname.rstrip("/") + "/").startswith(mountpoint) and \
+                        len(mountpoint) > len(best_mountpoint):
+                    best_mountpoint = mountpoint
+                    device = fields[0]
+    except OSError:
+        pass
+    if device.startswith("UUID="):
+        device = "/dev/disk/by-uuid/" + device[5:]
+    elif device.startswith("LABEL="):
+        device = "/dev/disk/by-label/" + device[6:]
+    return device
+
+
+def get_block_device(dirname):
+    """
+    Determine the physical disk that holds a source or destination directory
+    so that tasks that share a disk are never run at the same time.
+    The currently mounted device is used if there is one, otherwise the
+    device in fstab. A remote "hostname:dir" is identified by the host.
+    :param dirname:
+    :return: a disk name such as "sda" or "remote:hostname". None if unknown.
+    """
+    command_prefix, local_dirname = \
+        FilesystemManager.split_remote_filesystem_info(dirname)
+    if command_prefix:
+        return "remote:" + dirname.split(":")[0]
+    device = ""
+    best_mountpoint = ""
+    try:
+        with open("/proc/mounts", "r") as f:
+            for line in f:
+                mount_info = line.split()
+                mountpoint = mount_info[1].rstrip("/") + "/"
+                if (local_dirname.rstrip("/") + "/").startswith(mountpoint) and \
+                        len(mountpoint) > len(best_mountpoint) and \
+                        mount_info[0].startswith("/dev/"):
+                    best_mountpoint = mountpoint
+                    device = mount_info[0]
+    except (OSError, IndexError):
+        pass
+    # "/" matches everything so prefer a more specific fstab entry
+    if not device or best_mountpoint == "/":
+        device = find_fstab_device(local_dirname) or device
+    try:
+        partition_name = os.path.basename(os.path.realpath(device))
+        sys_path = os.path.realpath(os.path.join("/sys/class/block", partition_name))
+        if not os.path.exists(sys_path):
+            return None
+        if os.path.exists(os.path.join(sys_path, "partition")):
+            return os.path.basename(os.path.dirname(sys_path))
+        return partition_name
+    except OSError:
+        return None
+
+
+class MirrorScheduler:
+    """
+    Run mirror tasks in parallel when they use different disks. Each disk is
+    used by only one task at a time so no disk is slowed by competing rsyncs.
+    Tasks are started in configuration file order as soon as both of their
+    disks are free. A task with a disk that cannot be identified is run alone.
+    """
+
+    def __init__(self, tasks, task_function, max_parallel=0):
+        """
+        :param tasks: list of task dictionaries
+        :param task_function: function called with a task that returns
+            True if the task was successful
+        :param max_parallel: maximum number of tasks at the same time. 0 for
+            no limit other than the disks
+        """
+        self.task_function = task_function
+        self.max_parallel = max_parallel
+        self.pending = []
+        for task in tasks:
+            devices = {get_block_device(task["source_dir"]),
+                       get_block_device(task["dest_dir"])}
+            self.pending.append((task, None if None in devices else devices))
+        self.busy_devices = set()
+        self.running_count = 0
+        self.exclusive_running = False
+        self.all_successful = True
+        self.condition = threading.Condition()
+
+    def can_start(self, devices):
+        if self.exclusive_running:
+            return False
+        if self.max_parallel and self.running_count >= self.max_parallel:
+            return False
+        if devices is None:
+            return self.running_count == 0
+        return not (devices & self.busy_devices)
+
+    def run_task(self, task, devices):
+        successful = False
+        try:
+            successful = self.task_function(task)
+        finally:
+            with self.condition:
+                self.all_successful = self.all_successful and successful
+                self.running_count -= 1
+                if devices is None:
+                    self.exclusive_running = False
+                else:
+                    self.busy_devices -= devices
+                self.condition.notify_all()
+
+    def run(self):
+        """
+        Run all tasks and wait for them to finish.
+        :return: True if all tasks were successful
+        """
+        threads = []
+        with self.condition:
+            while self.pending:
+                for index, (task, devices) in enumerate(self.pending):
+                    if self.can_start(devices):
+                        del self.pending[index]
+                        self.running_count += 1
+                        if devices is None:
+                            self.exclusive_running = True
+                        else:
+                            self.busy_devices |= devices
+                        thread = threading.Thread(target=self.run_task,
+                                                  args=(task, devices),
+                                                  name=task["name"])
+                        thread.start()
+                        threads.append(thread)
+                        break
+                else:
+                    self.condition.wait()
+        for thread in threads:
+            thread.join()
+        return self.all_successful
+
+
 def create_task_dict(config, taskname, nice, ionice, nocache):
     """
     process an entry in the mirror.cfg file to create a dictionary with all
@@ -643,6 +1525,28 @@ def create_task_dict(config, taskname, nice, ionice, nocache):
                  "max_percent_full": config.getint(taskname,
                                                    "max_percent_full",
                                                    fallback=97),
+                 "snapshot_daily": config.getint(taskname,
+                                                 "snapshot_daily_generations",
+                                                 fallback=0),
+                 "snapshot_weekly": config.getint(taskname,
+                                                  "snapshot_weekly_generations",
+                                                  fallback=0),
+                 "use_change_journal": config.getboolean(taskname,
+                                                         "use_change_journal",
+                                                         fallback=False),
+                 "verify_percent": config.getfloat(taskname,
+                                                   "verify_sample_percent",
+                                                   fallback=0),
+                 "verify_budget_mb": config.getint(taskname,
+                                                   "verify_budget_mb",
+                                                   fallback=2048),
+                 "throttle_io_pressure": config.getfloat(taskname,
+                                                         "throttle_io_pressure",
+                                                         fallback=0),
+                 "school_hours": config.get(taskname, "school_hours",
+                                            fallback="07:00-17:00"),
+                 "school_days": config.get(taskname, "school_days",
+                                           fallback="Mon Tue Wed Thu Fri"),
                  "nice": nice or config.getint(taskname,
                                                "nice"),
                  "nocache": nocache,
@@ -713,7 +1617,12 @@ if __name__ == '__main__':
                    help='use ionice to reduce io priority')
     p.add_argument("--nocache", action='store_true',
                    help="Use nocache on rsync if nocache program is available")
+    p.add_argument("--max-parallel", type=int, dest='max_parallel',
+                   help="Maximum number of mirror tasks run at the same time. Tasks on the same disk are never run together. 1 for one at a time")
+    p.add_argument("--snapshot-space", action='store_true', dest='snapshot_space',
+                   help="Show the space used only by each snapshot generation, then exit without mirroring")
     p.set_defaults(jobname='DailyJobs',
+                   max_parallel=0,
                    config_file='/usr/local/etc/mirror/mirror.cfg',
                    nice=5)
     try:
@@ -725,6 +1634,20 @@ if __name__ == '__main__':
         print ("The config file '%s' does not exist" %opt.config_file)
         sys.exit(1)
     localFunctions.confirm_root_user(PROGRAM_NAME)
+    if opt.snapshot_space:
+        unused, unused, mirror_tasks, error_text, fatal_read_error = \
+            read_configuration_file(opt.config_file, opt.jobname, opt.nice,
+                                    opt.ionice, opt.nocache)
+        if fatal_read_error:
+            print(error_text, file=sys.stderr)
+            sys.exit(1)
+        for mirror_task in mirror_tasks:
+            if mirror_task["snapshot_daily"] or mirror_task["snapshot_weekly"]:
+                print("%s:" % mirror_task["name"])
+                print(SnapshotManager(mirror_task["dest_dir"],
+                                      mirror_task["snapshot_daily"],
+                                      mirror_task["snapshot_weekly"]).get_space_text())
+        sys.exit(0)
     # check for current run -- do not run the program twice at the same time.
 
     default_logfile = InitialLogFileName
@@ -772,26 +1695,43 @@ if __name__ == '__main__':
                     dest_dir=passwd_task["dest_dir"],
                     task_type="Passwd Backup")
         job_successful = job_successful and successful
-    for mirror_task in mirror_tasks:
-        log_results(starting=True, result_text="", sync_successful=False,
-                    mirror_logfile=mirror_task["mirror_logfile"],
-                    source_dir=mirror_task["source_dir"],
-                    dest_dir=mirror_task["dest_dir"],
-                    task_type="Mirror")
+    # mirror log entries are written by several threads
+    log_lock = threading.Lock()
+
+    def run_mirror_task(mirror_task):
+        with log_lock:
+            log_results(starting=True, result_text="", sync_successful=False,
+                        mirror_logfile=mirror_task["mirror_logfile"],
+                        source_dir=mirror_task["source_dir"],
+                        dest_dir=mirror_task["dest_dir"],
+                        task_type="Mirror")
+        rsyncer = None
         try:
             rsyncer = Rsyncer(mirror_task)
             successful, result_text = rsyncer.perform_rsync()
         except Exception as err:
             result_text = "   Mirror failed:\n     %s" % err
             successful = False
-        log_results(starting=False,
-                    result_text=result_text,
-                    sync_successful=successful,
-                    mirror_logfile=mirror_task["mirror_logfile"],
-                    source_dir=mirror_task["source_dir"],
-                    dest_dir=mirror_task["dest_dir"],
-                    task_type="Mirror")
-        job_successful = job_successful and successful
+        with log_lock:
+            log_results(starting=False,
+                        result_text=result_text,
+                        sync_successful=successful,
+                        mirror_logfile=mirror_task["mirror_logfile"],
+                        source_dir=mirror_task["source_dir"],
+                        dest_dir=mirror_task["dest_dir"],
+                        task_type="Mirror")
+            if successful and rsyncer.verifier and rsyncer.verifier.status_text:
+                log_results(starting=False,
+                            result_text=rsyncer.verifier.status_text,
+                            sync_successful=rsyncer.verifier.verify_successful,
+                            mirror_logfile=mirror_task["mirror_logfile"],
+                            source_dir=mirror_task["source_dir"],
+                            dest_dir=mirror_task["dest_dir"],
+                            task_type="Verify")
+        return successful
+
+    scheduler = MirrorScheduler(mirror_tasks, run_mirror_task, opt.max_parallel)
+    job_successful = scheduler.run() and job_successful
     log_results(starting=False, result_text="",
                 sync_successful=job_successful,
                 mirror_logfile=default_logfile,
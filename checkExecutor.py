@@ -0,0 +1,580 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Run the checks of systemCheck concurrently while keeping the report
+exactly as it is when they are run one after another.
+
+Each check is a CheckStep with the steps it depends upon. A step is started
+in its own thread as soon as the steps it depends upon have finished, with
+at most max_workers checks running at once. Nothing is written to the report
+by the check threads: while a check runs every report call it makes is
+recorded and the main thread replays the calls, together with the progress
+messages and percent complete values of the step, in the order of the step
+list. The report is then the same as a serial run and the GUI is only
+updated from the main thread. Steps that name the same exclusive resource,
+such as the network link that a measurement needs to itself, never run at
+the same time.
+
+A run can be cancelled: the steps that have not started are then not run
+and the running steps are left to finish. A step listener is told of each
+change of a step's status, for a display of the checks as they run.
+
+A thread cannot be stopped, so a step that runs past its timeout is left
+to finish on its own. From then on its report calls are dropped, and so
+are its changes to the attributes of objects that are CheckResultHolders,
+so that it cannot change the report or the results being analyzed.
+
+A CheckProfile selects the steps for one kind of run (the full system
+check, the internet check, a quick check) from the complete list.
+
+The results of the checks that list their result attributes and a ttl are
+kept in a ResultCache file under /run/systemcheck. A later run, by the same
+or another program, that accepts results of that age uses them instead of
+running the check again.
+"""
+
+import fcntl
+import json
+import os
+import os.path
+import threading
+import time
+
+DEFAULT_CHECK_TIMEOUT = 120
+DEFAULT_MAX_WORKERS = 6
+# Reporter methods that write to the report. Other attributes are passed on.
+REPORT_METHOD_PREFIXES = ("report_", "show_percent_complete", "adjust_problems_count")
+
+# cost classes of the checks, cheapest first
+COST_CHEAP = "cheap"        # reads files in /proc, /sys or /var
+COST_COMMAND = "command"    # runs local commands
+COST_NETWORK = "network"    # waits on the network
+COST_SLOW = "slow"          # long probes such as a ping sweep
+COST_ORDER = (COST_CHEAP, COST_COMMAND, COST_NETWORK, COST_SLOW)
+
+RESULT_CACHE_FILENAME = "/run/systemcheck/results.json"
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+SKIPPED = "skipped"
+FAILED = "failed"
+TIMED_OUT = "timed out"
+CANCELLED = "cancelled"
+
+# the CheckStep run by each check thread
+StepThreads = threading.local()
+
+
+def progress_message(message_name, **kwargs):
+    """
+    :return: a report_progress call for the before or after list of a CheckStep
+    """
+    return "report_progress", (message_name,), kwargs
+
+
+def percent_complete(value):
+    return "show_percent_complete", (value,), {}
+
+
+def step_abandoned():
+    """
+    :return: True if this thread runs a step that has timed out
+    """
+    step = getattr(StepThreads, "step", None)
+    return step is not None and step.status == TIMED_OUT
+
+
+class CheckResultHolder:
+    """
+    Base class of the objects that the checks set their results in. An
+    attribute set by a step that has timed out is not changed.
+    """
+
+    def __setattr__(self, name, value):
+        if not step_abandoned():
+            super().__setattr__(name, value)
+
+
+class DeferredReporter:
+    """
+    Wraps a sysChkIO.Reporter. In a thread that has started a buffer the
+    report calls are recorded rather than performed. The calls of a step
+    that has timed out are dropped. In other threads the calls are
+    performed directly.
+    """
+
+    def __init__(self, reporter):
+        self.reporter = reporter
+        self.local = threading.local()
+
+    def start_buffer(self):
+        self.local.buffer = []
+
+    def stop_buffer(self):
+        buffer = getattr(self.local, "buffer", None) or []
+        self.local.buffer = None
+        return buffer
+
+    def replay(self, calls):
+        for method_name, args, kwargs in calls:
+            getattr(self.reporter, method_name)(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.reporter, name)
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is not None and callable(attribute) and \
+                name.startswith(REPORT_METHOD_PREFIXES):
+            def record_call(*args, **kwargs):
+                if not step_abandoned():
+                    buffer.append((name, args, kwargs))
+            return record_call
+        return attribute
+
+
+class CheckStep:
+    """
+    One check in the list run by the CheckExecutor.
+    """
+
+    def __init__(self, name, function=None, depends_on=(), condition=None,
+                 before=(), after=(), timeout=DEFAULT_CHECK_TIMEOUT,
+                 cost=COST_COMMAND, auto_fix=False, results=(), ttl=0,
+                 exclusive=None):
+        """
+        :param name: used for depends_on and as the function_errors key
+        :param function: the check. None for a step that only reports progress
+        :param depends_on: names of the steps that must finish first
+        :param condition: a function called after the steps in depends_on
+            have finished. The step is skipped if it returns False.
+        :param before: report calls made before the output of the check
+        :param after: report calls made after the output of the check
+        :param timeout: seconds the check may run before it is abandoned
+        :param cost: one of the COST_ORDER classes
+        :param auto_fix: True if the check may change the system, such as
+            restarting a daemon, when it finds a problem
+        :param results: names of the attributes of the checker that the check
+            sets. They must be json values or sets.
+        :param ttl: the most seconds that the cached results may be used.
+            0 for a check that is never cached.
+        :param exclusive: name of a resource that the check must have to
+            itself. Checks with the same name are run one at a time, in any
+            order. None for no resource.
+        """
+        self.name = name
+        self.function = function
+        self.depends_on = depends_on
+        self.condition = condition
+        self.before = before
+        self.after = after
+        self.timeout = timeout
+        self.cost = cost
+        self.auto_fix = auto_fix
+        self.results = results
+        self.ttl = ttl
+        self.exclusive = exclusive
+        self.from_cache = False
+        self.status = PENDING
+        self.start_time = 0.0
+        self.run_time = 0.0
+        self.output = []
+        self.error = None
+        self.done = threading.Event()
+
+
+def encode_value(value):
+    if isinstance(value, set):
+        return {"__set__": sorted(value)}
+    raise TypeError("%s cannot be cached" % type(value).__name__)
+
+
+def decode_value(value):
+    if "__set__" in value:
+        return set(value["__set__"])
+    return value
+
+
+class ResultCache:
+    """
+    The results and report output of checks with the time they were made.
+    The file is shared by all programs that run the checks so it is only
+    changed while holding a lock.
+    """
+
+    def __init__(self, filename=RESULT_CACHE_FILENAME):
+        self.filename = filename
+        self.entries = {}
+        self.new_entries = {}
+
+    def load(self):
+        try:
+            with open(self.filename, "r") as f:
+                self.entries = json.load(f, object_hook=decode_value)
+        except (OSError, ValueError):
+            self.entries = {}
+        return self.entries
+
+    def get(self, check_name, max_age):
+        """
+        :return: the entry for the check if it is no older than max_age
+            seconds, otherwise None
+        """
+        entry = self.entries.get(check_name)
+        if entry and 0 <= time.time() - entry.get("time", 0) <= max_age:
+            return entry
+        return None
+
+    def add(self, check_name, results, output):
+        """
+        Record the results of a check that was run. They are written by save.
+        :return: False if the values cannot be cached
+        """
+        entry = {"time": time.time(), "results": results, "output": output}
+        try:
+            json.dumps(entry, default=encode_value)
+        except (TypeError, ValueError):
+            return False
+        self.new_entries[check_name] = entry
+        return True
+
+    def update_file(self, function):
+        """
+        Call function with the current file entries and write what it returns.
+        """
+        directory = os.path.dirname(self.filename)
+        os.makedirs(directory, 0o755, exist_ok=True)
+        with open(self.filename + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.load()
+            self.entries = function(self.entries)
+            with open(self.filename + ".new", "w") as f:
+                json.dump(self.entries, f, default=encode_value)
+            os.replace(self.filename + ".new", self.filename)
+
+    def save(self):
+        """
+        Merge the new results into the file.
+        """
+        if not self.new_entries:
+            return
+        try:
+            self.update_file(lambda entries: dict(entries, **self.new_entries))
+            self.new_entries = {}
+        except OSError:
+            pass
+
+    def invalidate(self):
+        """
+        A problem was fixed so no cached result can be trusted.
+        """
+        self.new_entries = {}
+        try:
+            self.update_file(lambda entries: {})
+        except OSError:
+            pass
+
+
+class CheckProfile:
+    """
+    A named selection of the steps to run.
+    """
+
+    def __init__(self, name, description, checks=None, max_cost=COST_SLOW,
+                 allow_fixes=True, analysis="full"):
+        """
+        :param name:
+        :param description:
+        :param checks: names of the checks to run or None for all. The steps
+            they depend upon are added.
+        :param max_cost: checks with a higher cost class are left out
+        :param allow_fixes: if False the auto_fix checks are left out
+        :param analysis: the analysis the SystemChecker makes of the results
+        """
+        self.name = name
+        self.description = description
+        self.checks = checks
+        self.max_cost = max_cost
+        self.allow_fixes = allow_fixes
+        self.analysis = analysis
+
+    def allows_cost(self, step):
+        return COST_ORDER.index(step.cost) <= COST_ORDER.index(self.max_cost)
+
+    def allows(self, step):
+        return self.allows_cost(step) and (self.allow_fixes or not step.auto_fix)
+
+    def select(self, steps):
+        """
+        :param steps: the complete list of steps in report order
+        :return: the steps of this profile in the same order. A step whose
+            dependencies are left out for their cost is also left out.
+        """
+        steps_by_name = {step.name: step for step in steps}
+        if self.checks is None:
+            wanted = set(steps_by_name)
+        else:
+            wanted = set([name for name in self.checks if name in steps_by_name])
+            needed = list(wanted)
+            while needed:
+                for name in steps_by_name[needed.pop()].depends_on:
+                    if name not in wanted:
+                        wanted.add(name)
+                        needed.append(name)
+            # the steps that only report progress go with their checks
+            wanted.update([step.name for step in steps if not step.function and
+                           all([name in wanted for name in step.depends_on])])
+        selected = []
+        # a check left out only because it may fix something does not stop
+        # the checks that wait for it
+        usable_names = set()
+        for step in steps:
+            if step.name in wanted and \
+                    all([name in usable_names for name in step.depends_on]):
+                if self.allows(step):
+                    selected.append(step)
+                    usable_names.add(step.name)
+                elif step.auto_fix and self.allows_cost(step):
+                    usable_names.add(step.name)
+        return selected
+
+
+class CheckExecutor:
+    """
+    Run a list of CheckSteps and write their reports in list order.
+    """
+
+    def __init__(self, reporter, function_errors, max_workers=DEFAULT_MAX_WORKERS,
+                 checker=None, result_cache=None, max_age=0, timer=None,
+                 cancel_event=None, step_listener=None):
+        """
+        :param reporter: the DeferredReporter of the SystemChecker, or a
+            sysChkIO.Reporter that is then wrapped in one
+        :param function_errors: the dictionary that check errors are added to
+        :param max_workers: the most checks running at once
+        :param checker: the object that holds the results of the checks
+        :param result_cache: a ResultCache or None
+        :param max_age: the oldest cached results, in seconds, that may be
+            used instead of running a check. The ttl of the check also applies.
+        :param timer: a checkTiming.CheckTimer to measure each check or None
+        :param cancel_event: a threading.Event that is set to cancel the run
+        :param step_listener: a function called with the step whenever the
+            status of a step changes. It is called from the check threads.
+        """
+        if not isinstance(reporter, DeferredReporter):
+            reporter = DeferredReporter(reporter)
+        self.reporter = reporter
+        self.function_errors = function_errors
+        self.checker = checker
+        self.result_cache = result_cache
+        self.max_age = max_age
+        self.timer = timer
+        self.cancel_event = cancel_event
+        self.step_listener = step_listener
+        self.workers = threading.BoundedSemaphore(max(1, max_workers))
+        self.steps = {}
+        self.exclusive_locks = {}
+        self.lock = threading.Lock()
+
+    # ----------------------------------------------------------------------
+    def is_cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    # ----------------------------------------------------------------------
+    def notify(self, step):
+        if self.step_listener:
+            self.step_listener(step)
+
+    # ----------------------------------------------------------------------
+    def run_step(self, step):
+        for name in step.depends_on:
+            dependency = self.steps[name]
+            dependency.done.wait()
+            if dependency.status in (FAILED, TIMED_OUT, CANCELLED):
+                self.finish_step(step, CANCELLED if self.is_cancelled() else SKIPPED)
+                return
+        with self.lock:
+            if step.status != PENDING:
+                return
+        self.workers.acquire()
+        try:
+            if self.is_cancelled():
+                self.finish_step(step, CANCELLED)
+                return
+            if step.condition and not step.condition():
+                self.finish_step(step, SKIPPED)
+                return
+            if self.use_cached_results(step):
+                return
+            if step.exclusive:
+                self.run_exclusive_step(step)
+            else:
+                self.run_step_function(step)
+        finally:
+            # a step that timed out has already given up its worker
+            with self.lock:
+                if step.status != TIMED_OUT:
+                    self.workers.release()
+
+    # ----------------------------------------------------------------------
+    def run_exclusive_step(self, step):
+        """
+        Wait for the resource of the step. A step that timed out keeps the
+        resource until its thread really finishes.
+        """
+        with self.exclusive_locks[step.exclusive]:
+            if self.is_cancelled():
+                self.finish_step(step, CANCELLED)
+                return
+            self.run_step_function(step)
+
+    # ----------------------------------------------------------------------
+    def run_step_function(self, step):
+        """
+        Run the check with its report calls recorded.
+        """
+        step.start_time = time.time()
+        step.status = RUNNING
+        self.notify(step)
+        StepThreads.step = step
+        self.reporter.start_buffer()
+        try:
+            if step.function:
+                self.call_step_function(step)
+            status = COMPLETED
+        except Exception as e:
+            step.error = e
+            status = FAILED
+        finally:
+            StepThreads.step = None
+        step.run_time = time.time() - step.start_time
+        output = self.reporter.stop_buffer()
+        if status == COMPLETED:
+            self.cache_results(step, output)
+        self.finish_step(step, status, output)
+
+    # ----------------------------------------------------------------------
+    def call_step_function(self, step):
+        if not self.timer:
+            step.function()
+            return
+        with self.timer.measure(step.name) as record:
+            try:
+                step.function()
+            except Exception:
+                record["status"] = FAILED
+                raise
+            finally:
+                if step.status == TIMED_OUT:
+                    record["status"] = TIMED_OUT
+
+    # ----------------------------------------------------------------------
+    def record_unmeasured_steps(self, steps):
+        """
+        Add the checks that did not run to the timing records.
+        """
+        for step in steps:
+            if not step.function:
+                continue
+            if step.from_cache:
+                self.timer.add_unmeasured(step.name, "cached")
+            elif step.status == TIMED_OUT:
+                self.timer.add_unmeasured(step.name, TIMED_OUT, step.timeout)
+            elif step.status in (SKIPPED, CANCELLED):
+                self.timer.add_unmeasured(step.name, step.status)
+
+    # ----------------------------------------------------------------------
+    def use_cached_results(self, step):
+        """
+        Set the results of the step from the cache if they are recent enough.
+        :return: True if the cached results were used
+        """
+        if not (self.result_cache and step.ttl and step.results):
+            return False
+        entry = self.result_cache.get(step.name, min(self.max_age, step.ttl))
+        if not entry:
+            return False
+        for name, value in entry["results"].items():
+            setattr(self.checker, name, value)
+        step.from_cache = True
+        self.finish_step(step, COMPLETED,
+                         [(call[0], tuple(call[1]), call[2]) for call in entry["output"]])
+        return True
+
+    # ----------------------------------------------------------------------
+    def cache_results(self, step, output):
+        """
+        The results of a step that timed out were not used in this run so
+        they are not shared with other runs either.
+        """
+        if self.result_cache and step.ttl and step.results:
+            with self.lock:
+                if step.status == TIMED_OUT:
+                    return
+                results = {name: getattr(self.checker, name) for name in step.results}
+                self.result_cache.add(step.name, results, output)
+
+    # ----------------------------------------------------------------------
+    def finish_step(self, step, status, output=()):
+        with self.lock:
+            if step.status == TIMED_OUT:
+                return
+            step.status = status
+            step.output = list(output)
+            step.done.set()
+        self.notify(step)
+
+    # ----------------------------------------------------------------------
+    def wait_for_step(self, step):
+        """
+        Wait until the step is finished or has run longer than its timeout.
+        A step that is still waiting for the steps before it has not started
+        its timeout.
+        """
+        while not step.done.wait(0.5):
+            with self.lock:
+                if step.status == RUNNING and \
+                        time.time() - step.start_time > step.timeout:
+                    # the thread cannot be stopped. It is left to finish
+                    # on its own; its report calls and result attributes
+                    # are dropped from now on.
+                    step.status = TIMED_OUT
+                    self.function_errors[step.name] = \
+                        "timed out after %d seconds" % step.timeout
+                    self.workers.release()
+                    step.done.set()
+            if step.status == TIMED_OUT:
+                self.notify(step)
+
+    # ----------------------------------------------------------------------
+    def run(self, steps):
+        """
+        Start all of the steps then write the report of each in list order.
+        An exception raised by a check is raised again here when its step is
+        reached, as it would have been in a serial run.
+        :param steps: list of CheckSteps. A step may only depend on steps
+            earlier in the list.
+        :return: the steps
+        """
+        self.steps = {step.name: step for step in steps}
+        self.exclusive_locks = {step.exclusive: threading.Lock() for step in steps
+                                if step.exclusive}
+        for step in steps:
+            self.notify(step)
+        for step in steps:
+            thread = threading.Thread(target=self.run_step, args=(step,),
+                                      name="check %s" % step.name, daemon=True)
+            thread.start()
+        for step in steps:
+            self.wait_for_step(step)
+            if step.status in (SKIPPED, CANCELLED):
+                continue
+            self.reporter.set_current_check(step.name)
+            self.reporter.replay(step.before)
+            self.reporter.replay(step.output)
+            if step.status == FAILED:
+                raise step.error
+            self.reporter.replay(step.after)
+        self.reporter.set_current_check("")
+        if self.timer:
+            self.record_unmeasured_steps(steps)
+        return steps
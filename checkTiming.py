@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Measure how long each check and each analysis or fix step of systemCheck
+takes: the wall time, the CPU time of the thread that ran it and the number
+of commands it started with localFunctions.run_command or
+command_run_successful. Checks run in their own threads so the CPU time of
+one check is not mixed with the others. The CPU time used by the commands
+themselves is only known for the whole run.
+
+The table is printed at the end of the run and each measurement is appended
+as a json line to the history file so that slow checks at a school can be
+found over time and the check timeouts set from real values.
+"""
+
+import contextlib
+import json
+import os
+import os.path
+import resource
+import socket
+import threading
+import time
+import localFunctions
+
+TIMING_HISTORY_FILENAME = "/var/log/systemCheck/timing.jsonl"
+# the history file is cut to the last half when larger than this
+MAX_HISTORY_SIZE = 5 * 2 ** 20
+
+
+def thread_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class CheckTimer:
+    """
+    Collect the timing records of one run.
+    """
+
+    def __init__(self, profile_name="", history_filename=TIMING_HISTORY_FILENAME):
+        self.profile_name = profile_name
+        self.history_filename = history_filename
+        self.records = []
+        self.lock = threading.Lock()
+        self.start_time = 0.0
+        self.wall_start = 0.0
+        self.children_cpu_start = 0.0
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        self.start_time = time.time()
+        self.wall_start = time.monotonic()
+        self.children_cpu_start = children_cpu_time()
+
+    # ----------------------------------------------------------------------
+    @contextlib.contextmanager
+    def measure(self, name, kind="check"):
+        """
+        Time the code in the with block. The record is yielded so that the
+        caller can set its "status".
+        """
+        record = {"name": name, "kind": kind, "status": "completed"}
+        subprocesses_start = localFunctions.get_command_count()
+        cpu_start = thread_cpu_time()
+        wall_start = time.monotonic()
+        try:
+            yield record
+        finally:
+            record["wall"] = round(time.monotonic() - wall_start, 3)
+            record["cpu"] = round(thread_cpu_time() - cpu_start, 3)
+            record["subprocesses"] = localFunctions.get_command_count() - \
+                subprocesses_start
+            self.add(record)
+
+    # ----------------------------------------------------------------------
+    def add(self, record):
+        """
+        A check that finishes after it has been recorded as timed out is
+        not added again.
+        """
+        with self.lock:
+            if not self.find(record["name"], record["kind"]):
+                self.records.append(record)
+
+    # ----------------------------------------------------------------------
+    def find(self, name, kind):
+        return [r for r in self.records if r["name"] == name and r["kind"] == kind]
+
+    # ----------------------------------------------------------------------
+    def add_unmeasured(self, name, status, wall=0.0, kind="check"):
+        """
+        Record a check that did not run its function: skipped, taken from the
+        result cache or still running after its timeout.
+        """
+        with self.lock:
+            if not self.find(name, kind):
+                self.records.append({"name": name, "kind": kind, "status": status,
+                                     "wall": round(wall, 3), "cpu": 0.0,
+                                     "subprocesses": 0})
+
+    # ----------------------------------------------------------------------
+    def format_table(self):
+        """
+        :return: the records as text, slowest first, with the run totals
+        """
+        with self.lock:
+            records = sorted(self.records, key=lambda r: r["wall"], reverse=True)
+        lines = ["%-40s %-9s %9s %8s %6s  %s" % ("Step", "Kind", "Wall s", "CPU s",
+                                                "Cmds", "Status")]
+        for record in records:
+            lines.append("%-40s %-9s %9.2f %8.2f %6d  %s"
+                         % (record["name"][:40], record["kind"], record["wall"],
+                            record["cpu"], record["subprocesses"], record["status"]))
+        lines.append("Total %.1f s wall time, %.1f s CPU time in commands"
+                     % (time.monotonic() - self.wall_start,
+                        children_cpu_time() - self.children_cpu_start))
+        return "\n".join(lines)
+
+    # ----------------------------------------------------------------------
+    def write_history(self):
+        """
+        Append one json line for each record.
+        """
+        run_values = {"run": round(self.start_time, 2), "host": socket.gethostname(),
+                      "profile": self.profile_name}
+        try:
+            os.makedirs(os.path.dirname(self.history_filename), 0o755, exist_ok=True)
+            if os.path.exists(self.history_filename) and \
+                    os.path.getsize(self.history_filename) > MAX_HISTORY_SIZE:
+                with open(self.history_filename, "r") as f:
+                    lines = f.readlines()
+                with open(self.history_filename, "w") as f:
+                    f.writelines(lines[len(lines) // 2:])
+            with self.lock:
+                records = list(self.records)
+            with open(self.history_filename, "a") as f:
+                for record in records:
+                    f.write(json.dumps(dict(run_values, **record)) + "\n")
+        except OSError:
+            pass
@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Send DNS queries from this process with plain UDP packets instead of
+running dig and rndc for each name. All queries are sent at once and each
+has its own timeout, so a hung bind costs one timeout for the whole test
+rather than one for every name asked. As with dig a query that is not
+answered is sent again, 3 times 5 seconds for a name that may need a
+recursive lookup over a slow uplink. The query that only tests that the
+local bind is alive is given less time.
+
+Every query gives a DnsResult with the response code and the time the
+server took to answer:
+    results = dnsResolver.run_queries([
+        dnsResolver.DnsQuery("127.0.0.1", "google.com"),
+        dnsResolver.DnsQuery("8.8.8.8", "google.com")])
+The server port can be given in each query so the functions can be tried
+against a small DNS server on a high port.
+"""
+
+import asyncio
+import collections
+import random
+import re
+import socket
+import struct
+import time
+
+RESOLV_CONF_FILENAME = "/etc/resolv.conf"
+BIND_OPTIONS_FILENAME = "/etc/bind/named.conf.options"
+DNS_PORT = 53
+# seconds to wait for each try and the number of tries, as dig
+QUERY_TIMEOUT = 5.0
+QUERY_TRIES = 3
+# bind answers the liveness query itself
+LIVENESS_TIMEOUT = 2.0
+LIVENESS_TRIES = 2
+MAX_RESPONSE_SIZE = 4096
+TYPE_A = 1
+TYPE_PTR = 12
+CLASS_IN = 1
+FLAG_RESPONSE = 0x8000
+FLAG_RECURSION_DESIRED = 0x0100
+RCODE_NAMES = {0: "NOERROR", 1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN",
+               4: "NOTIMP", 5: "REFUSED"}
+TIMED_OUT = "TIMEOUT"
+UNREACHABLE = "UNREACHABLE"
+
+DnsQuery = collections.namedtuple("DnsQuery", ["server", "name", "query_type", "port",
+                                               "timeout", "tries"])
+DnsQuery.__new__.__defaults__ = (TYPE_A, DNS_PORT, QUERY_TIMEOUT, QUERY_TRIES)
+
+
+class DnsResult(collections.namedtuple("DnsResult", ["query", "rcode", "answers", "latency"])):
+    """
+    rcode is a name from RCODE_NAMES, TIMED_OUT or UNREACHABLE. latency is
+    in seconds, 0.0 if there was no answer.
+    """
+
+    @property
+    def answered(self):
+        return self.rcode not in (TIMED_OUT, UNREACHABLE)
+
+    @property
+    def resolved(self):
+        return self.rcode == "NOERROR" and self.answers > 0
+
+
+def reverse_name(address):
+    """
+    :return: the name for a PTR query of the IPv4 address
+    """
+    return ".".join(reversed(address.split("."))) + ".in-addr.arpa"
+
+
+def liveness_query(server="127.0.0.1"):
+    """
+    :return: the query for the name of 127.0.0.1 that a nameserver answers
+        without asking any other server
+    """
+    return DnsQuery(server, reverse_name("127.0.0.1"), TYPE_PTR,
+                    timeout=LIVENESS_TIMEOUT, tries=LIVENESS_TRIES)
+
+
+def encode_name(name):
+    encoded = b""
+    for label in name.strip(".").split("."):
+        label = label.encode("idna")
+        if not label or len(label) > 63:
+            raise ValueError("bad name %s" % name)
+        encoded += struct.pack("!B", len(label)) + label
+    return encoded + b"\0"
+
+
+def create_query(name, query_type=TYPE_A, query_id=0):
+    """
+    :return: the packet of a recursive query with one question
+    """
+    header = struct.pack("!HHHHHH", query_id, FLAG_RECURSION_DESIRED, 1, 0, 0, 0)
+    return header + encode_name(name) + struct.pack("!HH", query_type, CLASS_IN)
+
+
+def parse_response(data):
+    """
+    Only the header is needed: the answers themselves are not used.
+    :return: (query id, response code name, number of answers) or None if
+        the data is not a DNS response
+    """
+    if len(data) < 12:
+        return None
+    query_id, flags, questions, answers = struct.unpack("!HHHH", data[:8])
+    if not flags & FLAG_RESPONSE:
+        return None
+    rcode = flags & 0x000f
+    return query_id, RCODE_NAMES.get(rcode, "RCODE%d" % rcode), answers
+
+
+async def send_query(query):
+    """
+    Send the query again, with the same id, each time query.timeout passes
+    without an answer, until query.tries have been sent.
+    :return: the DnsResult of one query
+    """
+    loop = asyncio.get_event_loop()
+    query_id = random.randint(0, 0xffff)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    answered = loop.create_future()
+
+    def read_response():
+        try:
+            data, source = sock.recvfrom(MAX_RESPONSE_SIZE)
+        except ConnectionRefusedError:
+            if not answered.done():
+                answered.set_result((UNREACHABLE, 0))
+            return
+        except OSError:
+            return
+        response = parse_response(data)
+        if response and response[0] == query_id and not answered.done():
+            answered.set_result(response[1:])
+
+    start = time.monotonic()
+    try:
+        sock.connect((query.server, query.port))
+        loop.add_reader(sock.fileno(), read_response)
+        packet = create_query(query.name, query.query_type, query_id)
+        for unused in range(max(query.tries, 1)):
+            sock.send(packet)
+            try:
+                rcode, answers = await asyncio.wait_for(asyncio.shield(answered),
+                                                        query.timeout)
+            except asyncio.TimeoutError:
+                continue
+            latency = time.monotonic() - start if rcode != UNREACHABLE else 0.0
+            return DnsResult(query, rcode, answers, latency)
+        return DnsResult(query, TIMED_OUT, 0, 0.0)
+    except OSError:
+        return DnsResult(query, UNREACHABLE, 0, 0.0)
+    finally:
+        loop.remove_reader(sock.fileno())
+        sock.close()
+
+
+def run_queries(queries):
+    """
+    Send all the queries at once and wait for the answers.
+    :param queries: list of DnsQuery
+    :return: list of DnsResult in the order of the queries
+    """
+    if not queries:
+        return []
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(
+            asyncio.gather(*[send_query(q) for q in queries]))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def read_nameservers(filename=RESOLV_CONF_FILENAME):
+    """
+    :return: the nameserver addresses in the order they are used
+    """
+    nameservers = []
+    try:
+        with open(filename, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 1 and fields[0] == "nameserver":
+                    nameservers.append(fields[1])
+    except OSError:
+        pass
+    return nameservers
+
+
+def read_forwarders(filename=BIND_OPTIONS_FILENAME):
+    """
+    :return: the addresses in the forwarders statement of the bind options
+    """
+    try:
+        with open(filename, "r") as f:
+            text = re.sub(r"(//|#).*", "", f.read())
+    except OSError:
+        return []
+    forwarders_match = re.search(r"forwarders\s*\{([^}]*)\}", text)
+    if not forwarders_match:
+        return []
+    return re.findall(r"(\d+\.\d+\.\d+\.\d+)", forwarders_match.group(1))
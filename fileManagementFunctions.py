@@ -1,11 +1,22 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
+import collections
 import os
 import os.path
+import shutil
+import stat
 import subprocess
+import time
 import localFunctions
+import processFunctions
 import hashlib
 
+# An entry of a directory that is being cleaned. size is the disk space in
+# bytes used by the entry and everything in it and newest_mtime the latest
+# modification time in it.
+CleanupEntry = collections.namedtuple(
+    "CleanupEntry", ["path", "uid", "is_dir", "size", "newest_mtime"])
+
 
 def get_media_extensions_by_class():
     filename_extensions_by_class = {
@@ -205,5 +216,162 @@ def convert_copies_to_hardlinks(target_directory, file_extensions="", min_size=4
             matches_found.pop(0)
     return linked_files_list, errors
 
+class DirectoryCleaner:
+    """
+    Find what may be deleted in a directory such as /tmp and delete the
+    oldest first until enough space is free. Each entry is measured in one
+    pass with os.scandir rather than with du.
+    An entry is never deleted if a process has a file in it open or as its
+    working directory, if it holds a socket or if another filesystem is
+    mounted in it.
+    """
+
+    def __init__(self, open_files=None):
+        """
+        :param open_files: set of (device, inode) from
+            processFunctions.read_open_files. It is read if None.
+        """
+        if open_files is None:
+            open_files = processFunctions.read_open_files()
+        self.open_files = open_files
+
+    # ----------------------------------------------------------------------
+    def is_in_use(self, stat_result):
+        return stat.S_ISSOCK(stat_result.st_mode) or \
+            (stat_result.st_dev, stat_result.st_ino) in self.open_files
+
+    # ----------------------------------------------------------------------
+    def measure(self, path, stat_result):
+        """
+        Walk the directory tree once.
+        :param path: a directory
+        :param stat_result: the lstat of the directory
+        :return: (size, newest_mtime, in_use)
+        """
+        size = stat_result.st_blocks * 512
+        newest_mtime = stat_result.st_mtime
+        in_use = self.is_in_use(stat_result)
+        linked_inodes = set()
+        directories = [path]
+        while directories and not in_use:
+            try:
+                for entry in os.scandir(directories.pop()):
+                    try:
+                        entry_stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if entry_stat.st_dev != stat_result.st_dev or \
+                            self.is_in_use(entry_stat):
+                        in_use = True
+                        break
+                    if entry_stat.st_nlink > 1 and not stat.S_ISDIR(entry_stat.st_mode):
+                        if entry_stat.st_ino in linked_inodes:
+                            continue
+                        linked_inodes.add(entry_stat.st_ino)
+                    size += entry_stat.st_blocks * 512
+                    newest_mtime = max(newest_mtime, entry_stat.st_mtime)
+                    if stat.S_ISDIR(entry_stat.st_mode):
+                        directories.append(entry.path)
+            except OSError:
+                pass
+        return size, newest_mtime, in_use
+
+    # ----------------------------------------------------------------------
+    def scan(self, directory):
+        """
+        :param directory:
+        :return: list of CleanupEntry for the files and directories directly
+            in the directory that are not in use. Sockets, pipes and devices
+            are left out.
+        """
+        entries = []
+        try:
+            directory_device = os.lstat(directory).st_dev
+            for entry in os.scandir(directory):
+                try:
+                    entry_stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if entry_stat.st_dev != directory_device or self.is_in_use(entry_stat):
+                    continue
+                if stat.S_ISDIR(entry_stat.st_mode):
+                    size, newest_mtime, in_use = self.measure(entry.path, entry_stat)
+                    if not in_use:
+                        entries.append(CleanupEntry(entry.path, entry_stat.st_uid, True,
+                                                    size, newest_mtime))
+                elif stat.S_ISREG(entry_stat.st_mode) or stat.S_ISLNK(entry_stat.st_mode):
+                    entries.append(CleanupEntry(entry.path, entry_stat.st_uid, False,
+                                                entry_stat.st_blocks * 512,
+                                                entry_stat.st_mtime))
+        except OSError:
+            pass
+        return entries
+
+    # ----------------------------------------------------------------------
+    def find_files(self, directory, name_filter):
+        """
+        :param directory:
+        :param name_filter: function of the file name that returns True for
+            the files wanted
+        :return: list of CleanupEntry for the regular files anywhere in the
+            directory that are wanted and not open
+        """
+        entries = []
+        try:
+            directory_device = os.lstat(directory).st_dev
+        except OSError:
+            return entries
+        directories = [directory]
+        while directories:
+            try:
+                for entry in os.scandir(directories.pop()):
+                    try:
+                        entry_stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if entry_stat.st_dev != directory_device:
+                        continue
+                    if stat.S_ISDIR(entry_stat.st_mode):
+                        directories.append(entry.path)
+                    elif stat.S_ISREG(entry_stat.st_mode) and name_filter(entry.name) \
+                            and not self.is_in_use(entry_stat):
+                        entries.append(CleanupEntry(entry.path, entry_stat.st_uid, False,
+                                                    entry_stat.st_blocks * 512,
+                                                    entry_stat.st_mtime))
+            except OSError:
+                pass
+        return entries
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def remove(entries, bytes_needed=None, logger=None):
+        """
+        Delete the entries, oldest first.
+        :param entries: list of CleanupEntry
+        :param bytes_needed: stop when this much has been freed. None to
+            delete all of the entries.
+        :param logger: a logger for the names of the deleted entries
+        :return: bytes freed
+        """
+        bytes_freed = 0
+        for entry in sorted(entries, key=lambda e: e.newest_mtime):
+            if bytes_needed is not None and bytes_freed >= bytes_needed:
+                break
+            try:
+                if entry.is_dir:
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+                bytes_freed += entry.size
+                if logger:
+                    logger.info("Removed %s (%s, last changed %s)"
+                                % (entry.path,
+                                   localFunctions.convert_to_readable(entry.size // 1024, True),
+                                   time.ctime(entry.newest_mtime)))
+            except OSError:
+                pass
+        return bytes_freed
+
+
 def hash_filename(filename, size):
     return hashlib.sha256(str.encode(filename)).hexdigest() + str(size)
@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Measure the quality of the internet connection with pings sent from this
+process rather than a fixed number of pings with the ping command.
+
+The pings are sent in batches. Sampling stops as soon as the confidence
+interval of the packet loss (a Wilson score interval) is narrow enough or
+lies within one quality grade, and the round trip times are steady. A clean
+link is therefore measured quickly and a link with occasional loss gets a
+larger sample, up to MAX_SAMPLES pings.
+
+Each measurement is appended to a history file so that the report can show
+how the connection has been over the last week.
+"""
+
+import collections
+import json
+import math
+import os
+import os.path
+import random
+import select
+import struct
+import time
+import networkFunctions
+
+HISTORY_FILENAME = "/var/log/systemCheck/internetQuality.jsonl"
+# measurements older than this are dropped when the history is rewritten
+MAX_HISTORY_AGE = 30 * 24 * 3600
+MAX_HISTORY_SIZE = 2 ** 20
+TREND_DAYS = 7
+MIN_SAMPLES = 20
+BATCH_SIZE = 5
+MAX_SAMPLES = 200
+# seconds to wait for a reply. Round trips over a second are normal on
+# satellite and busy 3G links so this is much longer than the LAN
+# networkFunctions.PROBE_TIMEOUT.
+WAN_REPLY_TIMEOUT = 4.0
+# no batch is started after this many seconds of sampling, as each batch
+# with a lost ping waits the full reply timeout
+MAX_SAMPLING_TIME = 60.0
+# z for a 90% confidence interval
+CONFIDENCE_Z = 1.645
+# sampling stops when the loss interval is narrower than this, in percent
+MAX_LOSS_INTERVAL_WIDTH = 10.0
+# and the standard error of the mean round trip time is less than this
+# fraction of the mean
+MAX_RTT_RELATIVE_ERROR = 0.1
+# loss percent below which each grade is given, best first
+QUALITY_GRADES = ((5.0, "Good"), (9.0, "Fair"), (19.0, "Poor"))
+WORST_QUALITY = "Very Poor / Unusable"
+
+
+class PingSampler:
+    """
+    Send ICMP echo requests to one address at a fixed interval and time the
+    replies. A reply that takes longer than the timeout counts as lost.
+    """
+
+    def __init__(self, address, interval=0.2, payload_size=64,
+                 timeout=WAN_REPLY_TIMEOUT):
+        self.address = address
+        self.interval = interval
+        self.payload = b"\0" * payload_size
+        self.timeout = timeout
+        self.identifier = random.randint(0, 0xffff)
+        self.sequence = 0
+
+    # ----------------------------------------------------------------------
+    def create_packet(self, sequence):
+        header = struct.pack("!BBHHH", networkFunctions.ICMP_ECHO_REQUEST, 0, 0,
+                             self.identifier, sequence)
+        checksum = networkFunctions.icmp_checksum(header + self.payload)
+        return struct.pack("!BBHHH", networkFunctions.ICMP_ECHO_REQUEST, 0, checksum,
+                           self.identifier, sequence) + self.payload
+
+    # ----------------------------------------------------------------------
+    def read_reply(self, sock, raw):
+        """
+        :return: the sequence number of the echo reply or None
+        """
+        try:
+            data, source = sock.recvfrom(2048)
+        except OSError:
+            return None
+        if raw:
+            data = data[(data[0] & 0x0f) * 4:]
+        if source[0] != self.address or len(data) < 8:
+            return None
+        icmp_type, code, checksum, identifier, sequence = struct.unpack("!BBHHH", data[:8])
+        # the kernel replaces the identifier of a datagram socket
+        if icmp_type != networkFunctions.ICMP_ECHO_REPLY or \
+                (raw and identifier != self.identifier):
+            return None
+        return sequence
+
+    # ----------------------------------------------------------------------
+    def sample(self, count):
+        """
+        Send count pings and wait for the replies.
+        :return: list of the round trip times in seconds, None for each
+            lost ping, in the order sent
+        """
+        sock, raw = networkFunctions.IcmpProber.open_socket()
+        sent_times = collections.OrderedDict()
+        round_trips = {}
+        try:
+            next_send = time.monotonic()
+            deadline = None
+            while True:
+                now = time.monotonic()
+                if len(sent_times) < count and now >= next_send:
+                    sequence = self.sequence & 0xffff
+                    self.sequence += 1
+                    sent_times[sequence] = now
+                    try:
+                        sock.sendto(self.create_packet(sequence), (self.address, 0))
+                    except OSError:
+                        pass
+                    next_send += self.interval
+                    if len(sent_times) == count:
+                        deadline = now + self.timeout
+                    continue
+                if deadline and (now >= deadline or len(round_trips) == count):
+                    break
+                wait_until = deadline if deadline else next_send
+                readable = select.select([sock], [], [], max(wait_until - now, 0.0))[0]
+                if readable:
+                    sequence = self.read_reply(sock, raw)
+                    if sequence in sent_times and sequence not in round_trips:
+                        round_trip = time.monotonic() - sent_times[sequence]
+                        if round_trip <= self.timeout:
+                            round_trips[sequence] = round_trip
+        finally:
+            sock.close()
+        return [round_trips.get(sequence) for sequence in sent_times]
+
+
+def wilson_interval(lost, total, z=CONFIDENCE_Z):
+    """
+    :return: (low, high) of the loss fraction
+    """
+    if not total:
+        return 0.0, 1.0
+    fraction = lost / total
+    denominator = 1 + z * z / total
+    center = (fraction + z * z / (2 * total)) / denominator
+    spread = z * math.sqrt(fraction * (1 - fraction) / total +
+                           z * z / (4 * total * total)) / denominator
+    return max(center - spread, 0.0), min(center + spread, 1.0)
+
+
+def grade_loss(loss_percent):
+    if loss_percent == 0:
+        return "Excellent"
+    for limit, grade in QUALITY_GRADES:
+        if loss_percent < limit:
+            return grade
+    return WORST_QUALITY
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(int(math.ceil(percent / 100.0 * len(sorted_values))) - 1,
+                len(sorted_values) - 1)
+    return sorted_values[max(index, 0)]
+
+
+def is_decided(round_trips):
+    """
+    :param round_trips: the samples so far
+    :return: True if more samples would not change the result much
+    """
+    lost = round_trips.count(None)
+    low, high = wilson_interval(lost, len(round_trips))
+    # Excellent and Good are not told apart here: that needs many samples
+    # for little gain
+    same_grade = grade_loss(max(low * 100, 0.1)) == grade_loss(max(high * 100, 0.1))
+    if not (same_grade or (high - low) * 100 <= MAX_LOSS_INTERVAL_WIDTH):
+        return False
+    answered = [r for r in round_trips if r is not None]
+    if len(answered) < 5:
+        return True
+    mean = sum(answered) / len(answered)
+    deviation = math.sqrt(sum([(r - mean) ** 2 for r in answered]) / (len(answered) - 1))
+    return deviation / math.sqrt(len(answered)) <= MAX_RTT_RELATIVE_ERROR * mean
+
+
+def summarize(host, round_trips, duration):
+    """
+    :return: dictionary of the measurement, as kept in the history. Times
+        are in milliseconds.
+    """
+    lost = round_trips.count(None)
+    sent = len(round_trips)
+    answered = [r * 1000.0 for r in round_trips if r is not None]
+    low, high = wilson_interval(lost, sent)
+    loss_percent = 100.0 * lost / sent if sent else 100.0
+    # the mean difference between consecutive answered pings
+    jitter = 0.0
+    if len(answered) > 1:
+        jitter = sum([abs(b - a) for a, b in zip(answered, answered[1:])]) / \
+            (len(answered) - 1)
+    ordered = sorted(answered)
+    return {"time": round(time.time(), 1), "host": host, "sent": sent, "lost": lost,
+            "loss_percent": round(loss_percent, 1),
+            "loss_low": round(low * 100, 1), "loss_high": round(high * 100, 1),
+            "rtt_p50": round(percentile(ordered, 50), 1),
+            "rtt_p90": round(percentile(ordered, 90), 1),
+            "rtt_p99": round(percentile(ordered, 99), 1),
+            "jitter": round(jitter, 1), "quality": grade_loss(loss_percent),
+            "duration": round(duration, 1)}
+
+
+def measure_quality(sampler, min_samples=MIN_SAMPLES, batch_size=BATCH_SIZE,
+                    max_samples=MAX_SAMPLES, max_time=MAX_SAMPLING_TIME):
+    """
+    Ping until the result is decided, max_samples pings have been sent or
+    max_time seconds have passed.
+    :param sampler: PingSampler or an object with a sample(count) method
+    :return: the summary dictionary
+    """
+    start = time.monotonic()
+    round_trips = sampler.sample(min_samples)
+    while len(round_trips) < max_samples and not is_decided(round_trips) and \
+            time.monotonic() - start < max_time:
+        round_trips.extend(sampler.sample(min(batch_size, max_samples - len(round_trips))))
+    return summarize(sampler.address, round_trips, time.monotonic() - start)
+
+
+def read_history(history_filename=HISTORY_FILENAME):
+    history = []
+    try:
+        with open(history_filename, "r") as f:
+            for line in f:
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    pass
+    except OSError:
+        pass
+    return history
+
+
+def append_history(measurement, history_filename=HISTORY_FILENAME):
+    """
+    Add the measurement. Old measurements are dropped when the file grows
+    larger than MAX_HISTORY_SIZE.
+    """
+    try:
+        os.makedirs(os.path.dirname(history_filename), 0o755, exist_ok=True)
+        if os.path.exists(history_filename) and \
+                os.path.getsize(history_filename) > MAX_HISTORY_SIZE:
+            history = read_history(history_filename)
+            oldest = time.time() - MAX_HISTORY_AGE
+            recent = [m for m in history if m.get("time", 0) > oldest]
+            if len(recent) == len(history):
+                recent = recent[len(recent) // 2:]
+            with open(history_filename, "w") as f:
+                for entry in recent:
+                    f.write(json.dumps(entry) + "\n")
+        with open(history_filename, "a") as f:
+            f.write(json.dumps(measurement) + "\n")
+    except OSError:
+        pass
+
+
+def format_trend(history, now=None, days=TREND_DAYS, html=False):
+    """
+    Summarize the measurements of each of the last days.
+    :param html: return an html table for the GUI, which does not keep
+        the columns of plain text
+    :return: the text, empty if there are fewer than two measurements
+    """
+    now = now or time.time()
+    by_day = collections.OrderedDict()
+    for measurement in sorted(history, key=lambda m: m.get("time", 0)):
+        if now - measurement.get("time", 0) > days * 24 * 3600:
+            continue
+        day = time.strftime("%a %d %b", time.localtime(measurement["time"]))
+        by_day.setdefault(day, []).append(measurement)
+    if sum([len(m) for m in by_day.values()]) < 2:
+        return ""
+    header = ("Day", "Tests", "Loss %", "Worst %", "Median ms", "Jitter ms")
+    rows = []
+    for day, measurements in by_day.items():
+        round_trips = sorted([m["rtt_p50"] for m in measurements])
+        jitters = sorted([m["jitter"] for m in measurements])
+        rows.append((day, len(measurements),
+                     sum([m["loss_percent"] for m in measurements]) / len(measurements),
+                     max([m["loss_percent"] for m in measurements]),
+                     percentile(round_trips, 50), percentile(jitters, 50)))
+    if html:
+        text = "<table><tr>%s</tr>\n" % "".join(["<th>%s</th>" % h for h in header])
+        for row in rows:
+            text += "<tr><td>%s</td><td>%d</td><td>%.1f</td><td>%.1f</td>" \
+                    "<td>%.0f</td><td>%.0f</td></tr>\n" % row
+        return text + "</table>"
+    lines = ["%-11s %5s %8s %8s %9s %8s" % header]
+    for row in rows:
+        lines.append("%-11s %5d %8.1f %8.1f %9.0f %8.0f" % row)
+    return "\n".join(lines)
@@ -5,21 +5,28 @@ This file contains shared functions for several local applications.
 """
 
 import argparse
+import collections
 import errno
 import getpass
 import logging
 import os
 import re
+import stat
 import subprocess
 import sys
 import string
+import threading
 import time
 import traceback
 import pwd
+import processFunctions
 
 PROGRAM_VERSION = "1.8"
 REPORTED_ERRORS = []
 TestTimerStart = 0.0
+# the number of commands started by run_command and command_run_successful
+# in each thread, read by checkTiming
+CommandCounts = threading.local()
 
 UUIDS = {"primary_root": "5790d9ca-1394-4a22-9c70-ab58249f78ed",
          "primary_root_copy": "6c05c773-4b66-4bd5-ab66-fa31ac9e89ff",
@@ -54,6 +61,7 @@ def run_command(command, reraise_error=False, result_as_list=True,
     If the command fails then the exception subprocess.CalledProcessError.
     This should be handled by the caller.
     """
+    count_command()
     try:
         if no_stderr:
             output = subprocess.check_output(command, shell=True,
@@ -82,12 +90,26 @@ def run_command(command, reraise_error=False, result_as_list=True,
     return result
 
 
+# ----------------------------------------------------------------------
+def count_command():
+    CommandCounts.started = get_command_count() + 1
+
+
+# ----------------------------------------------------------------------
+def get_command_count():
+    """
+    :return: the number of commands started so far in this thread
+    """
+    return getattr(CommandCounts, "started", 0)
+
+
 # ----------------------------------------------------------------------
 def command_run_successful(command):
     """
     Run a single command and test for correct completion
     """
     result = True
+    count_command()
     try:
         subprocess.check_output(command, shell=True,
                                 universal_newlines=True,
@@ -195,18 +217,17 @@ def sort_nicely(target_list, return_copy=False):
         return target_list.sort(key=alphanum_key)
 
 
-def get_all_active_users_by_class():
+def get_all_active_users_by_class(snapshot=None):
     """
     This will return a list of usernames that have running processes -- ie.
     logged in users and system processes
+    :param snapshot: processFunctions.ProcessSnapshot to use or None to take one
     :return: a dictionary of 3 lists: "normal users", "system users" and
         "all users"
     """
-    ps_list = run_command('ps -eo user:40,gid --no-headers')
-    ps_split_list = [n.split() for n in set(ps_list)]
-    normal_users = [n[0] for n in ps_split_list if int(n[1]) > 999
-                    and n[0] != "root"]
-    system_users = [n[0] for n in ps_split_list if int(n[1]) < 10000]
+    user_gids = set([(p.user, p.gid) for p in snapshot or processFunctions.ProcessSnapshot()])
+    normal_users = [n[0] for n in user_gids if n[1] > 999 and n[0] != "root"]
+    system_users = [n[0] for n in user_gids if n[1] < 10000]
     all_users = normal_users + system_users
     return {"all users": all_users, "normal users": normal_users,
             "system users": system_users}
@@ -591,17 +612,130 @@ def create_timestamped_logger(logger_name, log_file_name, level = logging.INFO):
     return logger
 
 
-def get_filesystem_space_used(mount_name):
-    command = '/bin/df "%s"' %mount_name
-    kb_used = 0
+# Filesystem space read directly with statvfs rather than from df. All sizes
+# are in KB like df. percent_used is rounded up as df does.
+FilesystemSpace = collections.namedtuple(
+    "FilesystemSpace", ["mount_point", "device", "fs_type", "total", "used",
+                        "available", "free", "inodes_total", "inodes_used",
+                        "inodes_free", "percent_used"])
+MountInfo = collections.namedtuple("MountInfo", ["mount_point", "fs_type", "device"])
+# seconds that a space value is reused
+SPACE_CACHE_TTL = 2.0
+# never statvfs these from the mount list: a dead server would hang the call
+NETWORK_FS_TYPES = ("nfs", "nfs4", "cifs", "smb3", "fuse.sshfs", "ltspfs", "fuse.ltspfs")
+_SpaceCache = {}
+_SpaceCacheLock = threading.Lock()
+
+
+def unescape_mount_field(field):
+    """
+    Spaces, tabs, newlines and backslashes are octal escaped in mountinfo
+    """
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def get_mounts(mountinfo_filename="/proc/self/mountinfo"):
+    """
+    Read the mount list from the kernel.
+    :return: list of MountInfo in mount order
+    """
+    mounts = []
     try:
-        df_data = run_command(command, reraise_error=True, result_as_list=True,
-                              merge_stderr=False)
-        columns = df_data[1].split()
-        kb_used = int(columns[2])
-    except (subprocess.CalledProcessError, ValueError, IndexError, TypeError):
+        with open(mountinfo_filename, "r") as f:
+            for line in f:
+                # fields after the " - " separator are: type source options
+                try:
+                    before, after = line.split(" - ", 1)
+                    mount_point = unescape_mount_field(before.split()[4])
+                    fs_type, device = after.split()[:2]
+                    mounts.append(MountInfo(mount_point, fs_type,
+                                            unescape_mount_field(device)))
+                except (ValueError, IndexError):
+                    pass
+    except OSError:
         pass
-    return kb_used
+    return mounts
+
+
+def find_mount(path, mounts=None):
+    """
+    :return: the MountInfo of the filesystem holding path or None
+    """
+    if mounts is None:
+        mounts = get_mounts()
+    best = None
+    path = os.path.realpath(path)
+    for mount in mounts:
+        prefix = mount.mount_point.rstrip("/") + "/"
+        if (path == mount.mount_point or (path + "/").startswith(prefix)) and \
+                (best is None or len(mount.mount_point) >= len(best.mount_point)):
+            best = mount
+    return best
+
+
+def get_filesystem_space(path, max_age=SPACE_CACHE_TTL, mount=None):
+    """
+    Read the size and use of the filesystem holding path. A value read less
+    than max_age seconds ago is reused. Use max_age=0 to measure the effect of
+    a cleanup.
+    :param path:
+    :param max_age:
+    :param mount: the MountInfo for path if already known
+    :return: FilesystemSpace or None if it cannot be read
+    """
+    now = time.time()
+    with _SpaceCacheLock:
+        cached = _SpaceCache.get(path)
+    if cached and now - cached[0] < max_age:
+        return cached[1]
+    try:
+        fs_stats = os.statvfs(path)
+    except OSError:
+        return None
+    if mount is None:
+        mount = find_mount(path) or MountInfo(path, "", "")
+    block_kb = fs_stats.f_frsize / 1024.0
+    total = int(fs_stats.f_blocks * block_kb)
+    free = int(fs_stats.f_bfree * block_kb)
+    available = int(fs_stats.f_bavail * block_kb)
+    used = total - free
+    percent_used = 0
+    if used + available > 0:
+        percent_used = -(-used * 100 // (used + available))
+    space = FilesystemSpace(mount.mount_point, mount.device, mount.fs_type,
+                            total, used, available, free, fs_stats.f_files,
+                            fs_stats.f_files - fs_stats.f_ffree, fs_stats.f_ffree,
+                            percent_used)
+    with _SpaceCacheLock:
+        _SpaceCache[path] = (now, space)
+    return space
+
+
+def get_all_filesystem_space(fs_types=("ext4",), max_age=SPACE_CACHE_TTL):
+    """
+    Read the space for every mounted filesystem of the given types.
+    Network filesystems are never included.
+    :param fs_types: the filesystem types, or None for all local types
+    :param max_age:
+    :return: dictionary of mount point:FilesystemSpace
+    """
+    result = {}
+    for mount in get_mounts():
+        if mount.fs_type in NETWORK_FS_TYPES or \
+                (fs_types and mount.fs_type not in fs_types):
+            continue
+        space = get_filesystem_space(mount.mount_point, max_age, mount)
+        if space and space.total:
+            result[mount.mount_point] = space
+    return result
+
+
+def get_filesystem_space_used(mount_name):
+    """
+    :return: KB used in the filesystem holding mount_name, 0 if unreadable
+    """
+    space = get_filesystem_space(mount_name, max_age=0)
+    return space.used if space else 0
 
 
 def change_in_filesystem_size(mount_name, initial_size, size_now = 0):
@@ -618,15 +752,94 @@ def change_in_filesystem_size(mount_name, initial_size, size_now = 0):
     return change_text, delta
 
 
-def get_directory_size(directory):
-    try:
-        command = "du -s --one-file-system %s" % directory
-        du_result = run_command(command, reraise_error=True, result_as_list=False,
-                                merge_stderr=False)
-        kb_size = du_result.split()[0]
-        return int(kb_size)
-    except (subprocess.CalledProcessError, ValueError):
-        return 0
+class DirectorySizer:
+    """
+    The disk space used by directory trees as "du -s --one-file-system"
+    reports it, without running du. A file with several hard links is
+    counted once. The total of each directory measured is kept so that
+    measuring it again, or a directory that holds it, does not walk it
+    again. Call forget after files have been deleted.
+    """
+
+    def __init__(self):
+        # directory: (bytes, {(device, inode): bytes} of the hard linked files)
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    # ----------------------------------------------------------------------
+    def get_size(self, directory, limit=0):
+        """
+        :param directory:
+        :param limit: stop as soon as the size is more than this many bytes.
+            The size returned is then only known to be more than the limit.
+        :return: bytes used
+        """
+        directory = os.path.abspath(directory)
+        with self.lock:
+            if directory in self.totals:
+                return self.totals[directory][0]
+        try:
+            top_stat = os.lstat(directory)
+        except OSError:
+            return 0
+        total = top_stat.st_blocks * 512
+        linked = {}
+        directories = [directory]
+        while directories:
+            try:
+                for entry in os.scandir(directories.pop()):
+                    try:
+                        entry_stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if entry_stat.st_dev != top_stat.st_dev:
+                        continue
+                    if stat.S_ISDIR(entry_stat.st_mode):
+                        with self.lock:
+                            known = self.totals.get(entry.path)
+                        if known:
+                            known_total, known_linked = known
+                            total += known_total - sum(
+                                [size for key, size in known_linked.items() if key in linked])
+                            linked.update(known_linked)
+                            continue
+                        directories.append(entry.path)
+                    elif entry_stat.st_nlink > 1:
+                        key = (entry_stat.st_dev, entry_stat.st_ino)
+                        if key in linked:
+                            continue
+                        linked[key] = entry_stat.st_blocks * 512
+                    total += entry_stat.st_blocks * 512
+                    if limit and total > limit:
+                        return total
+            except OSError:
+                pass
+        with self.lock:
+            self.totals[directory] = (total, linked)
+        return total
+
+    # ----------------------------------------------------------------------
+    def forget(self, path):
+        """
+        Drop the totals that include the path or are inside it.
+        """
+        path = os.path.abspath(path).rstrip("/") + "/"
+        with self.lock:
+            for directory in list(self.totals.keys()):
+                directory_path = directory.rstrip("/") + "/"
+                if directory_path.startswith(path) or path.startswith(directory_path):
+                    del self.totals[directory]
+
+
+def get_directory_size(directory, sizer=None):
+    """
+    :param directory:
+    :param sizer: a DirectorySizer that keeps the totals for a run
+    :return: KB used by the directory and everything in it
+    """
+    if not sizer:
+        sizer = DirectorySizer()
+    return sizer.get_size(directory) // 1024
 
 
 def convert_users_to_uids(user_name_list):
@@ -750,3 +963,69 @@ def temp_mount_primary_partitions(temp_partition_mount_dirs):
             pass
     return temp_mounted_dirs
 
+
+
+# State of systemd units read for all units with one "systemctl show".
+# seconds_in_state is the time since the last change of ActiveState.
+UnitStatus = collections.namedtuple(
+    "UnitStatus", ["name", "unit_id", "load_state", "active_state", "sub_state",
+                   "restarts", "seconds_in_state"])
+UNIT_STATUS_PROPERTIES = ("Id", "LoadState", "ActiveState", "SubState", "NRestarts",
+                          "StateChangeTimestampMonotonic")
+# a unit restarted this many times by systemd ...
+FLAPPING_RESTART_COUNT = 3
+# ... and last changing state less than this many seconds ago is flapping
+FLAPPING_WINDOW = 3600
+
+
+def get_units_status(unit_names):
+    """
+    Read the state of every unit with a single systemctl call. systemctl
+    writes one block of properties per unit in the order of the names.
+    NRestarts is not available before systemd 235 and is then 0.
+    :param unit_names: list of unit names
+    :return: dictionary of unit name:UnitStatus. A unit that could not be
+        read is missing.
+    """
+    units_status = {}
+    if not unit_names:
+        return units_status
+    command = "systemctl show --no-pager -p %s %s" % (",".join(UNIT_STATUS_PROPERTIES),
+                                                      " ".join(unit_names))
+    try:
+        output = run_command(command, reraise_error=True, result_as_list=False,
+                             merge_stderr=False)
+    except subprocess.CalledProcessError:
+        return units_status
+    now = time.clock_gettime(time.CLOCK_MONOTONIC)
+    blocks = output.strip("\n").split("\n\n")
+    for unit_name, block in zip(unit_names, blocks):
+        values = dict([line.split("=", 1) for line in block.splitlines() if "=" in line])
+        try:
+            restarts = int(values.get("NRestarts") or 0)
+            state_change = int(values.get("StateChangeTimestampMonotonic") or 0)
+        except ValueError:
+            restarts = 0
+            state_change = 0
+        seconds_in_state = now - state_change / 1.0e6 if state_change else None
+        units_status[unit_name] = UnitStatus(unit_name, values.get("Id", unit_name),
+                                             values.get("LoadState", ""),
+                                             values.get("ActiveState", ""),
+                                             values.get("SubState", ""),
+                                             restarts, seconds_in_state)
+    return units_status
+
+
+def unit_is_flapping(unit_status):
+    """
+    A unit in a crash loop is often reported as active by "systemctl is-active"
+    because systemd restarts it each time.
+    :param unit_status: UnitStatus
+    :return: True if systemd is waiting to restart the unit or has restarted it
+        several times and it changed state recently
+    """
+    if unit_status.sub_state == "auto-restart":
+        return True
+    return (unit_status.restarts >= FLAPPING_RESTART_COUNT and
+            unit_status.seconds_in_state is not None and
+            unit_status.seconds_in_state < FLAPPING_WINDOW)
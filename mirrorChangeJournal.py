@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Watch the source directories of the mirror tasks with inotify and record
+the paths of changed files in a journal for each task. backupAllFilesystems
+then gives rsync only these paths with --files-from instead of making it
+stat every file in the tree.
+
+Only the tasks in the mirror configuration file that have
+"use_change_journal = yes" are watched. Whenever events may have been lost
+(inotify queue overflow, too many directories for the inotify watch limit,
+a path that cannot be written in the journal, an unmounted source) the
+overflow time is recorded and the next mirror makes a full walk. A
+directory that could not be watched is not covered by the journal at all,
+so then the journal is not used until a restart of the daemon has watched
+every directory. See mirrorFunctions.journal_usable for all of the
+conditions.
+"""
+
+import configparser
+import ctypes
+import errno
+import os
+import os.path
+import select
+import struct
+import time
+import localFunctions
+import backgroundFunctions
+import mirrorFunctions
+
+PROGRAM_NAME = "mirrorChangeJournal"
+PROGRAM_DESCRIPTION = "Record changed files in the mirror source directories"
+PROGRAM_VERSION = "1.0"
+ERROR_LOGFILE = "/var/log/mirror/changeJournalError.log"
+INFO_LOGFILE = "/var/log/mirror/changeJournalInfo.log"
+CONFIG_FILE = "/usr/local/etc/mirror/mirror.cfg"
+JOB_NAME = "DailyJobs"
+InfoLogger = None
+ErrorLogger = None
+# seconds between writes of the collected paths to the journal files
+FLUSH_INTERVAL = 10
+# a journal larger than this is no faster than a full walk
+MAX_JOURNAL_SIZE = 200 * 2 ** 20
+# seconds between watchdog notifications while a tree is being watched
+WATCHDOG_INTERVAL = 10
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+             IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | \
+             IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class TaskJournal:
+    """
+    The changed paths for one mirror task.
+    """
+
+    def __init__(self, task_name, source_dir):
+        self.task_name = task_name
+        self.source_dir = source_dir.rstrip("/") or "/"
+        self.journal_filename = mirrorFunctions.get_journal_filename(task_name,
+                                                                     ".journal")
+        self.meta_filename = mirrorFunctions.get_journal_filename(task_name,
+                                                                  ".meta.json")
+        self.pending = set()
+        self.meta = {"task": task_name, "source_dir": self.source_dir,
+                     "boot_id": mirrorFunctions.get_boot_id(), "pid": os.getpid(),
+                     "started": time.time(), "overflow_time": 0,
+                     "watch_incomplete": True}
+        self.watch_failed = False
+
+    def write_meta(self):
+        try:
+            mirrorFunctions.write_json_file(self.meta_filename, self.meta)
+        except OSError as err:
+            ErrorLogger.error("Failed to write %s: %s" % (self.meta_filename, err))
+
+    def add_path(self, relative_path):
+        if "\n" in relative_path:
+            # cannot be written as a line in the journal
+            self.mark_overflow("unusable file name")
+        else:
+            self.pending.add(relative_path)
+
+    def mark_overflow(self, reason):
+        """
+        Events were lost so the next mirror must walk the whole tree.
+        """
+        if InfoLogger:
+            InfoLogger.info("%s: events lost (%s). Next mirror will be a full walk"
+                            % (self.task_name, reason))
+        self.meta["overflow_time"] = time.time()
+        self.pending.clear()
+        self.write_meta()
+
+    def mark_watch_failed(self, reason):
+        """
+        A directory is not watched so its changes would never be in the
+        journal. The journal stays unusable until the daemon is restarted.
+        """
+        self.watch_failed = True
+        self.meta["watch_incomplete"] = True
+        self.mark_overflow(reason)
+
+    def mark_watch_complete(self):
+        """
+        The first scan of the tree is finished. The journal covers the whole
+        tree if no directory failed to be watched.
+        """
+        self.meta["watch_incomplete"] = self.watch_failed
+        self.write_meta()
+
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            with mirrorFunctions.open_locked_journal(self.journal_filename) as f:
+                f.writelines([p + "\n" for p in self.pending])
+                f.flush()
+                too_large = os.fstat(f.fileno()).st_size > MAX_JOURNAL_SIZE
+                if too_large:
+                    os.remove(self.journal_filename)
+            self.pending.clear()
+            if too_large:
+                self.mark_overflow("journal too large")
+        except OSError as err:
+            self.mark_overflow("journal write failed: %s" % err)
+
+
+class InotifyWatcher:
+    """
+    A single inotify instance with a watch on every directory of every
+    watched tree. Like rsync -x the watches do not cross filesystem
+    boundaries.
+    """
+
+    def __init__(self, systemd_connector=None):
+        self.systemd_connector = systemd_connector
+        self.last_watchdog_time = time.time()
+        self.libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor: (TaskJournal, directory path relative to the source)
+        self.watches = {}
+        self.root_watches = set()
+
+    def add_watch(self, journal, relative_dir):
+        full_path = os.path.join(journal.source_dir, relative_dir)
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(full_path), WATCH_MASK)
+        if wd < 0:
+            error_number = ctypes.get_errno()
+            if error_number == errno.ENOSPC:
+                journal.mark_watch_failed("inotify watch limit reached")
+            elif error_number not in (errno.ENOENT, errno.ENOTDIR):
+                journal.mark_watch_failed("cannot watch %s: %s"
+                                          % (full_path, os.strerror(error_number)))
+            return -1
+        self.watches[wd] = (journal, relative_dir)
+        return wd
+
+    def add_tree(self, journal, relative_dir=""):
+        """
+        Watch a directory and everything below it on the same filesystem.
+        """
+        top = os.path.normpath(os.path.join(journal.source_dir, relative_dir))
+        try:
+            device = os.lstat(journal.source_dir).st_dev
+        except OSError:
+            journal.mark_watch_failed("source %s not found" % journal.source_dir)
+            return
+        for dirpath, dirnames, filenames in os.walk(top):
+            self.update_watchdog()
+            dirnames[:] = [d for d in dirnames
+                           if self.same_device(os.path.join(dirpath, d), device)]
+            wd = self.add_watch(journal, os.path.relpath(dirpath, journal.source_dir)
+                                if dirpath != journal.source_dir else "")
+            if wd < 0 and dirpath == top:
+                return
+            if dirpath == journal.source_dir:
+                self.root_watches.add(wd)
+
+    def update_watchdog(self):
+        """
+        Scanning a large tree can take longer than the systemd watchdog
+        time so it is notified during the scan too.
+        """
+        if self.systemd_connector and \
+                time.time() - self.last_watchdog_time >= WATCHDOG_INTERVAL:
+            self.systemd_connector.update_watchdog()
+            self.last_watchdog_time = time.time()
+
+    @staticmethod
+    def same_device(path, device):
+        try:
+            return os.lstat(path).st_dev == device
+        except OSError:
+            return False
+
+    def remove_tree_watches(self, journal, relative_dir):
+        """
+        A directory was moved away. Its watches would report the old path
+        so remove them. If it was moved within the tree it is added again
+        with the IN_MOVED_TO event.
+        """
+        prefix = relative_dir + "/"
+        for wd, (watch_journal, watch_dir) in list(self.watches.items()):
+            if watch_journal is journal and \
+                    (watch_dir == relative_dir or watch_dir.startswith(prefix)):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def process_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            for journal in set([j for j, d in self.watches.values()]):
+                journal.mark_overflow("inotify queue overflow")
+            return
+        if wd not in self.watches:
+            return
+        journal, relative_dir = self.watches[wd]
+        if mask & (IN_IGNORED | IN_UNMOUNT | IN_DELETE_SELF | IN_MOVE_SELF):
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+            if wd in self.root_watches:
+                self.root_watches.discard(wd)
+                journal.mark_watch_failed("source directory removed or unmounted")
+            return
+        relative_path = os.path.join(relative_dir, name) if relative_dir else name
+        if mask & IN_ISDIR:
+            if mask & IN_MOVED_FROM:
+                self.remove_tree_watches(journal, relative_path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(journal, relative_path)
+            elif mask & IN_ATTRIB:
+                # a listed directory is copied recursively so a directory
+                # permission change is left for the weekly full walk
+                return
+        journal.add_path(relative_path)
+
+    def read_events(self, timeout):
+        """
+        Wait up to timeout seconds for events and process them all.
+        """
+        readable, unused, unused = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        buffer = os.read(self.fd, 65536)
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, cookie, name_length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            self.process_event(wd, mask, name)
+
+
+def read_watched_tasks(config_filename, jobname):
+    """
+    :return: dictionary of task name:source directory for tasks that use
+        the change journal and have a local source
+    """
+    tasks = {}
+    config = configparser.ConfigParser()
+    config.read(config_filename)
+    if not config.has_section(jobname):
+        return tasks
+    for taskname in config.get(jobname, "mirror_list").splitlines():
+        if config.has_section(taskname) and \
+                config.getboolean(taskname, "use_change_journal", fallback=False):
+            source_dir = config.get(taskname, "source_directory")
+            if ":" in source_dir:
+                ErrorLogger.error("%s: a remote source cannot be watched" % taskname)
+            else:
+                tasks[taskname] = source_dir
+    return tasks
+
+
+def main_loop(systemd_connector, watcher, journals):
+    last_flush = time.time()
+    while True:
+        systemd_connector.update_watchdog()
+        watcher.read_events(FLUSH_INTERVAL)
+        if time.time() - last_flush >= FLUSH_INTERVAL:
+            for journal in journals:
+                journal.flush()
+            last_flush = time.time()
+
+
+if __name__ == '__main__':
+    commandline_parser = localFunctions.initialize_app(PROGRAM_NAME, PROGRAM_VERSION,
+                                                       PROGRAM_DESCRIPTION,
+                                                       perform_parse=False)
+    commandline_parser.add_argument("-f", "--config-file", dest="config_file",
+                                    default=CONFIG_FILE)
+    commandline_parser.add_argument("-j", "--jobname", dest="jobname",
+                                    default=JOB_NAME)
+    args = commandline_parser.parse_args()
+    localFunctions.confirm_root_user(PROGRAM_NAME)
+    InfoLogger, ErrorLogger = backgroundFunctions.create_loggers(INFO_LOGFILE,
+                                                                 ERROR_LOGFILE)
+    systemd = backgroundFunctions.setup_systemd_and_start(PROGRAM_NAME, InfoLogger,
+                                                          ErrorLogger)
+    watcher = InotifyWatcher(systemd)
+    journals = []
+    for name, source in read_watched_tasks(args.config_file, args.jobname).items():
+        task_journal = TaskJournal(name, source)
+        # the start time is written before the first watch is added so that
+        # any change made while the tree is being scanned is covered by the
+        # next full walk
+        task_journal.write_meta()
+        watcher.add_tree(task_journal)
+        task_journal.mark_watch_complete()
+        journals.append(task_journal)
+        InfoLogger.info("Watching %s for %s: %d directories"
+                        % (source, name, len([1 for j, d in watcher.watches.values()
+                                              if j is task_journal])))
+    main_loop(systemd, watcher, journals)
@@ -0,0 +1,389 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Functions shared by the mirror program backupAllFilesystems and the
+programs that report on the mirrors such as systemCheck.
+While an rsync is running backupAllFilesystems writes a small json status
+file for the task in MIRROR_STATUS_DIRECTORY. It is rewritten every few
+seconds with the bytes and files transferred, the current rate and the
+estimated time remaining.
+The mirror log is read backwards with read_mirror_runs so only the last
+runs are parsed however long the log has grown.
+"""
+
+import collections
+import fcntl
+import json
+import os
+import os.path
+import re
+import threading
+import time
+
+MIRROR_STATUS_DIRECTORY = "/run/mirror"
+# minimum seconds between rewrites of a status file
+STATUS_UPDATE_INTERVAL = 5.0
+
+# a progress2 line is like:
+#   1,238,099,584  43%   41.51MB/s    0:00:28 (xfr#1234, to-chk=1017/3298)
+PROGRESS_RE = re.compile(
+    r'^\s*([\d,]+)\s+(\d+)%\s+([\d.]+)([kKMGT]?B)/s\s+(\d+):(\d\d):(\d\d)'
+    r'(?:\s+\(xfr#(\d+),\s+(?:ir|to)-chk=(\d+)/(\d+)\))?')
+STATS_RE = re.compile(r'^(Number of regular files transferred|'
+                      r'Total transferred file size|Total file size|'
+                      r'Total bytes sent|Total bytes received):\s*([\d,]+)')
+RATE_MULTIPLIERS = {"B": 1, "kB": 2 ** 10, "KB": 2 ** 10, "MB": 2 ** 20,
+                    "GB": 2 ** 30, "TB": 2 ** 40}
+
+
+def parse_progress_line(line):
+    """
+    Read one rsync --info=progress2 line.
+    :param line:
+    :return: dictionary of values or None if the line is not a progress line
+    """
+    match = PROGRESS_RE.match(line)
+    if not match:
+        return None
+    values = {"bytes_transferred": int(match.group(1).replace(",", "")),
+              "percent_done": int(match.group(2)),
+              "rate": float(match.group(3)) * RATE_MULTIPLIERS.get(match.group(4), 1),
+              "eta": int(match.group(5)) * 3600 + int(match.group(6)) * 60 +
+                     int(match.group(7))}
+    if match.group(8):
+        values["files_transferred"] = int(match.group(8))
+        values["files_to_check"] = int(match.group(9))
+        values["files_total"] = int(match.group(10))
+    return values
+
+
+def parse_stats_line(line):
+    """
+    Read one line of the rsync --info=stats2 summary.
+    :param line:
+    :return: (key, value) or None
+    """
+    match = STATS_RE.match(line.strip())
+    if not match:
+        return None
+    key = match.group(1).lower().replace(" ", "_")
+    return key, int(match.group(2).replace(",", ""))
+
+
+def get_status_filename(task_name, status_directory=MIRROR_STATUS_DIRECTORY):
+    return os.path.join(status_directory, task_name + ".json")
+
+
+def write_mirror_status(task_name, status, status_directory=MIRROR_STATUS_DIRECTORY):
+    """
+    Replace the status file with a rename so a reader never sees a
+    partly written file.
+    :param task_name:
+    :param status: dictionary of values
+    :param status_directory:
+    :return:
+    """
+    try:
+        os.makedirs(status_directory, 0o755, exist_ok=True)
+        status_filename = get_status_filename(task_name, status_directory)
+        status["updated"] = time.time()
+        # the rsync and throttle threads both write the status
+        temp_filename = "%s.%d.new" % (status_filename, threading.get_ident())
+        with open(temp_filename, "w") as f:
+            json.dump(dict(status), f)
+        os.replace(temp_filename, status_filename)
+    except OSError:
+        pass
+
+
+def process_is_running(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except (PermissionError, TypeError):
+        return True
+
+
+def read_mirror_status(status_directory=MIRROR_STATUS_DIRECTORY):
+    """
+    Read the status of every task. A task recorded as running whose mirror
+    program is no longer running is reported as "interrupted".
+    :param status_directory:
+    :return: dictionary of task name:status dictionary
+    """
+    all_status = {}
+    try:
+        filenames = os.listdir(status_directory)
+    except OSError:
+        return all_status
+    for filename in filenames:
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(status_directory, filename), "r") as f:
+                status = json.load(f)
+            if status.get("state") == "running" and \
+                    not process_is_running(status.get("pid")):
+                status["state"] = "interrupted"
+            all_status[filename[:-len(".json")]] = status
+        except (OSError, ValueError):
+            pass
+    return all_status
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+# ----------------------------------------------------------------------
+# Change journal shared by mirrorChangeJournal (the writer) and
+# backupAllFilesystems (the reader). For each task there is:
+#   TASK.journal     changed paths relative to the source, one per line,
+#                    appended by the daemon
+#   TASK.meta.json   written by the daemon: boot id, pid, start time,
+#                    the time of the last lost events (overflow_time) and
+#                    whether any directory is not watched (watch_incomplete)
+#   TASK.state.json  written by the mirror: the start time of the last
+#                    successful full walk
+#   TASK.journal.processing   the journal taken by a mirror run. It is
+#                    removed only when the run succeeds.
+# Both sides hold an flock on TASK.journal while using it (see
+# open_locked_journal) so no path is written to a journal being taken.
+JOURNAL_DIRECTORY = "/var/lib/mirror/journal"
+MAX_JOURNAL_AGE = 7 * 24 * 3600
+
+
+def get_boot_id():
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def get_journal_filename(task_name, suffix, journal_directory=JOURNAL_DIRECTORY):
+    return os.path.join(journal_directory, task_name + suffix)
+
+
+def read_json_file(filename):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json_file(filename, values):
+    os.makedirs(os.path.dirname(filename), 0o755, exist_ok=True)
+    with open(filename + ".new", "w") as f:
+        json.dump(values, f)
+    os.replace(filename + ".new", filename)
+
+
+def journal_usable(task_name, journal_directory=JOURNAL_DIRECTORY):
+    """
+    The journal can replace a full walk only if the daemon has been watching
+    without a gap since before the last full walk started: it is running,
+    it started in this boot before that walk, it has not lost events
+    since then and it watches every directory of the tree.
+    A full walk is also forced once MAX_JOURNAL_AGE has passed.
+    :return: (usable, reason text if not usable)
+    """
+    meta = read_json_file(get_journal_filename(task_name, ".meta.json",
+                                               journal_directory))
+    state = read_json_file(get_journal_filename(task_name, ".state.json",
+                                                journal_directory))
+    if not meta or not process_is_running(meta.get("pid")):
+        return False, "change journal daemon not running"
+    if meta.get("boot_id") != get_boot_id():
+        return False, "change journal from an earlier boot"
+    last_full_walk = state.get("last_full_walk", 0)
+    if meta.get("started", time.time()) >= last_full_walk:
+        return False, "no full walk since the change journal started"
+    if meta.get("watch_incomplete", True):
+        return False, "change journal does not watch every directory"
+    if meta.get("overflow_time", 0) >= last_full_walk:
+        return False, "change journal overflowed"
+    if time.time() - last_full_walk > MAX_JOURNAL_AGE:
+        return False, "weekly full walk"
+    return True, ""
+
+
+def open_locked_journal(journal_filename, mode="a"):
+    """
+    Open the journal with an exclusive flock. If the journal was taken
+    while waiting for the lock the new journal is opened instead, so the
+    file returned is always the one named journal_filename.
+    :return: the open file or None if there is no journal to read
+    """
+    while True:
+        try:
+            f = open(journal_filename, mode)
+        except FileNotFoundError:
+            return None
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.stat(journal_filename).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+def take_journal(task_name, journal_directory=JOURNAL_DIRECTORY):
+    """
+    Move the current journal aside so the daemon starts a new one, then
+    return every changed path including those from a failed earlier run.
+    The journal is moved while locked so a write by the daemon either
+    comes before and is taken or goes to the new journal.
+    :return: sorted list of relative paths
+    """
+    journal_filename = get_journal_filename(task_name, ".journal", journal_directory)
+    processing_filename = journal_filename + ".processing"
+    journal = open_locked_journal(journal_filename, "r")
+    if journal:
+        with journal:
+            if os.path.exists(processing_filename):
+                # keep the paths of the failed run with the new ones
+                with open(processing_filename, "a") as f:
+                    f.write(journal.read())
+                os.remove(journal_filename)
+            else:
+                os.rename(journal_filename, processing_filename)
+    paths = set()
+    if os.path.exists(processing_filename):
+        with open(processing_filename, "r") as f:
+            paths.update(f.read().splitlines())
+    paths.discard("")
+    return sorted(paths)
+
+
+def finish_journal(task_name, successful, full_walk_start=0,
+                   journal_directory=JOURNAL_DIRECTORY):
+    """
+    After a successful run the taken journal is no longer needed. After a
+    successful full walk the walk start time is recorded.
+    """
+    if not successful:
+        return
+    try:
+        processing_filename = get_journal_filename(task_name, ".journal.processing",
+                                                   journal_directory)
+        if os.path.exists(processing_filename):
+            os.remove(processing_filename)
+        if full_walk_start:
+            write_json_file(get_journal_filename(task_name, ".state.json",
+                                                 journal_directory),
+                            {"last_full_walk": full_walk_start})
+    except OSError:
+        pass
+
+
+# ----------------------------------------------------------------------
+# The mirror log written by backupAllFilesystems.log_results. Each entry
+# starts with a line like:
+#   ++ Tue Oct 19 02:13:42 2026: (1792376022.41) Mirror / to /OS_Copies/ completed:
+# The flag is ** for starting, ++ for completed and -- for failed. A
+# completed or failed entry is followed by its result text lines. The job
+# itself is logged as "Mirror Job ---DailyJobs--- starting." and so on.
+MIRROR_LOG_BLOCK_SIZE = 64 * 1024
+JOB_TASK_TYPE = "Job"
+MIRROR_TASK_TYPE = "Mirror"
+MIRROR_ENTRY_RE = re.compile(
+    r'^(\*\*|\+\+|--) .*?\((\d+\.\d*)\) '
+    r'(?:Mirror Job ---(\S*)--- |(Mirror|Verify|Passwd Backup) (\S*) to (\S*) )'
+    r'(starting|completed|failed)')
+THROUGHPUT_RE = re.compile(r'Throughput:.*transferred (\d+) KB')
+MirrorRun = collections.namedtuple(
+    "MirrorRun", ["task", "task_type", "destination", "start", "end",
+                  "success", "bytes_transferred"])
+
+
+def read_lines_reversed(filename, block_size=MIRROR_LOG_BLOCK_SIZE):
+    """
+    Yield the lines of a file from the last to the first, reading it in
+    blocks from the end so that a caller that stops early reads only the
+    end of the file.
+    """
+    with open(filename, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + remainder).split(b"\n")
+            # the first line may continue in the previous block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode("utf-8", errors="replace")
+        yield remainder.decode("utf-8", errors="replace")
+
+
+def parse_mirror_entry(line):
+    """
+    :param line:
+    :return: (flag, time, task type, task, destination, action) or None if
+        the line does not start an entry. The task of a job entry is the job
+        name; for the others it is the source directory.
+    """
+    match = MIRROR_ENTRY_RE.match(line)
+    if not match:
+        return None
+    if match.group(3) is not None:
+        return (match.group(1), float(match.group(2)), JOB_TASK_TYPE,
+                match.group(3), "", match.group(7))
+    return (match.group(1), float(match.group(2)), match.group(4), match.group(5),
+            match.group(6), match.group(7))
+
+
+def read_mirror_runs(logfile_name, complete_runs=1):
+    """
+    Find the most recent finished run of each task in the mirror log by
+    reading it backwards. Reading stops at the start of the job run that was
+    the complete_runs'th to finish so that only the end of the log is read.
+    :param logfile_name:
+    :param complete_runs: number of finished job runs to read
+    :return: list of MirrorRun, most recent first. A task that has been
+        started since its last finished run, because it is running now or it
+        was interrupted, has an extra run with end and success None.
+    """
+    runs = {}
+    unfinished_runs = {}
+    awaiting_start = set()
+    body = []
+    job_ends_seen = 0
+    for line in read_lines_reversed(logfile_name):
+        entry = parse_mirror_entry(line)
+        if not entry:
+            body.append(line)
+            continue
+        flag, entry_time, task_type, task, destination, action = entry
+        key = (task_type, task, destination)
+        if action == "starting":
+            if key in awaiting_start:
+                runs[key] = runs[key]._replace(start=entry_time)
+                awaiting_start.discard(key)
+            elif key not in runs and key not in unfinished_runs:
+                unfinished_runs[key] = MirrorRun(task, task_type, destination,
+                                                 entry_time, None, None, 0)
+            if task_type == JOB_TASK_TYPE and job_ends_seen >= complete_runs:
+                break
+        else:
+            if task_type == JOB_TASK_TYPE:
+                job_ends_seen += 1
+            if key not in runs:
+                bytes_transferred = 0
+                for body_line in body:
+                    match = THROUGHPUT_RE.search(body_line)
+                    if match:
+                        bytes_transferred = int(match.group(1)) * 1024
+                runs[key] = MirrorRun(task, task_type, destination, None, entry_time,
+                                      action == "completed", bytes_transferred)
+                awaiting_start.add(key)
+        body = []
+    return sorted(list(runs.values()) + list(unfinished_runs.values()),
+                  key=lambda r: r.end or r.start or 0, reverse=True)
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Incremental export and import of the SystemMonitor database.
+The exporter remembers the last exported Time for each table in a small
+state file and streams only the newer rows directly from the source tables
+into a gzip compressed export file. The file is self describing: it starts
+with a header, each table section lists its columns and time range, and it
+ends with a trailer with the row counts so that a truncated file is detected.
+The small reference tables (Users and ClientComputers) have no time column
+so they are always exported completely.
+
+On the receiving side run this program with --import to load an export file
+into a database with the same table structure:
+    monitorExport.py --import SystemMonitor-School-01-01-2024.jsonl.gz
+"""
+
+import MySQLdb
+import MySQLdb.cursors
+import gzip
+import json
+import os
+import os.path
+import socket
+import sys
+import time
+import localFunctions
+
+VERSION = "1.0"
+EXPORT_FORMAT = "SystemMonitorExport"
+EXPORT_FORMAT_VERSION = 1
+STATE_FILENAME = "/var/lib/smtpreporter/exportState.json"
+TIMED_TABLES = ("ClientResourceUse", "CpuUse", "MemoryUse", "SummaryData",
+                "UsersLoggedIn")
+REFERENCE_TABLES = ("Users", "ClientComputers")
+FETCH_BATCH_SIZE = 2000
+# Rows are exported only up to a few seconds before the start of the export
+# so that a row written by the SystemMonitor during the export is never skipped.
+EXPORT_TIME_MARGIN = 5
+
+
+class ExportError(Exception):
+    """
+    The export file is not a complete, readable SystemMonitor export.
+    """
+    pass
+
+
+class WatermarkState:
+    """
+    Read and write the per table last exported Time values.
+    """
+
+    def __init__(self, state_filename=STATE_FILENAME):
+        self.state_filename = state_filename
+        self.watermarks = {}
+
+    def load(self):
+        """
+        Read the state file. A missing or damaged file is treated as no
+        previous export.
+        :return: dictionary of tablename:last exported time
+        """
+        try:
+            with open(self.state_filename, "r") as f:
+                values = json.load(f)
+            self.watermarks = {k: int(v) for k, v in values.get("watermarks", {}).items()}
+        except (OSError, ValueError, AttributeError, TypeError):
+            self.watermarks = {}
+        return self.watermarks
+
+    def get_watermark(self, tablename, default=0):
+        return self.watermarks.get(tablename, default)
+
+    def save(self, new_watermarks):
+        """
+        Write the new values with a rename so that an interrupted write never
+        leaves a damaged state file.
+        :param new_watermarks: dictionary of tablename:last exported time
+        :return:
+        """
+        self.watermarks.update(new_watermarks)
+        state_dir = os.path.dirname(self.state_filename)
+        if state_dir and not os.path.isdir(state_dir):
+            os.makedirs(state_dir, 0o755)
+        temp_filename = self.state_filename + ".new"
+        with open(temp_filename, "w") as f:
+            json.dump({"watermarks": self.watermarks, "updated": int(time.time())},
+                      f, indent=2)
+        os.replace(temp_filename, self.state_filename)
+
+
+class IncrementalExporter:
+    """
+    Stream the rows newer than the stored watermark for each table into an
+    export file. The new watermarks are saved only when commit() is called so
+    that the caller can wait until the file has actually been sent.
+    """
+
+    def __init__(self, connector, export_filename, days_back,
+                 state_filename=STATE_FILENAME, school_name=""):
+        """
+        :param connector: an open MySQLdb connection to the SystemMonitor database
+        :param export_filename: the full path of the .jsonl.gz file to create
+        :param days_back: the maximum age of rows in the first export or after
+            a long gap in sending
+        :param state_filename:
+        :param school_name:
+        """
+        self.connector = connector
+        self.export_filename = export_filename
+        self.days_back = days_back
+        self.school_name = school_name
+        self.state = WatermarkState(state_filename)
+        self.new_watermarks = {}
+        self.row_counts = {}
+
+    def write_record(self, export_file, record):
+        export_file.write(json.dumps(record, default=str) + "\n")
+
+    def export_query(self, export_file, tablename, query, section_info):
+        """
+        Run the query with a server side cursor and write the rows in batches
+        so that only one batch is held in memory.
+        :return: number of rows written
+        """
+        count = 0
+        cursor = self.connector.cursor(MySQLdb.cursors.SSCursor)
+        try:
+            cursor.execute(query)
+            section_info["table"] = tablename
+            section_info["columns"] = [column[0] for column in cursor.description]
+            self.write_record(export_file, section_info)
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                count += len(rows)
+                self.write_record(export_file, {"rows": [list(row) for row in rows]})
+        finally:
+            cursor.close()
+        self.write_record(export_file, {"table_end": tablename, "count": count})
+        return count
+
+    def export(self):
+        """
+        Write the complete export file.
+        :return: dictionary of tablename:number of rows exported
+        """
+        self.state.load()
+        export_until = int(time.time()) - EXPORT_TIME_MARGIN
+        earliest_time = export_until - self.days_back * 24 * 3600
+        self.new_watermarks = {}
+        self.row_counts = {}
+        with gzip.open(self.export_filename, "wt", encoding="utf-8") as export_file:
+            self.write_record(export_file, {"format": EXPORT_FORMAT,
+                                            "version": EXPORT_FORMAT_VERSION,
+                                            "database": "SystemMonitor",
+                                            "school": self.school_name,
+                                            "host": socket.gethostname(),
+                                            "created": int(time.time())})
+            for tablename in TIMED_TABLES:
+                start_time = max(self.state.get_watermark(tablename), earliest_time)
+                query = "SELECT * FROM %s WHERE Time > %d AND Time <= %d ORDER BY Time" \
+                        % (tablename, start_time, export_until)
+                self.row_counts[tablename] = self.export_query(
+                    export_file, tablename, query,
+                    {"mode": "incremental", "from": start_time, "to": export_until})
+                self.new_watermarks[tablename] = export_until
+            for tablename in REFERENCE_TABLES:
+                query = "SELECT * FROM %s" % tablename
+                self.row_counts[tablename] = self.export_query(
+                    export_file, tablename, query, {"mode": "full"})
+            self.write_record(export_file, {"end": True, "row_counts": self.row_counts})
+        return self.row_counts
+
+    def commit(self):
+        """
+        Record the export as delivered so the next export starts after it.
+        """
+        if self.new_watermarks:
+            self.state.save(self.new_watermarks)
+
+
+class ExportImporter:
+    """
+    Load an export file into a database. REPLACE is used with the original
+    Index values so that loading the same file twice does no harm.
+    All inserts are in a single transaction that is committed only if the
+    file is complete.
+    """
+
+    def __init__(self, connector, export_filename):
+        self.connector = connector
+        self.export_filename = export_filename
+        self.header = {}
+        self.row_counts = {}
+
+    def insert_rows(self, cursor, tablename, columns, rows):
+        column_text = ",".join(["`%s`" % c for c in columns])
+        placeholders = ",".join(["%s"] * len(columns))
+        query = "REPLACE INTO `%s` (%s) VALUES (%s)" % (tablename, column_text,
+                                                       placeholders)
+        cursor.executemany(query, rows)
+
+    def import_file(self):
+        """
+        :return: dictionary of tablename:number of rows loaded
+        """
+        tablename = ""
+        columns = []
+        completed = False
+        cursor = self.connector.cursor()
+        try:
+            with gzip.open(self.export_filename, "rt", encoding="utf-8") as export_file:
+                for line_number, line in enumerate(export_file):
+                    record = json.loads(line)
+                    if line_number == 0:
+                        if record.get("format") != EXPORT_FORMAT or \
+                                record.get("version", 0) > EXPORT_FORMAT_VERSION:
+                            raise ExportError("%s is not a supported export file"
+                                              % self.export_filename)
+                        self.header = record
+                    elif "columns" in record:
+                        tablename = record["table"]
+                        columns = record["columns"]
+                        self.row_counts[tablename] = 0
+                    elif "rows" in record:
+                        self.insert_rows(cursor, tablename, columns, record["rows"])
+                        self.row_counts[tablename] += len(record["rows"])
+                    elif "end" in record:
+                        if record["row_counts"] != self.row_counts:
+                            raise ExportError("Row counts in %s do not match the trailer"
+                                              % self.export_filename)
+                        completed = True
+            if not completed:
+                raise ExportError("%s is truncated" % self.export_filename)
+            self.connector.commit()
+        except (OSError, EOFError, ValueError, KeyError, ExportError, MySQLdb.Error):
+            self.connector.rollback()
+            raise
+        finally:
+            cursor.close()
+        return self.row_counts
+
+
+if __name__ == "__main__":
+    commandline_parser = localFunctions.initialize_app(
+        name="monitorExport", version=VERSION,
+        description="Load a SystemMonitor export file into a database",
+        perform_parse=False)
+    commandline_parser.add_argument("--import", dest="import_filename", required=True,
+                                    help="the export file to load")
+    commandline_parser.add_argument("--database", dest="database", default="SystemMonitor",
+                                    help="the destination database name")
+    commandline_parser.add_argument("--host", dest="host", default="localhost")
+    commandline_parser.add_argument("--user", dest="user", default="root")
+    commandline_parser.add_argument("--password", dest="password", default="mysqlAdmin")
+    args = commandline_parser.parse_args()
+    try:
+        db_connector = MySQLdb.connect(db=args.database, passwd=args.password,
+                                       user=args.user, host=args.host)
+        importer = ExportImporter(db_connector, args.import_filename)
+        counts = importer.import_file()
+        db_connector.close()
+        print("Loaded export from %s (%s):" % (importer.header.get("school", ""),
+                                              time.ctime(importer.header.get("created", 0))))
+        for name, count in counts.items():
+            print("   %s: %d rows" % (name, count))
+    except (OSError, EOFError, ValueError, KeyError, ExportError, MySQLdb.Error) as err:
+        print("Import of %s failed: %s" % (args.import_filename, err), file=sys.stderr)
+        sys.exit(1)
@@ -3,9 +3,17 @@
 # this file contains shared functions for network applications.
 
 import localFunctions
+import asyncio
+import calendar
+import collections
 import glob
+import ipaddress
+import json
 import os
+import random
 import re
+import socket
+import struct
 import subprocess
 import time
 
@@ -14,6 +22,25 @@ INTERNET_OFF_DIR = "/tmp"
 INTERNET_OFF_PREFIX = "internet-off-"
 INTERNET_OFF_SUFFIX = ".txt"
 PROGRAM_VERSION = 0.7
+SYS_CLASS_NET = "/sys/class/net"
+NEIGHBOUR_TABLE_COMMAND = "ip -4 neigh show"
+DHCP_LEASES_FILENAME = "/var/lib/dhcp/dhcpd.leases"
+# net_device flags from linux/if.h
+IFF_UP = 0x1
+IFF_MASTER = 0x400
+IFF_SLAVE = 0x800
+# neighbour states that the kernel has confirmed recently. A STALE entry
+# may be left for hours after the host has gone.
+CONFIRMED_NEIGHBOUR_STATES = ("REACHABLE", "DELAY")
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+PROBE_TIMEOUT = 1.0
+MAX_CONCURRENT_PROBES = 64
+# no more than a /24 is ever probed
+MAX_PROBE_PREFIX = 24
+InterfaceState = collections.namedtuple(
+    "InterfaceState", ["name", "up", "running", "master", "slave", "mac_address",
+                       "rx_packets", "tx_packets", "rx_errors", "tx_errors"])
 
 
 def internet_interface_file_network_type():
@@ -193,3 +220,284 @@ wpa-psk  %s
         os.rename(temp_filename, os.path.realpath(filename))
     except OSError as e:
         print("Failed to write interfaces file for wireless: %s" % e)
+
+
+# ----------------------------------------------------------------------
+# Interface state and host discovery without forking ifconfig and fping.
+def read_sys_value(interface_name, value_name, default="", sys_class_net=SYS_CLASS_NET):
+    try:
+        with open(os.path.join(sys_class_net, interface_name, value_name), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def list_interfaces(sys_class_net=SYS_CLASS_NET):
+    try:
+        return sorted(os.listdir(sys_class_net))
+    except OSError:
+        return []
+
+
+def read_interface_state(interface_name, sys_class_net=SYS_CLASS_NET):
+    """
+    Read the state of an interface from sysfs.
+    An interface such as tun or ppp that has no carrier detection reports
+    the operstate "unknown". It is running if it is up.
+    :param interface_name:
+    :param sys_class_net:
+    :return: InterfaceState or None if there is no such interface
+    """
+    if not os.path.isdir(os.path.join(sys_class_net, interface_name)):
+        return None
+
+    def counter(name):
+        try:
+            return int(read_sys_value(interface_name, "statistics/" + name, "0",
+                                      sys_class_net))
+        except ValueError:
+            return 0
+
+    try:
+        flags = int(read_sys_value(interface_name, "flags", "0", sys_class_net), 16)
+    except ValueError:
+        flags = 0
+    operstate = read_sys_value(interface_name, "operstate", "down", sys_class_net)
+    up = bool(flags & IFF_UP)
+    return InterfaceState(interface_name, up,
+                          operstate == "up" or (operstate == "unknown" and up),
+                          bool(flags & IFF_MASTER), bool(flags & IFF_SLAVE),
+                          read_sys_value(interface_name, "address", "", sys_class_net),
+                          counter("rx_packets"), counter("tx_packets"),
+                          counter("rx_errors"), counter("tx_errors"))
+
+
+def get_interface_addresses(interface_name=""):
+    """
+    Use the json output of "ip addr" to get the IPv4 addresses.
+    :param interface_name: a single interface or "" for all
+    :return: dictionary of interface name:list of ipaddress.IPv4Interface
+    """
+    addresses = {}
+    command = ["ip", "-j", "-4", "addr", "show"]
+    if interface_name:
+        command += ["dev", interface_name]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True)
+        for interface in json.loads(result.stdout or "[]"):
+            addresses[interface["ifname"]] = [
+                ipaddress.IPv4Interface("%s/%s" % (a["local"], a["prefixlen"]))
+                for a in interface.get("addr_info", []) if a.get("family") == "inet"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return addresses
+
+
+def read_neighbour_table(command=NEIGHBOUR_TABLE_COMMAND):
+    """
+    Read the kernel neighbour (ARP) table. A line is like:
+        192.168.2.15 dev eth1 lladdr 00:1e:4f:2a:10:c3 REACHABLE
+    :param command:
+    :return: dictionary of ip address:(mac address, interface name, state)
+    """
+    neighbours = {}
+    try:
+        lines = localFunctions.run_command(command, reraise_error=True,
+                                           no_stderr=True)
+    except subprocess.CalledProcessError:
+        return neighbours
+    for line in lines:
+        columns = line.split()
+        if len(columns) < 2:
+            continue
+        values = dict(zip(columns[1:-1], columns[2:]))
+        neighbours[columns[0]] = (values.get("lladdr", ""), values.get("dev", ""),
+                                  columns[-1])
+    return neighbours
+
+
+def read_dhcp_leases(filename=DHCP_LEASES_FILENAME, now=None):
+    """
+    Read the leases that are still active from the ISC dhcpd leases file.
+    A lease may be listed several times; the last entry is the current one.
+    :param filename:
+    :param now: time to compare the lease end with
+    :return: dictionary of ip address:mac address
+    """
+    now = now or time.time()
+    lease_re = re.compile(r'lease\s+([\d.]+)\s*\{(.*?)\}', re.S)
+    ends_re = re.compile(r'\bends\s+\d\s+(\d+/\d+/\d+ \d+:\d+:\d+);')
+    mac_re = re.compile(r'hardware ethernet\s+([\w:]+);')
+    leases = {}
+    try:
+        with open(filename, "r") as f:
+            leases_text = f.read()
+    except OSError:
+        return leases
+    for address, block in lease_re.findall(leases_text):
+        active = re.search(r'\bbinding state active;', block) is not None
+        ends_match = ends_re.search(block)
+        if active and ends_match:
+            ends = calendar.timegm(time.strptime(ends_match.group(1), "%Y/%m/%d %H:%M:%S"))
+            active = ends > now
+        mac_match = mac_re.search(block)
+        if active:
+            leases[address] = mac_match.group(1) if mac_match else ""
+        else:
+            leases.pop(address, None)
+    return leases
+
+
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class IcmpProber:
+    """
+    Send ICMP echo requests to many addresses at once with asyncio.
+    An unprivileged datagram ICMP socket is used if the kernel allows it
+    (net.ipv4.ping_group_range), otherwise a raw socket which requires root.
+    Any object with an async probe(address) method that returns True when
+    the address answers can be used in its place by HostDiscovery.
+    """
+
+    def __init__(self, timeout=PROBE_TIMEOUT):
+        self.timeout = timeout
+
+    @staticmethod
+    def open_socket():
+        try:
+            return socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                 socket.IPPROTO_ICMP), False
+        except OSError:
+            return socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                 socket.IPPROTO_ICMP), True
+
+    async def probe(self, address):
+        loop = asyncio.get_event_loop()
+        sock, raw = self.open_socket()
+        sock.setblocking(False)
+        identifier = random.randint(0, 0xffff)
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, identifier, 1)
+        payload = b"systemCheck"
+        packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0,
+                             icmp_checksum(header + payload), identifier, 1) + payload
+        answered = loop.create_future()
+
+        def read_reply():
+            try:
+                data, source = sock.recvfrom(1024)
+            except OSError:
+                return
+            if raw:
+                # skip the IP header
+                data = data[(data[0] & 0x0f) * 4:]
+            if source[0] != address or len(data) < 8:
+                return
+            icmp_type, code, checksum, reply_id, sequence = \
+                struct.unpack("!BBHHH", data[:8])
+            # the kernel replaces the identifier of a datagram socket
+            if icmp_type == ICMP_ECHO_REPLY and (reply_id == identifier or not raw) \
+                    and not answered.done():
+                answered.set_result(True)
+
+        try:
+            loop.add_reader(sock.fileno(), read_reply)
+            sock.sendto(packet, (address, 0))
+            return await asyncio.wait_for(answered, self.timeout)
+        except (asyncio.TimeoutError, OSError):
+            return False
+        finally:
+            loop.remove_reader(sock.fileno())
+            sock.close()
+
+
+class HostDiscovery:
+    """
+    Find the active hosts on a subnet. Hosts that the kernel has confirmed
+    as reachable in the last few seconds are known to be active without
+    sending anything. Every other address of the subnet is probed, as fping
+    did, with the other neighbours and the addresses leased by the DHCP
+    server first.
+    The neighbour table, leases and prober can be replaced for testing.
+    """
+
+    def __init__(self, neighbour_reader=read_neighbour_table,
+                 lease_reader=read_dhcp_leases, prober=None,
+                 max_concurrent=MAX_CONCURRENT_PROBES):
+        self.neighbour_reader = neighbour_reader
+        self.lease_reader = lease_reader
+        self.prober = prober or IcmpProber()
+        self.max_concurrent = max_concurrent
+
+    @staticmethod
+    def get_network(interface_address):
+        """
+        :param interface_address: ipaddress.IPv4Interface or "a.b.c.d/nn"
+        :return: the subnet of the address, no larger than a /24
+        """
+        interface_address = ipaddress.IPv4Interface(interface_address)
+        if interface_address.network.prefixlen < MAX_PROBE_PREFIX:
+            return ipaddress.IPv4Interface("%s/%d" % (interface_address.ip,
+                                                      MAX_PROBE_PREFIX)).network
+        return interface_address.network
+
+    async def probe_all(self, addresses):
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        async def limited_probe(address):
+            async with semaphore:
+                return await self.prober.probe(address)
+
+        results = await asyncio.gather(*[limited_probe(a) for a in addresses])
+        return [a for a, answered in zip(addresses, results) if answered]
+
+    def run_probes(self, addresses):
+        if not addresses:
+            return []
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(self.probe_all(addresses))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def find_hosts(self, interface_address, interface_name=""):
+        """
+        :param interface_address: the address of this computer on the subnet,
+            ipaddress.IPv4Interface or "a.b.c.d/nn"
+        :param interface_name: if given only neighbours on this interface count
+        :return: sorted list of the addresses of the other active hosts
+        """
+        network = self.get_network(interface_address)
+        own_address = str(ipaddress.IPv4Interface(interface_address).ip)
+
+        def in_subnet(address):
+            try:
+                return address != own_address and \
+                    ipaddress.IPv4Address(address) in network
+            except ValueError:
+                return False
+
+        active = set()
+        known = set()
+        for address, (mac, device, state) in self.neighbour_reader().items():
+            if in_subnet(address) and (not interface_name or device == interface_name):
+                if state in CONFIRMED_NEIGHBOUR_STATES:
+                    active.add(address)
+                else:
+                    known.add(address)
+        known.update([address for address in self.lease_reader() if in_subnet(address)])
+        known -= active
+        unknown = sorted(known, key=ipaddress.IPv4Address)
+        unknown += [str(a) for a in network.hosts()
+                    if in_subnet(str(a)) and str(a) not in active and str(a) not in known]
+        active.update(self.run_probes(unknown))
+        return sorted(active, key=ipaddress.IPv4Address)
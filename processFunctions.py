@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+A snapshot of all processes read directly from /proc so that the process
+checks do not each fork their own ps command.
+
+A ProcessSnapshot holds a ProcessInfo for each process. CPU use since the
+start of each process is available from a single snapshot, like the %CPU
+of ps. The CPU use over an interval is the difference between two
+snapshots. Totals for each user show a single session that is using much
+of the server.
+
+read_open_files finds the files that processes hold open so that a cleanup
+does not delete a file that is in use.
+"""
+
+import collections
+import os
+import pwd
+import time
+
+PROC_DIRECTORY = "/proc"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+# rss is in KB. cpu_ticks is the user and system time and start_ticks the
+# start time after boot, both in clock ticks.
+ProcessInfo = collections.namedtuple(
+    "ProcessInfo", ["pid", "ppid", "uid", "gid", "user", "state", "name",
+                    "cmdline", "rss", "cpu_ticks", "start_ticks"])
+UserTotals = collections.namedtuple(
+    "UserTotals", ["user", "uid", "process_count", "rss", "cpu_ticks"])
+_user_names = {}
+
+
+def get_user_name(uid):
+    if uid not in _user_names:
+        try:
+            _user_names[uid] = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            _user_names[uid] = str(uid)
+    return _user_names[uid]
+
+
+def read_process(pid, proc_directory=PROC_DIRECTORY):
+    """
+    :param pid:
+    :param proc_directory:
+    :return: ProcessInfo or None if the process has exited
+    """
+    process_directory = os.path.join(proc_directory, str(pid))
+    try:
+        owner = os.stat(process_directory)
+        with open(os.path.join(process_directory, "stat"), "r") as f:
+            stat_text = f.read()
+        with open(os.path.join(process_directory, "cmdline"), "rb") as f:
+            cmdline = f.read().rstrip(b"\0").replace(b"\0", b" ").decode(
+                "utf-8", errors="replace")
+    except OSError:
+        return None
+    # the name may contain spaces and parentheses
+    name_start = stat_text.index("(") + 1
+    name_end = stat_text.rindex(")")
+    fields = stat_text[name_end + 2:].split()
+    name = stat_text[name_start:name_end]
+    # fields[0] is field 3 of proc(5)
+    return ProcessInfo(pid, int(fields[1]), owner.st_uid, owner.st_gid,
+                       get_user_name(owner.st_uid), fields[0], name,
+                       cmdline or "[%s]" % name, int(fields[21]) * PAGE_SIZE_KB,
+                       int(fields[11]) + int(fields[12]), int(fields[19]))
+
+
+def read_open_files(proc_directory=PROC_DIRECTORY):
+    """
+    Find the files that are open in any process and the working directory
+    of each process.
+    :return: set of (device, inode)
+    """
+    open_files = set()
+    for entry in os.listdir(proc_directory):
+        if not entry.isdigit():
+            continue
+        process_directory = os.path.join(proc_directory, entry)
+        try:
+            cwd_stat = os.stat(os.path.join(process_directory, "cwd"))
+            open_files.add((cwd_stat.st_dev, cwd_stat.st_ino))
+            fd_directory = os.path.join(process_directory, "fd")
+            fd_names = os.listdir(fd_directory)
+        except OSError:
+            # exited or a kernel thread
+            continue
+        for fd_name in fd_names:
+            try:
+                fd_stat = os.stat(os.path.join(fd_directory, fd_name))
+                open_files.add((fd_stat.st_dev, fd_stat.st_ino))
+            except OSError:
+                pass
+    return open_files
+
+
+def read_uptime(proc_directory=PROC_DIRECTORY):
+    with open(os.path.join(proc_directory, "uptime"), "r") as f:
+        return float(f.read().split()[0])
+
+
+def read_memory_total(proc_directory=PROC_DIRECTORY):
+    """
+    :return: total memory in KB
+    """
+    with open(os.path.join(proc_directory, "meminfo"), "r") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1])
+    return 0
+
+
+class ProcessSnapshot:
+    """
+    All processes at one moment.
+    """
+
+    def __init__(self, proc_directory=PROC_DIRECTORY):
+        self.time = time.monotonic()
+        self.uptime = read_uptime(proc_directory)
+        self.processes = {}
+        for entry in os.listdir(proc_directory):
+            if entry.isdigit():
+                process = read_process(int(entry), proc_directory)
+                if process:
+                    self.processes[process.pid] = process
+
+    def __iter__(self):
+        return iter(self.processes.values())
+
+    def age(self, process):
+        """
+        :return: seconds since the process started
+        """
+        return max(self.uptime - process.start_ticks / CLOCK_TICKS, 0.0)
+
+    def lifetime_cpu_percent(self, process):
+        """
+        The percent of one CPU used since the process started, as ps reports.
+        """
+        age = self.age(process)
+        if age <= 0.0:
+            return 0.0
+        return 100.0 * process.cpu_ticks / CLOCK_TICKS / age
+
+    def cpu_percent(self, earlier):
+        """
+        The percent of one CPU used by each process since the earlier
+        snapshot. A process that is not in the earlier snapshot is counted
+        from its start.
+        :param earlier: ProcessSnapshot
+        :return: dictionary of pid:percent
+        """
+        interval = self.time - earlier.time
+        usage = {}
+        if interval <= 0.0:
+            return usage
+        for pid, process in self.processes.items():
+            previous = earlier.processes.get(pid)
+            if previous and previous.start_ticks == process.start_ticks:
+                ticks = process.cpu_ticks - previous.cpu_ticks
+            else:
+                ticks = process.cpu_ticks
+            usage[pid] = 100.0 * ticks / CLOCK_TICKS / interval
+        return usage
+
+    def user_totals(self):
+        """
+        :return: dictionary of user name:UserTotals
+        """
+        totals = {}
+        for process in self.processes.values():
+            user = totals.get(process.user,
+                              UserTotals(process.user, process.uid, 0, 0, 0))
+            totals[process.user] = user._replace(
+                process_count=user.process_count + 1, rss=user.rss + process.rss,
+                cpu_ticks=user.cpu_ticks + process.cpu_ticks)
+        return totals
+
+    def user_cpu_percent(self, earlier):
+        """
+        :param earlier: ProcessSnapshot
+        :return: dictionary of user name:percent of one CPU used by all of
+            the user's processes since the earlier snapshot
+        """
+        usage = collections.defaultdict(float)
+        for pid, percent in self.cpu_percent(earlier).items():
+            usage[self.processes[pid].user] += percent
+        return dict(usage)
+
+    def processes_of_user(self, user):
+        return [p for p in self.processes.values() if p.user == user]
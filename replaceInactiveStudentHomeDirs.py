@@ -19,6 +19,7 @@ import syslog
 import pwd
 import localFunctions
 import localFunctionsPy3
+import processFunctions
 import systemCleanup
 
 PROGRAM_DESCRIPTION = \
@@ -31,43 +32,32 @@ def find_active_users():
     """
     Create a dictionary keyed by user of all users with an active process
     with the count of processes as the dictionary entry. This dictionary and
-    a "valid" flag are returned. If the /bin/ps fails the valid is false to
+    a "valid" flag are returned. If /proc cannot be read the valid is false to
     indicate that the users are unknown and the result should not be used.
     """
     active_users = {}
     valid = True
     try:
-        command = '/bin/ps -e --format=user:20 --no-headers'
-        user_names = localFunctions.run_command(command, result_as_list=True,
-                                                reraise_error=True)
-        for user in user_names:
-            if user in active_users:
-                active_users[user] += 1
-            else:
-                active_users[user] = 1
-    except subprocess.CalledProcessError:
+        for user, totals in processFunctions.ProcessSnapshot().user_totals().items():
+            active_users[user] = totals.process_count
+    except OSError:
         valid = False
     return active_users, valid
 
 
-def get_users_ip_address(user, remote_users):
+def get_users_ip_address(user, remote_users, snapshot):
     """
     Determine the host address of the user from the information
     about the primary shell process
     """
     ip_address = remote_users.get(user, None)
     if not ip_address:
-        try:
-            command = '/bin/ps -f -u ' + user
-            user_process_listing = localFunctions.run_command(command,
-                                                              reraise_error=True,
-                                                              result_as_list=False)
+        for process in snapshot.processes_of_user(user):
             match = re.search(r'(?:LTSP_CLIENT=)(\d+\.\d+\.\d+\.\d+)',
-                              user_process_listing)
+                              process.cmdline)
             if match:
                 ip_address = match.group(1)
-        except subprocess.CalledProcessError:
-            pass
+                break
     return ip_address
 
 
@@ -113,30 +103,20 @@ def find_orphan_users(user_dict):
     command and containing the pid.
     """
     try:
-        processes = localFunctions.run_command(
-            '/bin/ps -e --format=user:20,uid,gid,pid,comm',
-            result_as_list=True, reraise_error=True)
-        for process in processes:
-            try:
-                if len(process.split()) == 5:
-                    user, uid_str, gid_str, pid_str, command = process.split()
-                    uid = int(uid_str)
-                    gid = int(gid_str)
-                    pid = int(pid_str)
-                    if (int(gid) > 999) and (int(uid) > 999):
-                        # a user, not a daemon
-                        if user not in user_dict:
-                            user_dict[user] = {}
-                        user_dict[user][command] = pid
-            except ValueError:
-                continue
+        snapshot = processFunctions.ProcessSnapshot()
+        for process in snapshot:
+            if process.gid > 999 and process.uid > 999:
+                # a user, not a daemon
+                if process.user not in user_dict:
+                    user_dict[process.user] = {}
+                user_dict[process.user][process.name] = process.pid
         local_users, remote_users = find_who_users()
         check_host_dict = {}
         for user, user_processes in list(user_dict.items()):
             # remove all that have a bash or sh process
             if ("bash" in user_processes or "sh" in user_processes) \
                     and user not in local_users:
-                user_ip_address = get_users_ip_address(user, remote_users)
+                user_ip_address = get_users_ip_address(user, remote_users, snapshot)
                 if user_ip_address:
                     check_host_dict[user_ip_address] = user
         alive_host_dict = check_hosts(check_host_dict)
@@ -144,7 +124,7 @@ def find_orphan_users(user_dict):
             user_dict.pop(user, None)
         for user in alive_host_dict.values():
             user_dict.pop(user, None)
-    except subprocess.CalledProcessError as err_val:
+    except (subprocess.CalledProcessError, OSError) as err_val:
         report_error("Failed process in find_orphan_users %s" % err_val)
         pass
     return user_dict
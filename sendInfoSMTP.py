@@ -18,21 +18,30 @@ import shutil
 import smtplib
 import syslog
 import email.errors
+import json
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from email.mime.text import MIMEText
 import localFunctions
 import reporter
 import backgroundFunctions
+import monitorExport
 
 NUM_DAYS_RECORDS = 90
 MAX_ATTACH_SIZE = 5
 TMP_DIRECTORY = "/tmp/infofiles"
-SPLIT_FILES_DIRECTORY = TMP_DIRECTORY + "splits"
-SQL_DUMP_FILENAME = TMP_DIRECTORY + "/mon.sql"
+SPLIT_FILES_DIRECTORY = TMP_DIRECTORY + "/splits"
 CSV_FILENAME = TMP_DIRECTORY + "/mon.csv"
 SYSTEM_CHECK_LOG_FILENAME = "/var/log/systemCheck/systemCheck.log"
 LOGGING_DIRECTORY = "/var/log/smtpreporter"
+OUTBOX_DIRECTORY = "/var/spool/smtpreporter/outbox"
+# total size in megabytes of all queued messages. The oldest are dropped first
+OUTBOX_MAX_SIZE = 200
+# first retry after RETRY_BASE_DELAY seconds, then doubled for each failure
+RETRY_BASE_DELAY = 900
+RETRY_MAX_DELAY = 24 * 3600
+SMTP_HOST = "localhost"
+SMTP_PORT = 25
 InfoLogger = None
 ErrorLogger = None
 EMAIL_SENDER = "mainserver@reneal.duckdns.org"
@@ -46,9 +55,10 @@ class FileHandler:
     Manage individual files to be attachemnts
     """
 
-    def init(self, original_filename, remove_original):
+    def __init__(self, original_filename, remove_original=False, compress=True):
         self.original_file = original_filename
         self.remove_original = remove_original
+        self.compress = compress
         self.compressed_file = None
         self.result_file = None
         self.result_chunks_list = []
@@ -68,19 +78,22 @@ class FileHandler:
     def compress_file(self):
         """
         Compress file with 7z. Creates filename.7z.
-        and remove original
-        :param filename:
-        :return:
+        and remove original. Files that are already compressed, such as the
+        database export, are used as they are.
+        :return: the name of the file to attach or None
         """
+        if not self.compress:
+            return self.original_file
+        compressed_file = self.original_file + ".7z"
         try:
             delete_flag = "-sdel" if self.remove_original else ""
-            command = "/usr/bin/7z a  %s %s %s" \
-                              %(delete_flag, self.original_file, self.compressed_file)
-            result = localFunctions.run_command(command, reraise_error = True,
-                                                result_as_list=False, print_error=True)
+            command = "/usr/bin/7z a %s %s %s" \
+                              %(delete_flag, compressed_file, self.original_file)
+            localFunctions.run_command(command, reraise_error = True,
+                                       result_as_list=False, print_error=True)
         except subprocess.CalledProcessError as e:
-            result = False
-        return result
+            compressed_file = None
+        return compressed_file
 
     def split_file(self):
         """
@@ -89,13 +102,14 @@ class FileHandler:
         """
         global MAX_ATTACH_SIZE, SPLIT_FILES_DIRECTORY
         try:
-            if os.path.getsize(self.compressed_file) > MAX_ATTACH_SIZE:
+            if self.compressed_file and \
+                    os.path.getsize(self.compressed_file) > MAX_ATTACH_SIZE * 1024 * 1024:
                 self.is_split = True
-                os.mkdir(SPLIT_FILES_DIRECTORY)
+                os.makedirs(SPLIT_FILES_DIRECTORY, exist_ok=True)
                 command = "split -b %dm -d %s %s/%s" %(MAX_ATTACH_SIZE,
                                                        self.compressed_file,
                                                        SPLIT_FILES_DIRECTORY,
-                                                       self.compressed_file)
+                                                       os.path.basename(self.compressed_file))
                 result = localFunctions.run_command(command, reraise_error = True,
                                                     result_as_list=False, print_error=True)
                 self.result_chunks_list = [os.path.join(SPLIT_FILES_DIRECTORY, f)
@@ -114,6 +128,7 @@ class FileHandler:
         :return:
         """
         self.compressed_file = self.compress_file()
+        self.result_file = self.compressed_file
         self.full_file_md5sum = self.generate_md5sum(self.compressed_file)
         self.split_file()
 
@@ -130,84 +145,104 @@ class ReportsGenerator:
     """
     Generate and compress and split all three reports to be sent.
     These reports are:
-    SQL dmp of database for NUM_DAYS_RECORDS back
+    Incremental export of the database rows added since the last send
     Summary report csv file
     Copy of systemCheck logfile
     """
 
-    def __init__(self, schoolname, days_back, max_attach_size):
+    def __init__(self, schoolname, csv_filename, systemCheckLog_filename,
+                 days_back, max_attach_size, include_export=True):
+        """
+        :param include_export: False to leave out the database export. Its
+            rows are then sent with a later export.
+        """
         self.datestring = datetime.date.today().strftime("%m-%d-%Y")
         self.schoolname = schoolname
         self.id = schoolname + "-" + self.datestring
-        self.sql_filename = "SystemMonitor-" + self.id + ".sql"
-        self.csv_filename = os.path.join("Summary-)
+        self.sql_filename = os.path.join(TMP_DIRECTORY,
+                                         "SystemMonitor-" + self.id + ".jsonl.gz")
+        self.csv_filename = csv_filename
         self.systemCheckLog_filename = systemCheckLog_filename
         self.days_back = days_back
         self.max_attach_size = max_attach_size
         self.split_list = []
         self.full_size_md5sum = ""
         self.split_list_md5sums = {}
+        self.include_export = include_export
+        self.exporter = None
 
-    def modify_sql_db(self, db_name):
+    def generate_sql_dump(self):
+        """
+        Export only the rows added since the last successful send. The
+        watermarks are not moved forward until commit_sql_dump is called.
+        :return: True if the export file was written
+        """
         global DATABASE_HOST
         try:
-            connector = MySQLdb.connect(db=modified_db_name,
+            connector = MySQLdb.connect(db="SystemMonitor",
                                         passwd="mysqlAdmin", user="root",
                                         host=DATABASE_HOST)
-            for tablename in ("ClientResourceUse", "CpuUse", "MemoryUse",
-                              "SummaryData", "UsersLoggedIn"):
-                earliest_time = time.time() - self.days_back * 24 * 3600
-                query = "DELETE FROM %s WHERE Time < %d" % (
-                    tablename, earliest_time)
-                connector.query(query)
-                connector.commit()
-        except MySQLdb.DatabaseError as err:
-            syslog.syslog(syslog.LOG_ERR, "Error in modifying db: %s" % err)
-            raise MySQLdb.DatabaseError
-
-    def generate_sql_dump(self):
-        global DATABASE_HOST
-        db_copy_name = "SystemMonitorCopy"
-        copy_command = 'mysqldbcopy --source=root:mysqlAdmin@%s ' % DATABASE_HOST + \
-                       '--destination=root:mysqlAdmin@%s  ' % DATABASE_HOST + \
-                       'SystemMonitor:%s' % db_copy_name
-        dump_command = 'mysqldump -u root --password="mysqlAdmin" --databases %s > %s' \
-                       % (db_copy_name, self.sql_filename)
-        drop_command = 'echo "DROP DATABASE IF EXISTS %s" | mysql -u root --password="mysqlAdmin"' \
-                       % db_copy_name
-        try:
-            #assure nothing left from a previous run
-            localFunctions.run_command(drop_command, reraise_error=True)
-            localFunctions.run_command(copy_command, reraise_error=True)
-            self.modify_sql_db(db_copy_name)
-            localFunctions.run_command(dump_command, reraise_error=True)
-            localFunctions.run_command(drop_command, reraise_error=True)
-        except (subprocess.CalledProcessError, MySQLdb.DatabaseError) as err:
+            self.exporter = monitorExport.IncrementalExporter(
+                connector, self.sql_filename, self.days_back,
+                school_name=self.schoolname)
+            row_counts = self.exporter.export()
+            connector.close()
+            InfoLogger.info("Exported rows: %s" % row_counts)
+            return True
+        except (OSError, MySQLdb.DatabaseError) as err:
+            self.exporter = None
             ErrorLogger.error("Error in create_sql_dump: %s" % err)
+            return False
 
+    def commit_sql_dump(self):
+        """
+        Called after the export has been sent so that the next export
+        starts where this one ended.
+        """
+        if self.exporter:
+            try:
+                self.exporter.commit()
+            except OSError as err:
+                ErrorLogger.error("Failed to save export state: %s" % err)
 
     def generate_sql_attachment_files(self):
-        self.generate_sql_dump()
-        sql_file_handler = FileHandler(self.sql_filename, remove_original=True)
+        if not self.generate_sql_dump():
+            return None
+        sql_file_handler = FileHandler(self.sql_filename, remove_original=True,
+                                       compress=False)
         sql_file_handler.process_file()
         return sql_file_handler
 
     def generate_csv_attachment_file(self):
         reporter.generate_csv_report(self.csv_filename)
-        csv_file_handler = FileHandler(self.csv_filename)
+        csv_file_handler = FileHandler(self.csv_filename, remove_original=True)
+        csv_file_handler.process_file()
         return csv_file_handler
 
     def generate_system_check_log(self):
         try:
             system_check_copy =  os.path.join(TMP_DIRECTORY, "systemCheck.log")
-            shutil.copy("/var/log/systemCheck/systemCheck.log",
-                        self.systemCheckLog_filename)
-            system_check_file_handler = FileHandler(self.systemCheckLog_filename)
+            shutil.copy(self.systemCheckLog_filename, system_check_copy)
+            system_check_file_handler = FileHandler(system_check_copy,
+                                                    remove_original=True)
+            system_check_file_handler.process_file()
             return system_check_file_handler
         except IOError as err:
             ErrorLogger.error("Error in generate_system_check_log: %s" %err)
             return None
 
+    def generate_reports(self):
+        """
+        :return: list of FileHandlers for the files to attach
+        """
+        if not os.path.isdir(TMP_DIRECTORY):
+            os.makedirs(TMP_DIRECTORY, 0o755)
+        handlers = [self.generate_csv_attachment_file(),
+                    self.generate_system_check_log()]
+        if self.include_export:
+            handlers.insert(0, self.generate_sql_attachment_files())
+        return [h for h in handlers if h and h.get_single_file()[0]]
+
 class MessageGenerator:
     def __init__(self, schoolname):
         self.datestring = datetime.date.today().strftime("%m-%d-%Y")
@@ -229,7 +264,7 @@ class MessageGenerator:
             with open(attachment_file, "rb") as f:
                 attachment = MIMEApplication(f.read(), self.mimetype)
                 attachment.add_header('Content-Disposition', 'attachment',
-                                  filename=attachment_file)
+                                  filename=os.path.basename(attachment_file))
                 self.msg.attach(attachment)
         except (OSError, email.errors.MessageError) as err:
             ErrorLogger.error("Failed to create attachment %s: %s"
@@ -248,39 +283,302 @@ def setup_logging():
     info_filename = LOGGING_DIRECTORY + "/info.log"
     error_filename = LOGGING_DIRECTORY + "/error.log"
     if not os.path.exists(LOGGING_DIRECTORY):
-        os.makedirs(LOGGING_DIRECTORY,0755)
+        os.makedirs(LOGGING_DIRECTORY,0o755)
         os.chown(LOGGING_DIRECTORY,1,143)
     return backgroundFunctions.create_loggers(info_filename, error_filename)
 
 # ********************************************************************
 
 
-if __name__ == "__main__":
-    try:
-        commandline_parser = localFunctions.initialize_app(name="sendInfoSMTP",
-                                                           version=VERSION,
-                                                           description="Send system monitor email to fixed destination",
-                                                           perform_parse=False)
-        commandline_parser.add_argument("--days-back", dest="days_back",
-                                        default=NUM_DAYS_RECORDS, type=int,
-                                        help="previous number of days reported")
-        commandline_parser.add_argument("--max-attach-size", dest="max_attach_size",
-                                        default=MAX_ATTACH_SIZE, type=int,
-                                        help="number of megabyes per email attachment")
-        commandline_parser.add_argument("--email-dest", dest="email_dest",
-                                        type=str, default=EMAIL_RECEIVER,
-                                        help="destination email address")
-        args = commandline_parser.parse_args()
-        ERRO
-        school_name = reporter.get_schoolname()
-        report_generator = ReportsGenerator( school_name, SQL_DUMP_FILENAME,
-                                             CSV_FILENAME, SYSTEM_CHECK_LOG_FILENAME,
-                                             args.days_back, args.max_attach_size)
+class Outbox:
+    """
+    A spool directory of messages waiting to be sent. Each queued report is a
+    subdirectory holding a state.json file and one complete message file for
+    each part. Parts are marked as sent individually so that a report that was
+    split into several messages is resumed at the first unsent part. A failed
+    send is retried after a delay that doubles with each failure.
+    """
 
-        syslog.syslog(
-            "sendInfoSMTP v. %s Preparing system monitor information. %i days"
-            % (VERSION, args.days_back))
-        report_generator.generate_reports()
+    def __init__(self, outbox_directory=OUTBOX_DIRECTORY, max_size=OUTBOX_MAX_SIZE,
+                 smtp_host=SMTP_HOST, smtp_port=SMTP_PORT):
+        """
+        :param outbox_directory:
+        :param max_size: maximum total size of all queued messages in megabytes
+        :param smtp_host:
+        :param smtp_port:
+        """
+        self.outbox_directory = outbox_directory
+        self.max_size = max_size * 1024 * 1024
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
 
+    def get_entry_names(self):
+        """
+        :return: list of queued entry directory names, oldest first
+        """
+        try:
+            return sorted([name for name in os.listdir(self.outbox_directory)
+                           if os.path.isfile(os.path.join(self.outbox_directory, name,
+                                                          "state.json"))])
+        except OSError:
+            return []
 
+    def read_state(self, entry_name):
+        state_filename = os.path.join(self.outbox_directory, entry_name, "state.json")
+        try:
+            with open(state_filename, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as err:
+            ErrorLogger.error("Unreadable outbox state %s: %s" % (state_filename, err))
+            return None
 
+    def write_state(self, entry_name, state):
+        state_filename = os.path.join(self.outbox_directory, entry_name, "state.json")
+        with open(state_filename + ".new", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(state_filename + ".new", state_filename)
+
+    def get_entry_size(self, entry_name):
+        entry_dir = os.path.join(self.outbox_directory, entry_name)
+        size = 0
+        for filename in os.listdir(entry_dir):
+            try:
+                size += os.path.getsize(os.path.join(entry_dir, filename))
+            except OSError:
+                pass
+        return size
+
+    def is_full(self):
+        """
+        :return: True if the queued messages have reached the maximum size
+        """
+        return sum([self.get_entry_size(name) for name in self.get_entry_names()]) \
+            >= self.max_size
+
+    def remove_entry(self, entry_name):
+        shutil.rmtree(os.path.join(self.outbox_directory, entry_name),
+                      ignore_errors=True)
+
+    def enqueue(self, report_id, messages, holds_export=False):
+        """
+        Write all messages for one report to a new outbox entry. The entry is
+        written under a temporary name and renamed when complete so that a
+        partly written entry is never sent.
+        :param report_id: a name for the report, used in the status listing
+        :param messages: list of email.message.Message, one for each part
+        :param holds_export: True if the messages carry a database export
+            whose watermarks have been moved past its rows
+        :return: the entry name
+        """
+        os.makedirs(self.outbox_directory, 0o700, exist_ok=True)
+        entry_name = "%d-%s" % (int(time.time()), report_id)
+        temp_dir = os.path.join(self.outbox_directory, "." + entry_name)
+        os.makedirs(temp_dir, 0o700, exist_ok=True)
+        parts = []
+        for part_number, message in enumerate(messages):
+            part_filename = "part-%03d.eml" % part_number
+            with open(os.path.join(temp_dir, part_filename), "wb") as f:
+                f.write(message.as_bytes())
+            parts.append({"file": part_filename, "sent": False})
+        state = {"id": report_id, "created": int(time.time()),
+                 "sender": EMAIL_SENDER, "receiver": EMAIL_RECEIVER,
+                 "attempts": 0, "next_attempt": 0, "last_error": "",
+                 "holds_export": holds_export, "parts": parts}
+        with open(os.path.join(temp_dir, "state.json"), "w") as f:
+            json.dump(state, f, indent=2)
+        os.rename(temp_dir, os.path.join(self.outbox_directory, entry_name))
+        self.enforce_size_limit()
+        return entry_name
+
+    def enforce_size_limit(self):
+        """
+        Remove the oldest entries until the total size is below the maximum.
+        The newest entry is always kept. An entry that holds a database
+        export is never removed: its rows would not be exported again.
+        Instead no new export is queued while the outbox is full, see
+        is_full, so the exports cannot grow the outbox past the maximum by
+        more than one report.
+        :return: list of the removed entry names
+        """
+        removed = []
+        entry_names = self.get_entry_names()
+        sizes = {name: self.get_entry_size(name) for name in entry_names}
+        total_size = sum(sizes.values())
+        for entry_name in entry_names[:-1]:
+            if total_size <= self.max_size:
+                break
+            state = self.read_state(entry_name)
+            if not state or state.get("holds_export"):
+                continue
+            total_size -= sizes[entry_name]
+            self.remove_entry(entry_name)
+            removed.append(entry_name)
+            ErrorLogger.error("Outbox full. Dropped unsent report %s" % entry_name)
+        return removed
+
+    def send_entry(self, entry_name, state, smtp):
+        """
+        Send each unsent part, saving the state after each one.
+        :return: True if all parts have been sent
+        """
+        entry_dir = os.path.join(self.outbox_directory, entry_name)
+        for part in state["parts"]:
+            if part["sent"]:
+                continue
+            with open(os.path.join(entry_dir, part["file"]), "rb") as f:
+                message_bytes = f.read()
+            smtp.sendmail(state["sender"], [state["receiver"]], message_bytes)
+            part["sent"] = True
+            self.write_state(entry_name, state)
+        return True
+
+    def process(self, now=None):
+        """
+        Try to send every entry whose retry time has come, oldest first.
+        The connection is opened only if there is something to send.
+        :param now: the current time, for testing
+        :return: (number of entries sent, number still queued)
+        """
+        if now is None:
+            now = time.time()
+        sent_count = 0
+        entry_names = self.get_entry_names()
+        due_entries = []
+        for entry_name in entry_names:
+            state = self.read_state(entry_name)
+            if state and state["next_attempt"] <= now:
+                due_entries.append((entry_name, state))
+        if not due_entries:
+            return 0, len(entry_names)
+        smtp = None
+        try:
+            smtp = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=120)
+            for entry_name, state in due_entries:
+                self.send_entry(entry_name, state, smtp)
+                self.remove_entry(entry_name)
+                sent_count += 1
+                InfoLogger.info("Sent report %s to %s" % (state["id"], state["receiver"]))
+        except (OSError, smtplib.SMTPException) as err:
+            # the connection failed so every remaining due entry is rescheduled
+            for entry_name, state in due_entries[sent_count:]:
+                state["attempts"] += 1
+                state["last_error"] = str(err)
+                state["next_attempt"] = now + min(
+                    RETRY_BASE_DELAY * 2 ** (state["attempts"] - 1), RETRY_MAX_DELAY)
+                self.write_state(entry_name, state)
+            ErrorLogger.error("Failed to send queued reports: %s" % err)
+        finally:
+            if smtp:
+                try:
+                    smtp.quit()
+                except (OSError, smtplib.SMTPException):
+                    pass
+        return sent_count, len(entry_names) - sent_count
+
+    def get_status_text(self):
+        """
+        :return: printable listing of the queued entries
+        """
+        lines = []
+        for entry_name in self.get_entry_names():
+            state = self.read_state(entry_name)
+            if not state:
+                continue
+            sent_parts = len([p for p in state["parts"] if p["sent"]])
+            lines.append("%s  queued %s  parts sent %d/%d  attempts %d  size %s"
+                         % (state["id"], time.ctime(state["created"]),
+                            sent_parts, len(state["parts"]), state["attempts"],
+                            localFunctions.convert_to_readable(
+                                max(1, self.get_entry_size(entry_name) // 1024))))
+            if state["attempts"]:
+                lines.append("    next attempt %s  last error: %s"
+                             % (time.ctime(state["next_attempt"]), state["last_error"]))
+        if not lines:
+            lines.append("Outbox is empty")
+        return "\n".join(lines)
+
+
+def generate_messages(school_name, file_handlers):
+    """
+    Create one message for each attachment file or each piece of a split file.
+    :return: list of messages
+    """
+    attachments = []
+    for handler in file_handlers:
+        chunks, chunk_md5sums = handler.get_split_files()
+        if chunks:
+            attachments.extend([(f, chunk_md5sums[f]) for f in chunks])
+        else:
+            attachments.append(handler.get_single_file())
+    messages = []
+    for part_number, (attachment_file, md5sum) in enumerate(attachments):
+        message_generator = MessageGenerator(school_name)
+        message_generator.create_message(
+            "part %d of %d" % (part_number + 1, len(attachments)),
+            "System monitor reports for %s\n%s md5sum: %s"
+            % (school_name, os.path.basename(attachment_file), md5sum))
+        message_generator.add_attachment(attachment_file)
+        messages.append(message_generator.get_message())
+    return messages
+
+
+if __name__ == "__main__":
+    commandline_parser = localFunctions.initialize_app(name="sendInfoSMTP",
+                                                       version=VERSION,
+                                                       description="Send system monitor email to fixed destination",
+                                                       perform_parse=False)
+    commandline_parser.add_argument("--days-back", dest="days_back",
+                                    default=NUM_DAYS_RECORDS, type=int,
+                                    help="maximum number of days of records in an export")
+    commandline_parser.add_argument("--max-attach-size", dest="max_attach_size",
+                                    default=MAX_ATTACH_SIZE, type=int,
+                                    help="number of megabyes per email attachment")
+    commandline_parser.add_argument("--email-dest", dest="email_dest",
+                                    type=str, default=EMAIL_RECEIVER,
+                                    help="destination email address")
+    commandline_parser.add_argument("--smtp-host", dest="smtp_host",
+                                    type=str, default=SMTP_HOST,
+                                    help="mail server used to send the reports")
+    commandline_parser.add_argument("--smtp-port", dest="smtp_port",
+                                    type=int, default=SMTP_PORT)
+    commandline_parser.add_argument("--outbox", dest="outbox",
+                                    type=str, default=OUTBOX_DIRECTORY,
+                                    help="directory of queued messages")
+    commandline_parser.add_argument("--status", dest="status", action="store_true",
+                                    help="list the queued messages and exit")
+    commandline_parser.add_argument("--send-queued", dest="send_queued",
+                                    action="store_true",
+                                    help="only retry queued messages, do not create new reports")
+    args = commandline_parser.parse_args()
+    InfoLogger, ErrorLogger = setup_logging()
+    outbox = Outbox(args.outbox, OUTBOX_MAX_SIZE, args.smtp_host, args.smtp_port)
+    if args.status:
+        print(outbox.get_status_text())
+        sys.exit(0)
+    EMAIL_RECEIVER = args.email_dest
+    MAX_ATTACH_SIZE = args.max_attach_size
+    if not args.send_queued:
+        school_name = reporter.get_school_name()
+        include_export = not outbox.is_full()
+        if not include_export:
+            ErrorLogger.error("Outbox full. The database export waits until "
+                              "the queued reports have been sent")
+        report_generator = ReportsGenerator(school_name, CSV_FILENAME,
+                                            SYSTEM_CHECK_LOG_FILENAME,
+                                            args.days_back, args.max_attach_size,
+                                            include_export)
+        syslog.syslog(
+            "sendInfoSMTP v. %s Preparing system monitor information. %i days"
+            % (VERSION, args.days_back))
+        file_handlers = report_generator.generate_reports()
+        try:
+            outbox.enqueue(report_generator.id,
+                           generate_messages(school_name, file_handlers),
+                           holds_export=bool(report_generator.exporter))
+            # the export is safely queued so the next one can start after it
+            report_generator.commit_sql_dump()
+        except OSError as err:
+            ErrorLogger.error("Failed to queue reports: %s" % err)
+        shutil.rmtree(TMP_DIRECTORY, ignore_errors=True)
+    sent, waiting = outbox.process()
+    syslog.syslog("sendInfoSMTP sent %d reports, %d waiting" % (sent, waiting))
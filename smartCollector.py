@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Collect the SMART data of every disk a few times a day and keep a history
+for each disk, indexed by its serial number so that the history follows the
+disk when its device name changes.
+
+smartctl is run with "-n standby" so a sleeping disk, such as a USB mirror
+disk that is not in use, is not spun up. Its last sample is kept.
+
+systemCheck reads the latest sample from the history instead of running
+smartctl itself and warns on trends such as a growing number of pending
+sectors, not just on the overall PASSED/FAILED result.
+The collector is run by smart-collector.timer.
+"""
+
+import json
+import os
+import os.path
+import subprocess
+import time
+import localFunctions
+import backgroundFunctions
+
+PROGRAM_NAME = "smartCollector"
+PROGRAM_DESCRIPTION = "Record the SMART data of all disks"
+PROGRAM_VERSION = "1.0"
+ERROR_LOGFILE = "/var/log/smart/collectorError.log"
+INFO_LOGFILE = "/var/log/smart/collectorInfo.log"
+HISTORY_FILENAME = "/var/lib/smart/history.json"
+SMARTCTL = "/usr/local/sbin/smartctl"
+# smartctl exit status bits
+SMARTCTL_OPEN_FAILED = 0x02
+SMARTCTL_DISK_FAILING = 0x08
+# samples older than this are dropped from the history
+MAX_HISTORY_AGE = 400 * 24 * 3600
+# a sample older than this is not used by the checks. The collector runs
+# every six hours.
+MAX_SAMPLE_AGE = 14 * 3600
+# the increase of a counter is measured against the sample at least this old
+TREND_WINDOW = 7 * 24 * 3600
+MAX_TEMPERATURE = 55
+# ATA attribute id: sample key
+ATA_ATTRIBUTES = {5: "reallocated_sectors", 187: "reported_uncorrectable",
+                  197: "pending_sectors", 198: "offline_uncorrectable",
+                  199: "crc_errors"}
+NVME_VALUES = {"media_errors": "media_errors", "critical_warning": "critical_warning",
+               "percentage_used": "percentage_used",
+               "num_err_log_entries": "error_log_entries"}
+# counters that should never increase on a healthy disk
+TREND_COUNTERS = ("reallocated_sectors", "pending_sectors", "offline_uncorrectable",
+                  "reported_uncorrectable", "crc_errors", "media_errors")
+COUNTER_DESCRIPTIONS = {"reallocated_sectors": "reallocated sectors",
+                        "pending_sectors": "sectors waiting to be reallocated",
+                        "offline_uncorrectable": "uncorrectable sectors",
+                        "reported_uncorrectable": "uncorrectable read errors",
+                        "crc_errors": "cable (CRC) errors",
+                        "media_errors": "media errors"}
+InfoLogger = None
+ErrorLogger = None
+
+
+def get_disk_devices():
+    """
+    :return: list of device paths of the sd and nvme disks, including USB disks
+    """
+    devices = []
+    try:
+        for line in localFunctions.run_command("lsblk -d -n -o NAME,TYPE",
+                                               reraise_error=True, merge_stderr=False):
+            columns = line.split()
+            if len(columns) == 2 and columns[1] == "disk" and \
+                    columns[0].startswith(("sd", "nvme")):
+                devices.append("/dev/" + columns[0])
+    except subprocess.CalledProcessError:
+        pass
+    return devices
+
+
+def is_in_standby(device):
+    """
+    :return: True if the disk is asleep. It is not woken to find out.
+    """
+    process = subprocess.run([SMARTCTL, "-i", "-n", "standby", device],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             universal_newlines=True)
+    return bool(process.returncode & SMARTCTL_OPEN_FAILED) and \
+        "STANDBY" in process.stdout.upper()
+
+
+def read_smart_data(device):
+    """
+    Run smartctl once for the device.
+    :param device:
+    :return: the smartctl json output as a dictionary and the exit status.
+        The dictionary is empty if the disk is asleep or cannot be read.
+    """
+    command = [SMARTCTL, "--json", "-a", "-n", "standby", device]
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             universal_newlines=True)
+    try:
+        smart_data = json.loads(process.stdout)
+    except ValueError:
+        smart_data = {}
+    if process.returncode & SMARTCTL_OPEN_FAILED or "serial_number" not in smart_data:
+        # in standby or not a SMART device
+        smart_data = {}
+    return smart_data, process.returncode
+
+
+def create_sample(smart_data, exit_status, sample_time=None):
+    """
+    Extract the values that are kept in the history.
+    :return: dictionary of values
+    """
+    sample = {"time": sample_time or time.time(),
+              "passed": smart_data.get("smart_status", {}).get("passed",
+                                                              not exit_status & SMARTCTL_DISK_FAILING),
+              "power_on_hours": smart_data.get("power_on_time", {}).get("hours"),
+              "temperature": smart_data.get("temperature", {}).get("current")}
+    for attribute in smart_data.get("ata_smart_attributes", {}).get("table", []):
+        if attribute.get("id") in ATA_ATTRIBUTES:
+            sample[ATA_ATTRIBUTES[attribute["id"]]] = attribute.get("raw", {}).get("value")
+    nvme_log = smart_data.get("nvme_smart_health_information_log", {})
+    for name, key in NVME_VALUES.items():
+        if name in nvme_log:
+            sample[key] = nvme_log[name]
+    return sample
+
+
+def read_history(history_filename=HISTORY_FILENAME):
+    try:
+        with open(history_filename, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_history(history, history_filename=HISTORY_FILENAME):
+    os.makedirs(os.path.dirname(history_filename), 0o755, exist_ok=True)
+    with open(history_filename + ".new", "w") as f:
+        json.dump(history, f)
+    os.replace(history_filename + ".new", history_filename)
+
+
+def collect(history, devices, now=None):
+    """
+    Add a sample for each disk that is awake to the history.
+    :return: the updated history
+    """
+    now = now or time.time()
+    for device in devices:
+        smart_data, exit_status = read_smart_data(device)
+        if not smart_data:
+            if InfoLogger:
+                InfoLogger.info("%s: asleep or no SMART data, not sampled" % device)
+            continue
+        serial = smart_data["serial_number"]
+        disk_history = history.setdefault(serial, {"samples": []})
+        disk_history["model"] = smart_data.get("model_name", "")
+        disk_history["device"] = device
+        disk_history["samples"].append(create_sample(smart_data, exit_status, now))
+        disk_history["samples"] = [s for s in disk_history["samples"]
+                                   if now - s["time"] < MAX_HISTORY_AGE]
+    return history
+
+
+def get_boot_time():
+    try:
+        with open("/proc/uptime", "r") as f:
+            return time.time() - float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+def get_disk_history(device, history=None, max_age=MAX_SAMPLE_AGE):
+    """
+    Find the history of the disk that is now the device. Device names are
+    assigned at boot so a history last collected before the boot is not used.
+    :param device:
+    :param history: the full history or None to read it
+    :param max_age: seconds since the latest sample
+    :return: (serial, disk history) or (None, None) if there is no usable sample
+    """
+    if history is None:
+        history = read_history()
+    boot_time = get_boot_time()
+    for serial, disk_history in history.items():
+        samples = disk_history.get("samples")
+        if disk_history.get("device") == device and samples and \
+                samples[-1]["time"] > boot_time and \
+                time.time() - samples[-1]["time"] < max_age:
+            return serial, disk_history
+    return None, None
+
+
+def find_trend_warnings(samples, now=None):
+    """
+    Compare the latest sample with the newest sample at least TREND_WINDOW
+    old, or the oldest one if the history is shorter.
+    :param samples: the samples of one disk, oldest first
+    :return: list of warning texts
+    """
+    warnings = []
+    if not samples:
+        return warnings
+    now = now or time.time()
+    latest = samples[-1]
+    reference = samples[0]
+    for sample in samples:
+        if now - sample["time"] >= TREND_WINDOW:
+            reference = sample
+    for counter in TREND_COUNTERS:
+        current = latest.get(counter)
+        if current is None:
+            continue
+        previous = reference.get(counter)
+        if previous is not None and current > previous:
+            warnings.append("%s increased from %d to %d since %s" % (
+                COUNTER_DESCRIPTIONS[counter], previous, current,
+                time.strftime("%d %b %Y", time.localtime(reference["time"]))))
+        elif counter == "pending_sectors" and current > 0:
+            warnings.append("%d %s" % (current, COUNTER_DESCRIPTIONS[counter]))
+    if latest.get("critical_warning"):
+        warnings.append("NVMe critical warning %d" % latest["critical_warning"])
+    if latest.get("temperature") and latest["temperature"] > MAX_TEMPERATURE:
+        warnings.append("temperature %d C" % latest["temperature"])
+    return warnings
+
+
+if __name__ == '__main__':
+    commandline_parser = localFunctions.initialize_app(PROGRAM_NAME, PROGRAM_VERSION,
+                                                       PROGRAM_DESCRIPTION,
+                                                       perform_parse=False)
+    commandline_parser.add_argument("--show", dest="show", action="store_true",
+                                    help="print the latest sample of each disk")
+    args = commandline_parser.parse_args()
+    if args.show:
+        for disk_serial, disk_info in read_history().items():
+            print("%s %s (%s):" % (disk_info.get("model", ""), disk_serial,
+                                   disk_info.get("device", "")))
+            print("   %s" % disk_info["samples"][-1])
+            for warning in find_trend_warnings(disk_info["samples"]):
+                print("   WARNING: %s" % warning)
+    else:
+        localFunctions.confirm_root_user(PROGRAM_NAME)
+        InfoLogger, ErrorLogger = backgroundFunctions.create_loggers(INFO_LOGFILE,
+                                                                     ERROR_LOGFILE)
+        try:
+            write_history(collect(read_history(), get_disk_devices()))
+        except OSError as err:
+            ErrorLogger.error("SMART collection failed: %s" % err)
@@ -3,8 +3,27 @@
 This file contains the python modules for text io and GUI for the systemCheck
 program. All texts that are used in the program output are maintained in this
 file in sysChkTxt.
+
+Every message is first made into a record: a dictionary with the check that
+reported it, the severity, the message name and values, the text and, for
+problems, whether a fix was attempted and its result. The text and GUI
+reporters show the records and the records can be written as json lines so
+that other programs do not have to read the text.
 """
-import textwrap, re, sys, time, pwd, os, io
+import textwrap, re, sys, time, pwd, os, io, json
+
+# record severities
+SEVERITY_PROGRESS = "progress"
+SEVERITY_INFORMATION = "information"
+SEVERITY_PROBLEM = "problem"
+SEVERITY_ACTION = "action required"
+SEVERITY_FIXABLE = "fixable problem"
+SEVERITY_FIX = "fix"
+SEVERITY_FIX_RESULT = "fix result"
+SEVERITY_SERIOUS = "serious problem"
+SEVERITY_SUMMARY = "summary"
+PROBLEM_SEVERITIES = (SEVERITY_PROBLEM, SEVERITY_ACTION, SEVERITY_FIXABLE,
+                      SEVERITY_SERIOUS)
 
 
 class SysChkText:
@@ -27,6 +46,10 @@ class SysChkText:
             "These required system processes have stopped:%s\n Will now restart them."
         self.sysChkTxtDict["failed process"] = \
             "This required system process has stopped:%s Will now restart it."
+        self.sysChkTxtDict["stopped processes"] = \
+            "These required system processes have stopped:%s"
+        self.sysChkTxtDict["stopped process"] = \
+            "This required system process has stopped:%s"
         self.sysChkTxtDict["failed restart processes"] = \
             "These required system processes were not successfully restarted or\n" + \
             "          failed again just after restart: %s"
@@ -45,13 +68,23 @@ class SysChkText:
         self.sysChkTxtDict["process restart successful"] = \
             """All required processes now running.  This may fix your problem.
             Please run System Check again to check if all problems are solved."""
+        self.sysChkTxtDict["flapping processes"] = \
+            "These required system processes keep failing and being restarted:%s"
+        self.sysChkTxtDict["flapping processes action"] = \
+            """Look at the reason for the failures with the command
+        "sudo journalctl -e -u %s"
+        If you cannot find and correct the problem, reboot the server."""
         self.sysChkTxtDict["proxy test failed"] = \
             """The proxy server refuses the connection. Will try squid process restart. """
+        self.sysChkTxtDict["proxy not working"] = \
+            """The proxy server refuses the connection."""
         self.sysChkTxtDict["proxy restart successful"] = \
             """The proxy server is now working correctly."""
         self.sysChkTxtDict["kahn test failed"] = \
             """The server for Kahn Academy is not running correctly.
             Will try server restart. """
+        self.sysChkTxtDict["kahn not working"] = \
+            """The server for Kahn Academy is not running correctly."""
         self.sysChkTxtDict["kahn restart successful"] = \
             """The server for Kahn Academy is now working correctly"""
         self.sysChkTxtDict["kahn needs further work problem"] = \
@@ -99,6 +132,14 @@ class SysChkText:
         Run System Check once more. If the same process is still a problem
         type "sudo kill -9 ID".
         Check the manual or Reneal Superusers Group for further information."""
+        self.sysChkTxtDict["problem user"] = \
+            """The programs of a single user are using too much of the server."""
+        self.sysChkTxtDict["problem user action"] = \
+            """Problem User:
+%s
+        All other users are slowed while this continues. Ask the user to close
+        some programs. If that does not help, ask the user to log out and log in again.
+        Check the manual or Reneal Superusers Group for further information."""
 
     # ----------------------------------------------------------------------
     def add_disk_check_texts(self):
@@ -121,6 +162,13 @@ class SysChkText:
         self.sysChkTxtDict["backup disk failure action"] = \
             """The backup disk %s  should be replaced and rebuilt. 
         No user file backups can be performed until is replaced."""
+        self.sysChkTxtDict["disk smart warning"] = \
+            """WARNING: The %s disk drive (%s) still works but it may fail soon:
+   %s"""
+        self.sysChkTxtDict["disk smart warning action"] = \
+            """Make sure that the mirror to the backup disk is current.
+Run "sudo smartCollector.py --show" and send the result for the disk
+with serial number %s to the Reneal team."""
         self.sysChkTxtDict["running on backup disk"] = \
             """The server is running from the backup disk drive."""
         self.sysChkTxtDict["disk missing"] = \
@@ -251,6 +299,7 @@ class SysChkText:
             """There is a problem with the network caching squid proxy service."""
         self.sysChkTxtDict["nameserver bad"] = \
             """There is a problem with the way the server finds network addresses."""
+        self.sysChkTxtDict["dns query result"] = "Nameserver %s, %s: %s in %.0f ms"
         self.sysChkTxtDict["internet interface down"] = \
             """The internet is down. The network connection from the server to the internet
         router is bad."""
@@ -282,6 +331,9 @@ class SysChkText:
         returns and if necessary report the problem to your internet service 
         provider. 
         Read the manual for your internet router for other information."""
+        self.sysChkTxtDict["internet blocked"] = \
+            """The server finds network addresses but cannot browse the internet.
+        There might be a problem with the server firewall."""
         self.sysChkTxtDict["firewall restart"] = \
             """There might be a problem with the server firewall. I will try restarting it.
         Run System Check again to confirm fix. If the problem still exists then it
@@ -292,6 +344,10 @@ class SysChkText:
         restart it and run System Check again. If the restart does not help then there may
         be some problem with this interface."""
         self.sysChkTxtDict["internet quality"] = "Internet connection quality: %s"
+        self.sysChkTxtDict["internet quality details"] = \
+            "%.1f%% of %d pings lost, round trip %.0f ms (90%% under %.0f ms), jitter %.0f ms"
+        self.sysChkTxtDict["internet quality trend"] = \
+            "Internet connection quality over the last week:\n%s"
 
     def add_other_texts(self):
         self.sysChkTxtDict["no backup log"] = \
@@ -308,10 +364,14 @@ class SysChkText:
         minutes and could slightly slow down your users. If this error still exists
         after 15 minutes look at the end of the file /var/log/mirror/mirror.log to
         see the problem."""
+        self.sysChkTxtDict["mirror running"] = \
+            """Mirror %s is running: %s copied (%d%%) at %s/s, about %s remaining."""
         self.sysChkTxtDict["review mirror file"] = \
             """Click the View System Logs button and choose "mirror.log" in the result
         window. Scroll to the end of the  text window. Then take a photo of the window
         with the text and send to the Reneal team."""
+        self.sysChkTxtDict["partition nearly full"] = \
+            """The partition %s has only %s (%.1f%%) free."""
         self.sysChkTxtDict["os partition full"] = \
             """The system partition "/" has only %s (%.1f%%) free."""
         self.sysChkTxtDict["clean os partition"] = \
@@ -463,6 +523,9 @@ class SysChkText:
             "Starting test result analysis"
         self.sysChkTxtDict["finished analysis"] = \
             "Completed test result analysis"
+        self.sysChkTxtDict["checks cancelled"] = \
+            """System Check was cancelled. The checks that had not started were
+            not run and no problems were fixed."""
 
     # ----------------------------------------------------------------------
     def load_texts(self):
@@ -492,7 +555,11 @@ class Reporter:
     # ----------------------------------------------------------------------
     def __init__(self, config, gui_connector=None, report_progress_messages=False,
                  output_filename="", username="", line_width=70, verbose=False,
-                 use_stringbuffer=False):
+                 use_stringbuffer=False, records_filename=""):
+        """
+        :param records_filename: file that the records are appended to as
+            json lines at cleanup
+        """
         if gui_connector:
             self.gui_reporter = GuiReporter(config, gui_connector, report_progress_messages,
                                             output_filename)
@@ -509,6 +576,9 @@ class Reporter:
         self.log_stringbuffer = io.StringIO()
         self.action_messages = []
         self.suggest_reboot=False
+        self.records = []
+        self.records_filename = records_filename
+        self.current_check = ""
         try:
             if self.output_filename:
                 self.output_file = open(self.output_filename, 'a')
@@ -527,6 +597,7 @@ class Reporter:
                   % (output_filename, e))
         self.problems_found = 0
         self.problems_fixed = 0
+        self.fixes_started = 0
         self.further_action_required = False
         self.serious_problems = False
         self.txt_reporter = TextReporter(report_progress_messages,
@@ -540,7 +611,61 @@ class Reporter:
                 "Further Action Required": self.further_action_required,
                 "Number Further Actions": len(self.action_messages),
                 "Serious Problem": self.serious_problems,
-                "Reboot Required": self.suggest_reboot}
+                "Reboot Required": self.suggest_reboot,
+                "Records": self.records}
+
+    # ----------------------------------------------------------------------
+    def set_current_check(self, check_name):
+        """
+        The check or analysis step that the following messages belong to.
+        """
+        self.current_check = check_name
+
+    # ----------------------------------------------------------------------
+    def add_record(self, severity, message_name, values, text):
+        """
+        :return: the new record
+        """
+        record = {"time": round(time.time(), 2), "check": self.current_check,
+                  "severity": severity, "message": message_name,
+                  "values": list(values), "text": text,
+                  "fix_attempted": False, "fix_result": None}
+        self.records.append(record)
+        return record
+
+    # ----------------------------------------------------------------------
+    def find_fixed_problem_record(self):
+        """
+        A fix belongs to the last problem reported by the same check or
+        analysis step. Fixes made outside of a check, or by a step that
+        reported no problem itself, are not linked to any problem.
+        :return: the problem record or None
+        """
+        if not self.current_check:
+            return None
+        for record in reversed(self.records):
+            if record["check"] == self.current_check and \
+                    record["severity"] in PROBLEM_SEVERITIES:
+                return record
+        return None
+
+    # ----------------------------------------------------------------------
+    def render_record(self, record, reformat_text=True, level=1, indent=8,
+                      html_text=""):
+        self.txt_reporter.render_record(record, reformat_text, level, indent)
+        if self.gui_reporter:
+            self.gui_reporter.render_record(record, reformat_text, level, indent,
+                                            html_text)
+
+    # ----------------------------------------------------------------------
+    def write_records(self, records_filename, run_values=None):
+        """
+        Append the records as json lines.
+        :param run_values: dictionary of values added to each line
+        """
+        with open(records_filename, "a") as f:
+            for record in self.records:
+                f.write(json.dumps(dict(run_values or {}, **record), default=str) + "\n")
 
     # ----------------------------------------------------------------------
     def generate_text(self, message_name, values):
@@ -553,13 +678,15 @@ class Reporter:
         return message_text
 
     # ----------------------------------------------------------------------
-    def report_values(self, message_name, values, indent=8):
+    def report_values(self, message_name, values, indent=8, html_text=""):
+        """
+        :param html_text: shown in the GUI instead of the text, for tables
+        """
         if not (message_name and type(values) is list):
             return
-        message_text = self.generate_text(message_name, values)
-        self.txt_reporter.report_values(message_text, indent_count=indent)
-        if self.gui_reporter:
-            self.gui_reporter.report_values(message_text, indent_count=indent)
+        record = self.add_record(SEVERITY_INFORMATION, message_name, values,
+                                 self.generate_text(message_name, values))
+        self.render_record(record, indent=indent, html_text=html_text)
 
     # ----------------------------------------------------------------------
     def adjust_problems_count(self, problems_found_change=0,
@@ -571,10 +698,9 @@ class Reporter:
     def report_progress(self, message_name, values=[], level=1, reformat_text=True):
         if not (message_name and type(values) is list):
             return
-        message_text = self.generate_text(message_name, values)
-        self.txt_reporter.report_progress(message_text, reformat_text, level)
-        if self.gui_reporter:
-            self.gui_reporter.report_progress(message_text, reformat_text, level)
+        record = self.add_record(SEVERITY_PROGRESS, message_name, values,
+                                 self.generate_text(message_name, values))
+        self.render_record(record, reformat_text, level)
 
     # ----------------------------------------------------------------------
     def report_problem(self, message_name, values=[], reformat_text=True,
@@ -585,13 +711,9 @@ class Reporter:
             return
         if increment_problem_count:
             self.problems_found += 1
-        message_text = self.generate_text(message_name, values)
-        self.txt_reporter.report_problem(message_text, reformat_text)
-        if self.gui_reporter:
-            if html_text:
-                self.gui_reporter.report_problem(html_text, False)
-            else:
-                self.gui_reporter.report_problem(message_text, reformat_text)
+        record = self.add_record(SEVERITY_PROBLEM, message_name, values,
+                                 self.generate_text(message_name, values))
+        self.render_record(record, reformat_text, html_text=html_text)
 
     # ----------------------------------------------------------------------
     def report_requires_user_action_problem(self, error_message_name="",  values=[],
@@ -611,16 +733,16 @@ class Reporter:
             error_message_text = ""
         if action_message_name == "tbd":
             action_values = [error_message_name]
+        record = self.add_record(SEVERITY_ACTION, error_message_name, values,
+                                 error_message_text)
         if action_message_name:
-            self.action_messages.append(self.generate_text(action_message_name,
-                                                           action_values))
+            action_text = self.generate_text(action_message_name, action_values)
+            self.action_messages.append(action_text)
+            record["action_message"] = action_message_name
+            record["action_values"] = list(action_values)
+            record["action_text"] = action_text
         if error_message_text:
-            self.txt_reporter.report_problem(error_message_text, reformat_text)
-        if self.gui_reporter and error_message_text:
-            if html_text:
-                self.gui_reporter.report_problem(html_text, False)
-            else:
-                self.gui_reporter.report_problem(error_message_text, reformat_text)
+            self.render_record(record, reformat_text, html_text=html_text)
         self.suggest_reboot = suggest_reboot
 
     # ----------------------------------------------------------------------
@@ -630,10 +752,9 @@ class Reporter:
         if not (message_name and type(values) is list):
             return
         self.problems_found += 1
-        message_text = self.generate_text(message_name, values)
-        self.txt_reporter.report_fixable_problem(message_text, reformat_text)
-        if self.gui_reporter:
-            self.gui_reporter.report_fixable_problem(message_text, reformat_text)
+        record = self.add_record(SEVERITY_FIXABLE, message_name, values,
+                                 self.generate_text(message_name, values))
+        self.render_record(record, reformat_text)
 
     # ----------------------------------------------------------------------
     def report_starting_fix(self, message_name, values=[],
@@ -642,10 +763,14 @@ class Reporter:
         """
         if not (message_name and type(values) is list):
             return
-        message_text = self.generate_text(message_name, values)
-        self.txt_reporter.report_starting_fix(message_text, reformat_text)
-        if self.gui_reporter:
-            self.gui_reporter.report_starting_fix(message_text, reformat_text)
+        self.fixes_started += 1
+        record = self.add_record(SEVERITY_FIX, message_name, values,
+                                 self.generate_text(message_name, values))
+        problem_record = self.find_fixed_problem_record()
+        record["fix_attempted"] = True
+        if problem_record:
+            problem_record["fix_attempted"] = True
+        self.render_record(record, reformat_text)
 
     # ----------------------------------------------------------------------
     def report_fix_result(self, message_name, values=[],
@@ -656,10 +781,15 @@ class Reporter:
             return
         if fixed:
             self.problems_fixed += 1
-        message_text = self.generate_text(message_name, values)
-        self.txt_reporter.report_fix_result(message_text, reformat_text)
-        if self.gui_reporter:
-            self.gui_reporter.report_fix_result(message_text, reformat_text, fixed)
+        record = self.add_record(SEVERITY_FIX_RESULT, message_name, values,
+                                 self.generate_text(message_name, values))
+        problem_record = self.find_fixed_problem_record()
+        record["fix_attempted"] = True
+        record["fix_result"] = "fixed" if fixed else "failed"
+        if problem_record:
+            problem_record["fix_attempted"] = True
+            problem_record["fix_result"] = record["fix_result"]
+        self.render_record(record, reformat_text)
 
     # ----------------------------------------------------------------------
     def report_serious_problem(self, message_name, values=[], reformat_text=True):
@@ -672,10 +802,9 @@ class Reporter:
             return
         self.problems_found += 1
         self.serious_problems = True
-        message_text = self.generate_text(message_name, values)
-        self.txt_reporter.report_serious_problem(message_text, reformat_text)
-        if self.gui_reporter:
-            self.gui_reporter.report_serious_problem(message_text, reformat_text)
+        record = self.add_record(SEVERITY_SERIOUS, message_name, values,
+                                 self.generate_text(message_name, values))
+        self.render_record(record, reformat_text)
 
     # ----------------------------------------------------------------------
     def show_percent_complete(self, percent_complete):
@@ -699,6 +828,12 @@ class Reporter:
         num_actions_required = len(self.action_messages)
         self.suggest_reboot = suggest_rebooting
         suggest_reboot_message = self.generate_suggest_reboot_message(suggest_rebooting)
+        self.set_current_check("")
+        self.add_record(SEVERITY_SUMMARY, "", [self.problems_found, self.problems_fixed,
+                                               num_actions_required, suggest_rebooting],
+                        self.txt_reporter.generate_problems_count_string(
+                            self.problems_found, self.problems_fixed,
+                            num_actions_required))
         if self.config.get_value("problems_only"):
             self.action_messages = []
         self.txt_reporter.report_summary(problem_reported, suggest_reboot_message,
@@ -729,6 +864,13 @@ class Reporter:
         """
         Do final actions to close files, etc
         """
+        if self.records_filename:
+            try:
+                self.write_records(self.records_filename,
+                                   {"run": round(time.time(), 2),
+                                    "profile": self.config.get_value("profile", "")})
+            except OSError as e:
+                print("Unable to write the records to '%s': %s" % (self.records_filename, e))
         if self.output_file:
             self.write_tail()
             self.output_file.close()
@@ -758,6 +900,25 @@ class TextReporter:
             full_text = self.textwrapper.fill(full_text)
         return full_text
 
+    # ----------------------------------------------------------------------
+    def render_record(self, record, reformat_text=True, level=1, indent=8):
+        severity = record["severity"]
+        text = record["text"]
+        if severity == SEVERITY_PROGRESS:
+            self.report_progress(text, reformat_text, level)
+        elif severity == SEVERITY_INFORMATION:
+            self.report_values(text, indent_count=indent)
+        elif severity in (SEVERITY_PROBLEM, SEVERITY_ACTION):
+            self.report_problem(text, reformat_text)
+        elif severity == SEVERITY_FIXABLE:
+            self.report_fixable_problem(text, reformat_text)
+        elif severity == SEVERITY_FIX:
+            self.report_starting_fix(text, reformat_text)
+        elif severity == SEVERITY_FIX_RESULT:
+            self.report_fix_result(text, reformat_text)
+        elif severity == SEVERITY_SERIOUS:
+            self.report_serious_problem(text, reformat_text)
+
     # ----------------------------------------------------------------------
     def report_values(self, message_text, prefix="- ", indent_count=8):
         print(self.generate_output_text((' ' * indent_count) + prefix, message_text, '', False))
@@ -881,6 +1042,25 @@ class GuiReporter:
         """
         return prefix + message_text
 
+    # ----------------------------------------------------------------------
+    def render_record(self, record, reformat_text=True, level=1, indent=8, html_text=""):
+        severity = record["severity"]
+        text = record["text"]
+        if severity == SEVERITY_PROGRESS:
+            self.report_progress(text, reformat_text, level)
+        elif severity == SEVERITY_INFORMATION:
+            self.report_values(html_text or text, indent_count=indent)
+        elif severity in (SEVERITY_PROBLEM, SEVERITY_ACTION):
+            self.report_problem(html_text or text)
+        elif severity == SEVERITY_FIXABLE:
+            self.report_fixable_problem(text)
+        elif severity == SEVERITY_FIX:
+            self.report_starting_fix(text)
+        elif severity == SEVERITY_FIX_RESULT:
+            self.report_fix_result(text, fixed=record["fix_result"] == "fixed")
+        elif severity == SEVERITY_SERIOUS:
+            self.report_serious_problem(text)
+
     # ----------------------------------------------------------------------
     def insert_information_text(self, problem_type, color, message_text, emphasized=False):
         """
@@ -53,6 +53,7 @@ import re
 import subprocess
 import sys
 import tabulate
+import threading
 import time
 import urllib.error
 import urllib.parse
@@ -63,8 +64,15 @@ import PyQt4.QtGui
 import localFunctions
 import localFunctionsPy3
 import backgroundFunctions
+import checkExecutor
+import checkTiming
+import dnsResolver
 import networkFunctions
 import fileManagementFunctions
+import internetQuality
+import mirrorFunctions
+import processFunctions
+import smartCollector
 import rebuildSquidCache
 import cleanUsersTrash
 import sysChkIO
@@ -119,6 +127,12 @@ LoadmonitorDir = '/var/log/loadmonitor'
 MirrorLogFilename = '/var/log/mirror/mirror.log'
 RotatedMirrorLogFilename = '/var/log/mirror/mirror.log.1'
 MaxMirrorAge = 2
+# the percent of all of the server CPU or memory that the processes of a
+# single user may use
+UserCpuLimit = 50.0
+UserMemoryLimit = 40.0
+# minimum seconds between the two process snapshots for the CPU use of each user
+ProcessSampleInterval = 5.0
 GrubFilename = '/boot/grub/grub.cfg'
 StandardGrubFile = 'grub.cfg.OSprimary'
 EmergencyGrubFile = 'grub.cfg.OSprimarySingleDisk'
@@ -128,13 +142,34 @@ SingleDiskMirrorFile = 'mirror.cfg.OSprimarySingleDisk'
 IpPingTargetAddr = "8.8.8.8"
 InternetPingHost = "1.1.1.1"
 VPNHost = "10.8.0.1"
+DnsTestName = "google.com"
 MainServerIpAddress = "192.168.2.1"
 ProblemReported = False
 ProgramVersion = "2.6 LTSP"
 ProgramName = "systemCheck"
 TestTimerStart = 0.0
 LogDirectory = "/var/log/systemCheck"
+# the ping sweep of the local networks and the internet ping and quality
+# measurements must not run at the same time or they measure each other
+ProbeResource = "network probes"
 error_logger = None
+# The kinds of check that can be run. The check names are those of
+# SystemChecker.get_check_steps.
+CheckProfiles = {
+    "full": checkExecutor.CheckProfile(
+        "full", "all checks of the server"),
+    "internet": checkExecutor.CheckProfile(
+        "internet", "the internet connection only",
+        checks=("find_default_router", "check_local_dns_server",
+                "check_internet_ping", "check_dns", "check_internet_browsing",
+                "check_internet_quality"),
+        analysis="internet"),
+    "quick": checkExecutor.CheckProfile(
+        "quick", "everything that does not wait on the network",
+        max_cost=checkExecutor.COST_COMMAND),
+    "login-background": checkExecutor.CheckProfile(
+        "login-background", "the unattended check for the login screen status",
+        max_cost=checkExecutor.COST_NETWORK, allow_fixes=False)}
 
 class Configuration:
     """
@@ -159,6 +194,11 @@ class Configuration:
                  check_internet_quality=True,
                  unused_interfaces=[],
                  single_disk_system=False,
+                 max_parallel_checks=checkExecutor.DEFAULT_MAX_WORKERS,
+                 profile="full",
+                 max_result_age=0,
+                 timing=False,
+                 records_filename="",
                  os_version="16.04",
                  screen_dimensions="1280x1024",
                  inactive_daemons=[],
@@ -239,6 +279,11 @@ class Configuration:
                         config.get("System", "single_disk_system")
                 except configparser.NoOptionError:
                     pass
+                try:
+                    self.config_file_params_dict["max_parallel_checks"] = \
+                        config.getint("System", "max_parallel_checks")
+                except (configparser.NoOptionError, ValueError):
+                    pass
                 val = None
                 try:
                     val = config.get("System", "inactive_daemons")
@@ -316,6 +361,20 @@ class Configuration:
         commandline_parser.add_argument('-g', '--gui', dest="use_gui",
                                         action='store_true',
                                         help='Run the program in a gui interface')
+        commandline_parser.add_argument('--profile', dest="profile",
+                                        choices=sorted(CheckProfiles.keys()),
+                                        help="the set of checks to run (default full)")
+        commandline_parser.add_argument('--max-age', dest="max_result_age",
+                                        type=int, default=0,
+                                        help="use the results of checks made by another run "
+                                             "in the last MAX_AGE seconds")
+        commandline_parser.add_argument('--timing', dest="timing",
+                                        action='store_true',
+                                        help="print the time used by each check at the end "
+                                             "and add it to %s" % checkTiming.TIMING_HISTORY_FILENAME)
+        commandline_parser.add_argument('--json', dest="records_filename",
+                                        help="append the report records to this file as "
+                                             "json lines")
         try:
             opt = commandline_parser.parse_args()
             if opt.no_internet:
@@ -352,6 +411,14 @@ class Configuration:
                 self.command_line_params_dict[
                     'inet_interface'] = opt.inet_interface
             self.command_line_params_dict['use_gui'] = opt.use_gui
+            if opt.profile:
+                self.command_line_params_dict['profile'] = opt.profile
+            if opt.max_result_age:
+                self.command_line_params_dict['max_result_age'] = opt.max_result_age
+            if opt.timing:
+                self.command_line_params_dict['timing'] = True
+            if opt.records_filename:
+                self.command_line_params_dict['records_filename'] = opt.records_filename
         except argparse.ArgumentError as e:
             print("Error in the command line argumennts: %s" % e)
 
@@ -365,8 +432,7 @@ class Configuration:
                     pass
             if self.get_value("write_log"):
                 self.set_value("output_filename",
-                               config_store.get_value(
-                                   "default_output_filename"))
+                               self.get_value("default_output_filename"))
             else:
                 self.set_value("output_filename", "")
 
@@ -388,7 +454,7 @@ class Configuration:
         self.params_dict[param_name] = value
 
 
-class NetworkInterface:
+class NetworkInterface(checkExecutor.CheckResultHolder):
     """
     A class that contains all of the data and the test and analysis
     functions for the individual interface. 
@@ -415,6 +481,7 @@ class NetworkInterface:
         self.up = False
         self.running = False
         self.ip_address = ""
+        self.ip_interface = None
         self.mac_address = ""
         self.tx_packets = 0
         self.rx_packets = 0
@@ -483,68 +550,48 @@ class NetworkInterface:
     # ----------------------------------------------------------------------
     def get_status(self):
         """
-        Read ifconfig for current status of interface
-        """
-
-        ip_address_info_re = re.compile(r'\s*inet addr:([\d.]+)')
-        mac_address_info_re = re.compile(r'\s*HWaddr ([\w:]+)')
-        rx_address_info_re = re.compile(r'\s*RX packets:(\d*)\s*errors:(\d*)')
-        tx_address_info_re = re.compile(r'\s*TX packets:(\d*)\s*errors:(\d*)')
-        detailed_result = str(localFunctions.run_command('/sbin/ifconfig ' +
-                                                         self.name, False,
-                                                         False))
-        self.up = detailed_result.find("UP") != -1
-        self.running = (detailed_result.find("RUNNING") != -1)
-        self.slave_interface = (detailed_result.find("SLAVE") != -1)
-        self.bond_interface = (detailed_result.find("MASTER") != -1)
-        for line in detailed_result.splitlines():
-            address_match_obj = ip_address_info_re.search(line)
-            if address_match_obj:
-                self.ip_address = \
-                    address_match_obj.group(1)
-                continue
-            address_match_obj = mac_address_info_re.search(line)
-            if address_match_obj:
-                self.mac_address = \
-                    address_match_obj.group(1)
-                continue
-            count_match_obj = rx_address_info_re.match(line)
-            if count_match_obj:
-                self.rx_packets = int(count_match_obj.group(1))
-                self.rx_errors = int(count_match_obj.group(2))
-                continue
-            count_match_obj = tx_address_info_re.match(line)
-            if count_match_obj:
-                self.tx_packets = int(count_match_obj.group(1))
-                self.tx_errors = int(count_match_obj.group(2))
+        Read the current status of the interface from sysfs and its address
+        from "ip addr".
+        """
+        state = networkFunctions.read_interface_state(self.name)
+        if not state:
+            self.up = self.running = False
+            return
+        self.up = state.up
+        self.running = state.running
+        self.slave_interface = state.slave
+        self.bond_interface = state.master
+        self.mac_address = state.mac_address
+        self.rx_packets = state.rx_packets
+        self.rx_errors = state.rx_errors
+        self.tx_packets = state.tx_packets
+        self.tx_errors = state.tx_errors
+        addresses = networkFunctions.get_interface_addresses(self.name).get(self.name, [])
+        if addresses:
+            self.ip_interface = addresses[0]
+            self.ip_address = str(addresses[0].ip)
+        else:
+            self.ip_interface = None
+            self.ip_address = ""
 
     # ----------------------------------------------------------------------
-    def get_hosts_on_interface(self):
+    def get_hosts_on_interface(self, host_discovery=None):
         """
-        Use fping to perform a ping sweep across the subnet to look for
-        other active hosts. This should be only on an active, non-slave ethernet
-        network. This should be done only after all status tests are complete
-        to avoid running on a non-functioning interface. The test is only needed
-        on a local interface -- if there is no host (modem) on the internet side
-        it will be diagnosed by other test.
+        Look for other active hosts on the subnet: the neighbours the kernel
+        has just confirmed, then a ping of every other address. This should be only on an active, non-slave
+        ethernet network. This should be done only after all status tests
+        are complete to avoid running on a non-functioning interface. The
+        test is only needed on a local interface -- if there is no host
+        (modem) on the internet side it will be diagnosed by other test.
+        :param host_discovery: networkFunctions.HostDiscovery to use
         """
         if self.fully_active() and self.requires_test() and self.local_interface:
-            address_bytes = self.ip_address.split('.')
-            subnet_address = '%s.%s.%s.0' % (address_bytes[0], address_bytes[1],
-                                             address_bytes[2])
-            command = '/usr/bin/fping  -A -a -r 0 -i 1 -g %s/24 2>/dev/null' \
-                      % subnet_address
+            host_discovery = host_discovery or networkFunctions.HostDiscovery()
             try:
-                result = localFunctions.run_command(command,
-                                                    reraise_error=False,
-                                                    result_as_list=True)
+                self.active_hosts = host_discovery.find_hosts(
+                    self.ip_interface or self.ip_address + "/24", self.name)
                 self.hosts_searched = True
-                for line in result:
-                    if line and (line.find("ICMP") == -1):
-                        host_addr = line.split()[0]
-                        if not (self.ip_address == host_addr):
-                            self.active_hosts.append(host_addr)
-            except subprocess.CalledProcessError:
+            except OSError:
                 pass
 
     # ----------------------------------------------------------------------
@@ -706,7 +753,7 @@ class NetworkInterface:
                         action_values=[self.name, other_end])
 
 
-class DiskInfo:
+class DiskInfo(checkExecutor.CheckResultHolder):
 
     def __init__(self, name, device, primary, system_checker):
         self.name = name
@@ -717,17 +764,33 @@ class DiskInfo:
         self.bad = False
         self.health = ""
         self.active_os = False
+        self.serial = ""
+        self.smart_warnings = []
+        # the time of the smartCollector sample used if it is older than
+        # smartCollector.MAX_SAMPLE_AGE because the disk is asleep
+        self.stale_sample_time = 0.0
 
     def check_disks_health(self):
         """Perform smart check to determine health from report.
+        The latest sample recorded by smartCollector is used if there is a
+        recent one. The disk is then not read at all and the history of the
+        disk is checked for trends. A disk that is asleep is not woken: its
+        last sample is used however old it is. Otherwise smartctl is run
+        directly.
         Note the this now uses /usr/local/sbin/new-smartctl, the most current
         version as of April 2022 which was built on the server. It understands
         nvme disks."""
+        if self.check_smart_history():
+            return
         try:
+            if smartCollector.is_in_standby(self.device):
+                self.exists = True
+                self.check_smart_history(smartCollector.MAX_HISTORY_AGE)
+                return
             self.exists = localFunctions.command_run_successful(
-                '/usr/local/sbin/smartctl --info ' + self.device)
+                '/usr/local/sbin/smartctl --info -n standby ' + self.device)
             try:
-                command = "/usr/local/sbin/smartctl -H " + self.device
+                command = "/usr/local/sbin/smartctl -H -n standby " + self.device
                 check_result = localFunctions.run_command(command,
                                                           result_as_list=False)
                 regexp_options = re.MULTILINE | re.IGNORECASE
@@ -756,11 +819,35 @@ class DiskInfo:
         except Exception as e:
             self.system_checker.function_errors["check_disks_health"] = str(e)
 
+    def check_smart_history(self, max_age=smartCollector.MAX_SAMPLE_AGE):
+        """
+        Use the sample recorded by smartCollector.
+        :param max_age: the oldest sample that may be used, in seconds
+        :return: True if there was a usable sample
+        """
+        serial, disk_history = smartCollector.get_disk_history(self.device,
+                                                               max_age=max_age)
+        if not disk_history:
+            return False
+        latest = disk_history["samples"][-1]
+        if time.time() - latest["time"] >= smartCollector.MAX_SAMPLE_AGE:
+            self.stale_sample_time = latest["time"]
+        self.serial = serial
+        self.exists = True
+        self.bad = not latest.get("passed", True)
+        self.smart_warnings = smartCollector.find_trend_warnings(disk_history["samples"])
+        if self.smart_warnings and self.stale_sample_time:
+            self.smart_warnings.append("(last read %s, the disk is asleep)"
+                                       % time.ctime(self.stale_sample_time))
+        if self.bad:
+            self.health = "SMART overall-health self-assessment test result: FAILED"
+        return True
+
     def set_active_os(self):
         self.active_os = True
 
 
-class SystemChecker:
+class SystemChecker(checkExecutor.CheckResultHolder):
     """
     The class defines the functions to perform many different system checks fo
     the main-server of an LSTP computer center. These functions collect data 
@@ -770,8 +857,22 @@ class SystemChecker:
     # ----------------------------------------------------------------------
     def __init__(self, reporter, config):
         global RequiredDaemons1604, OtherSystemProcesses
-        self.reporter = reporter
+        # the check threads report through it so that their output can be
+        # held until it is their turn. Elsewhere it reports directly.
+        self.reporter = checkExecutor.DeferredReporter(reporter)
         self.config = config
+        self.profile = CheckProfiles.get(config.get_value("profile", "full"),
+                                         CheckProfiles["full"])
+        self.selected_checks = set()
+        self.result_cache = checkExecutor.ResultCache()
+        # directory sizes measured in this run
+        self.directory_sizer = localFunctions.DirectorySizer()
+        self.timer = None
+        if config.get_value("timing", False):
+            self.timer = checkTiming.CheckTimer(self.profile.name)
+        # set from another thread, such as the GUI, to stop the checks
+        self.cancel_event = threading.Event()
+        self.step_listener = None
         self.daemons_list = RequiredDaemons1604
         self.other_system_processes_list = OtherSystemProcesses
         # remove inactive daemons from list
@@ -785,9 +886,15 @@ class SystemChecker:
         self.requires_daemon_recheck = False
         self.function_errors = {}
         self.failed_processes = {}
+        self.flapping_processes = {}
+        self.daemons_status = {}
+        # the disks, mounts and interfaces kept by systemCheckDaemon so that
+        # they are not read again in each run. None to read them.
+        self.topology = None
         self.disks = {}
         self.primary_disk_device = "/dev/sda"
         self.disk_health_bad = False
+        self.disk_smart_warnings = False
         self.disk_mounts = {}
         self.using_backup_disk = False
         self.fs_backup_days_ago = {}
@@ -796,6 +903,7 @@ class SystemChecker:
         self.full_backup_failed = False
         self.last_backup_too_old = True
         self.empty_backup_log_file = True
+        self.mirror_status = {}
         self.required_partitions = []
         self.requires_partition_recheck = False
         self.partition_free_space = {}
@@ -812,6 +920,7 @@ class SystemChecker:
         self.internet_ping_successful = False
         self.internet_accessible = False
         self.internet_quality = "Unknown"
+        self.internet_quality_stats = {}
         self.proxy_ok = False
         self.analyze_internet_access_retries = 0
         self.local_nameserver_alive = False
@@ -821,15 +930,20 @@ class SystemChecker:
         self.local_nameserver_good = False
         self.dns_timed_out = False
         self.initial_nameserver = ""
+        self.dns_results = []
         self.nameserver_changed = False
         self.problem_processes = {}
+        self.problem_users = {}
         self.proxy_server_ok = False
         self.kahn_academy_server_ok = False
         self.suggest_reboot = False
         self.fixed_problems = False
         self.target_number_remaining_accounts = 50
         self.student_accounts_removed = 0
-        self.active_users = localFunctions.get_all_active_users_by_class()
+        # also the start of the interval for the CPU use of each user
+        self.process_snapshot = processFunctions.ProcessSnapshot()
+        self.active_users = localFunctions.get_all_active_users_by_class(
+            self.process_snapshot)
         self.create_unused_interfaces()
         self.cleanup_info_logger = None
         self.delete_files_info_logger = None
@@ -837,21 +951,24 @@ class SystemChecker:
     # ----------------------------------------------------------------------
     def check_daemons(self):
         """ 
-        Check the running processes for all names contained in the process_name
-        list. As each is found remove the name from the list. The list returned
-        has only the processes that could not be found. This list should be
-        empty.
+        Read the state of all daemons in the daemons list with one systemctl
+        call. Daemons that systemd keeps restarting are put in
+        flapping_processes with their restart count and time since the last
+        restart. Other daemons that are not active are put in failed_processes.
         """
         try:
             # initialize failed_processes for fresh run each time
             self.failed_processes = {}
-            for daemon_name in self.daemons_list.keys():
-
-                result = localFunctions.run_command("systemctl is-active %s"
-                                                    % daemon_name)
-                if result[0] != "active":
-                    #    print("%s: %s" %(daemon_name,result[0]))
-                    # if not localFunctions.run_command("systemctl is-active %s |grep 'active'" %daemon_name):
+            self.flapping_processes = {}
+            daemon_names = list(self.daemons_list.keys())
+            self.daemons_status = localFunctions.get_units_status(daemon_names)
+            for daemon_name in daemon_names:
+                status = self.daemons_status.get(daemon_name)
+                # a unit in a crash loop is activating, not active, so test
+                # for flapping first or it would be restarted again
+                if status and localFunctions.unit_is_flapping(status):
+                    self.flapping_processes[daemon_name] = status
+                elif not status or status.active_state != "active":
                     self.failed_processes[daemon_name] = self.daemons_list[
                         daemon_name]
         except Exception as e:
@@ -865,16 +982,10 @@ class SystemChecker:
         M.2 drives have prefixes "nvme". If there is a nvme drive it will be the primary.
         :return:
         """
-        command = "lsblk -d -n -o NAME |grep -v sr |sort"
-        all_disks = localFunctions.run_command(command, reraise_error=True, merge_stderr=False)
-        system_disks = []
-        for devname in all_disks:
-            if devname.startswith("sd"):
-                command = "find /dev/disk/by-id/ -lname '*%s'| grep 'ata'" %devname
-                if localFunctions.command_run_successful(command):
-                    system_disks.append("/dev/%s" %devname)
-            elif devname.startswith("nvme"):
-                system_disks.append("/dev/%s" % devname)
+        if self.topology and self.topology.system_disks:
+            system_disks = self.topology.system_disks
+        else:
+            system_disks = find_system_disks()
         self.disks[system_disks[0]] = DiskInfo("Primary Disk", system_disks[0], True, self)
         self.primary_disk_device = system_disks[0]
         self.check_using_backup_disk()
@@ -897,6 +1008,8 @@ class SystemChecker:
                 disk.check_disks_health()
             if disk.bad or (not disk.exists):
                 self.disk_health_bad = True
+            if disk.smart_warnings:
+                self.disk_smart_warnings = True
 
     # ----------------------------------------------------------------------
     def map_filesystems_disks(self):
@@ -905,15 +1018,20 @@ class SystemChecker:
         """
         try:
             cleaner_re = re.compile(r'(^\D*)')
-            result = localFunctions.run_command('df -l -t ext4')
-            for line in result:
-                # only read disk partition lines
-                if line[0] == "/":
-                    columns = line.split()
-                    mount_point = columns.pop()
-                    match_group = cleaner_re.match(columns[0])
-                    if match_group:
-                        self.disk_mounts[mount_point] = match_group.group(0)
+            if self.topology:
+                ext4_mounts = [(m["device"], m["mount_point"]) for m in self.topology.mounts
+                               if m["fs_type"] == "ext4" and m["device"].startswith("/")]
+            else:
+                ext4_mounts = []
+                for line in localFunctions.run_command('df -l -t ext4'):
+                    # only read disk partition lines
+                    if line[0] == "/":
+                        columns = line.split()
+                        ext4_mounts.append((columns[0], columns[-1]))
+            for device, mount_point in ext4_mounts:
+                match_group = cleaner_re.match(device)
+                if match_group:
+                    self.disk_mounts[mount_point] = match_group.group(0)
             try:
                 self.disks[self.disk_mounts['/']].set_active_os()
             except KeyError:
@@ -952,60 +1070,40 @@ class SystemChecker:
         Read the copy disk log file to determine the time of the last backup.
         The entry for each mirror is: time partition-name action. The action
         is either "started","completed", or "failed" and the time is in the
-        standard time.ctime format. The results are overwritten until the
-        the final instance of the file.
+        standard time.ctime format. The log is read backwards from the end
+        only as far as the start of the last finished mirror job.
         """
         global MirrorLogFilename, RotatedMirrorLogFilename, MaxMirrorAge
         try:
-            completion_re = re.compile(
-                r'\+\+.*\((\d*\.\d*)\).*---DailyJobs--- completed')
-            completion_failed_re = re.compile(
-                r'--.*\((\d*\.\d*)\).*---DailyJobs--- failed')
-            fs_re = re.compile(r'\+\+.*\((\d*\.\d*)\)\s*\S*\s*(\S*).*completed')
-            fs_failed_re = re.compile(r'--.*\((\d*\.\d*)\)\s*\S*\s*(\S*).*failed')
             if os.path.exists(MirrorLogFilename) and os.path.getsize(MirrorLogFilename):
                 logname = MirrorLogFilename
             else:
                 logname = RotatedMirrorLogFilename
-            logfile = open(logname, 'r')
+            self.empty_backup_log_file = not os.path.getsize(logname)
             completion_time = 0.0
             fs_completion_time = {}
-            for line in logfile:
-                self.empty_backup_log_file = False
-                completion_match = completion_re.match(line)
-                completion_failed_match = completion_failed_re.match(line)
-                fs_match = fs_re.match(line)
-                fs_failed_match = fs_failed_re.match(line)
-                if completion_match:
-                    comp_time = float(completion_match.group(1))
-                    if comp_time > completion_time:
-                        completion_time = comp_time
-                        self.full_backup_failed = False
-                elif completion_failed_match:
-                    comp_time = float(completion_failed_match.group(1))
-                    if comp_time > completion_time:
-                        completion_time = comp_time
-                        self.full_backup_failed = True
-                elif fs_match:
-                    comp_time, fs_name = float(fs_match.group(1)), fs_match.group(2)
-                    if fs_name not in fs_completion_time:
-                        fs_completion_time[fs_name] = comp_time
-                    elif comp_time > fs_completion_time[fs_name]:
-                        fs_completion_time[fs_name] = comp_time
-                    self.fs_backup_failures.discard(fs_name)
-                elif fs_failed_match:
-                    comp_time, fs_name = float(fs_failed_match.group(1)), fs_failed_match.group(2)
-                    if fs_name not in fs_completion_time:
-                        fs_completion_time[fs_name] = comp_time
-                    elif comp_time > fs_completion_time[fs_name]:
-                        fs_completion_time[fs_name] = comp_time
-                    self.fs_backup_failures.add(fs_name)
+            # most recent first so the first finished run of each is the last
+            for run in mirrorFunctions.read_mirror_runs(logname):
+                if run.end is None:
+                    continue
+                if run.task_type == mirrorFunctions.JOB_TASK_TYPE:
+                    if not completion_time:
+                        completion_time = run.end
+                        self.full_backup_failed = not run.success
+                elif run.task_type == mirrorFunctions.MIRROR_TASK_TYPE and \
+                        run.task not in fs_completion_time:
+                    # the Verify and Passwd Backup runs of the same source
+                    # are not the backup of the filesystem
+                    fs_completion_time[run.task] = run.end
+                    if run.success:
+                        self.fs_backup_failures.discard(run.task)
+                    else:
+                        self.fs_backup_failures.add(run.task)
             self.full_backup_days_ago, interval = \
                 prior_time_name(completion_time)
             self.last_backup_too_old = (interval > MaxMirrorAge)
             for name in fs_completion_time:
                 self.fs_backup_days_ago[name], interval = prior_time_name(fs_completion_time[name])
-            logfile.close()
         except OSError:
             # mirror log file was not present
             self.last_backup_too_old = True
@@ -1015,6 +1113,32 @@ class SystemChecker:
             f = open(MirrorLogFilename, "a")
             f.close()
 
+    # ----------------------------------------------------------------------
+    def check_mirror_progress(self):
+        """
+        Read the status files written by backupAllFilesystems to find any
+        mirror that is running now.
+        """
+        try:
+            self.mirror_status = {name: status for name, status in
+                                  mirrorFunctions.read_mirror_status().items()
+                                  if status.get("state") == "running"}
+        except Exception as e:
+            self.function_errors["check_mirror_progress"] = str(e)
+
+    # ----------------------------------------------------------------------
+    def report_mirror_progress(self):
+        for name, status in self.mirror_status.items():
+            self.reporter.report_values(
+                "mirror running",
+                [name, localFunctions.convert_to_readable(
+                    status.get("bytes_transferred", 0) // 1024) or "0 KB",
+                 status.get("percent_done", 0),
+                 localFunctions.convert_to_readable(
+                     int(status.get("rate", 0)) // 1024) or "0 KB",
+                 mirrorFunctions.format_duration(status.get("eta", 0))],
+                indent=0)
+
     # ----------------------------------------------------------------------
     def fsck_partition(self, partition, file_system):
         """
@@ -1055,6 +1179,7 @@ class SystemChecker:
         """
         Read /etc/fstab to find partitions which are auto mounted.
         """
+        self.required_partitions = []
         fstab = open("/etc/fstab", "r")
         for line in fstab:
             if ((line.find("UUID") != -1) and
@@ -1072,42 +1197,41 @@ class SystemChecker:
         If not, perform an fsck, then attempt to mount.
         """
         self.requires_partition_recheck = False
-        self.get_required_file_systems()
+        if self.topology:
+            mounted_filesystems = [m["mount_point"] for m in self.topology.mounts
+                                   if m["device"].startswith("/dev/")]
+        else:
+            mounted_filesystems = localFunctions.get_mounted_filesystems()
         for fs in self.required_partitions:
-            if fs["mount point"] not in localFunctions.get_mounted_filesystems():
+            if fs["mount point"] not in mounted_filesystems:
                 self.handle_unmounted_filesystem(fs)
 
     # ----------------------------------------------------------------------
-    def check_partitions_free_space(self):
+    def check_partitions_free_space(self, max_age=localFunctions.SPACE_CACHE_TTL):
         """ 
-        Use df to determine the remaining space in the partitions listed in
-        the partition list. It returns a dictionary indexed by partitions of
-        space remaining.
+        Use statvfs to determine the remaining space in the partitions listed
+        in the partition list. It returns a dictionary indexed by partitions of
+        space remaining. Only local ext4 filesystems are read so a hung
+        network mount cannot block the check.
+        :param max_age: use 0 after a cleanup to read the new values
         """
-        try:
-            du_table = localFunctions.run_command(
-                '/bin/df --local --type=ext4 --output=used,avail,target',
-                reraise_error=True, merge_stderr=False, no_stderr=True)
-        except subprocess.CalledProcessError as e:
-            # The output will probably still have valid partition names
-            # along with the error info
-            du_table = e.output.splitlines()
-            self.function_errors["check_partitions_free_space"] = e.returncode
         required_filesystems = [v["mount point"] for v in
                                 self.required_partitions]
-        for line in du_table:
-            data_values = line.split()
-            if data_values[2] in required_filesystems:
-                used = float(data_values[0])
-                avail = float(data_values[1])
-                percent = round((avail / (used + avail)) * 100.0, 1)
-                self.partition_free_space[data_values[2]] = \
-                    {"percent": percent, "amount": round(avail / 1.0e6, 1),
-                     "used":used, "avail":avail,
-                     "display used": localFunctions.convert_to_readable(used, True),
-                     "display avail": localFunctions.convert_to_readable(avail, True)}
-                if percent < 10.0:
-                    self.partition_full = True
+        all_space = localFunctions.get_all_filesystem_space(("ext4",), max_age)
+        for mount_point in required_filesystems:
+            space = all_space.get(mount_point)
+            if not space or not space.used + space.available:
+                continue
+            used = float(space.used)
+            avail = float(space.available)
+            percent = round((avail / (used + avail)) * 100.0, 1)
+            self.partition_free_space[mount_point] = \
+                {"percent": percent, "amount": round(avail / 1.0e6, 1),
+                 "used":used, "avail":avail,
+                 "display used": localFunctions.convert_to_readable(used, True),
+                 "display avail": localFunctions.convert_to_readable(avail, True)}
+            if percent < 10.0:
+                self.partition_full = True
 
 
     # ----------------------------------------------------------------------
@@ -1280,18 +1404,19 @@ class SystemChecker:
     # ----------------------------------------------------------------------
     def check_interfaces_state(self):
         """
-        Use ifconfig to identify the interfaces and get information about each.
+        Use sysfs to identify the interfaces and get information about each.
         Do not create an entry for interfaces listed in the config file as unused.
         This will assure that nothing else is done with these.
         """
         try:
-            result = localFunctions.run_command('/sbin/ifconfig -a -s')
-            interface_info_re = re.compile(
-                r'(internet|lab\d+|bond\d+|wlan\d+|ppp\d+|tun\d+)[\s\d]+(\w+)')
-            for line in result:
-                match_obj = interface_info_re.match(line)
-                if match_obj:
-                    interface_name, status_flags = match_obj.groups()
+            interface_name_re = re.compile(
+                r'(internet|lab\d+|bond\d+|wlan\d+|ppp\d+|tun\d+)$')
+            if self.topology:
+                interface_names = list(self.topology.interfaces)
+            else:
+                interface_names = networkFunctions.list_interfaces()
+            for interface_name in interface_names:
+                if interface_name_re.match(interface_name):
                     interface = self.get_interface_record(interface_name)
                     if interface and interface.used:
                         interface.get_status()
@@ -1443,100 +1568,111 @@ class SystemChecker:
         Test the quality of the internet with a longer ping test to check 
         for dropped packets. If the tun0 (vpn connection to remote server)
         is active, use that with a faster ping rate because it will not
-        intentionally slow the ping response.
+        intentionally slow the ping response. The number of pings depends
+        on how clear the result is, see internetQuality.
         """
         if self.config.get_value("check_internet_quality", True):
             if self.check_openvpn():
-                command = 'ping -i 0.05 -s 200 -c 40 -q %s' % VPNHost
+                sampler = internetQuality.PingSampler(VPNHost, interval=0.05,
+                                                      payload_size=200)
             else:
-                command = 'ping -i 0.2 -s 64 -c 30 -q %s' % target_host
+                sampler = internetQuality.PingSampler(target_host, interval=0.2,
+                                                      payload_size=64)
             try:
-                ping_result = localFunctions.run_command(command, True, False)
-                match = re.search(r'(\d+)%', ping_result)
-                if match:
-                    percent_loss = int(match.group(1))
-                    if percent_loss == 0:
-                        self.internet_quality = 'Excellent'
-                    elif percent_loss < 5:
-                        self.internet_quality = 'Good'
-                    elif percent_loss < 9:
-                        self.internet_quality = 'Fair'
-                    elif percent_loss < 19:
-                        self.internet_quality = 'Poor'
-                    else:
-                        self.internet_quality = 'Very Poor / Unusable'
-            except subprocess.CalledProcessError:
+                measurement = internetQuality.measure_quality(sampler)
+                self.internet_quality = measurement["quality"]
+                self.internet_quality_stats = measurement
+                internetQuality.append_history(measurement)
+            except OSError as e:
                 self.internet_quality = 'Not Tested'
-                pass
+                self.function_errors["check_internet_quality"] = str(e)
+
+    # ----------------------------------------------------------------------
+    def local_nameserver_answers(self):
+        """
+        Ask the local nameserver for the name of 127.0.0.1. bind answers this
+        itself so any answer, even an error, shows that it is working.
+        """
+        result = dnsResolver.run_queries([dnsResolver.liveness_query()])[0]
+        return result.answered
 
     # ----------------------------------------------------------------------
     def check_local_dns_server(self):
         """
-        Check if local nameserver has a status of active. If not,restart and
+        Check if local nameserver answers. If not,restart and
         check again after a short delay.
         """
         try:
-            self.local_nameserver_alive = \
-                localFunctions.command_run_successful(
-                    '/usr/sbin/rndc status > /dev/null')
+            self.local_nameserver_alive = self.local_nameserver_answers()
             if not self.local_nameserver_alive:
-                # localFunctions.command_run_successful('service bind9 restart > /dev/null')
                 localFunctions.command_run_successful(
                     'systemctl restart bind9 > /dev/null')
                 time.sleep(2.0)
-                self.local_nameserver_alive = \
-                    localFunctions.command_run_successful(
-                        '/usr/sbin/rndc status > /dev/null')
+                self.local_nameserver_alive = self.local_nameserver_answers()
         except Exception as e:
             self.function_errors["check_local_dns_server"] = str(e)
 
     # ---------------------------------------------------------------------
-    def make_dns_query(self, dig_args):
+    def make_dns_queries(self, queries):
         """
-        Make a single call with dig with all text after the command line.
-        Return the tuple successful_query, unreacheable, nameserver
+        Send all queries at once and keep the response code and time of
+        each for the report.
+        :return: dictionary of query:DnsResult
         """
-        successful_query = False
-        nameserver = ""
-        try:
-            result = localFunctions.run_command('dig ' + dig_args, True, False)
-            if re.search(r'ANSWER SECTION', result):
-                successful_query = True
-            server_match = re.search(r'SERVER:\s*([\d.]*)', result)
-            if server_match:
-                nameserver = server_match.groups()[0]
-        except subprocess.CalledProcessError as e:
-            if e.returncode == 9:
-                # This indicates that the query timed out with no servers
-                # reachable -- thus no net access at all
-                self.dns_timed_out = True
-                self.internet_accessible = False
-                successful_query = False
-        return successful_query, nameserver
+        results = dnsResolver.run_queries(queries)
+        self.dns_results = [{"server": r.query.server, "name": r.query.name,
+                             "rcode": r.rcode, "answers": r.answers,
+                             "latency": round(r.latency * 1000.0, 1)} for r in results]
+        return {r.query: r for r in results}
+
+    # ---------------------------------------------------------------------
+    def report_dns_results(self):
+        for result in self.dns_results:
+            self.reporter.report_values("dns query result",
+                                        [result["server"], result["name"],
+                                         result["rcode"], result["latency"]])
 
     # ---------------------------------------------------------------------
     def check_dns(self):
         """
-        Check function of local nameserver and then full function.
+        Check function of local nameserver and then full function. The
+        nameservers of resolv.conf, the local nameserver and its forwarders
+        are asked at the same time.
         """
         try:
-            # flush cache to assure the coming dns queries will come from the net
-            # This fails if the local nameserver is dead
-            self.local_nameserver_alive = \
-                localFunctions.command_run_successful(
-                    '/usr/sbin/rndc flush > /dev/null')
-            # if the localname server is alive make a query that
-            # does not require internet
+            self.local_nameserver_alive = self.local_nameserver_answers()
             if self.local_nameserver_alive:
-                self.internal_dns_good, server = self.make_dns_query(
-                    '-x 127.0.0.1')
-            # try to resolve a name
-            self.dns_initially_good, self.initial_nameserver = \
-                self.make_dns_query('google.com')
+                # flush cache to assure the coming dns queries will come from the net
+                localFunctions.command_run_successful('/usr/sbin/rndc flush > /dev/null')
+            nameserver_queries = [dnsResolver.DnsQuery(server, DnsTestName)
+                                  for server in dnsResolver.read_nameservers()]
+            internal_query = dnsResolver.liveness_query()
+            local_query = dnsResolver.DnsQuery("127.0.0.1", DnsTestName)
+            forwarder_queries = [dnsResolver.DnsQuery(server, DnsTestName)
+                                 for server in dnsResolver.read_forwarders()]
+            queries = [internal_query, local_query]
+            for query in nameserver_queries + forwarder_queries:
+                if query not in queries:
+                    queries.append(query)
+            results = self.make_dns_queries(queries)
+            self.internal_dns_good = results[internal_query].resolved
+            # As dig does, use the first nameserver that answers
+            initial_result = None
+            for query in nameserver_queries or [local_query]:
+                if results[query].answered:
+                    initial_result = results[query]
+                    break
+            if initial_result:
+                self.dns_initially_good = initial_result.resolved
+                self.initial_nameserver = initial_result.query.server
+            else:
+                # no nameserver reachable -- thus no net access at all
+                self.dns_timed_out = True
+                self.internet_accessible = False
+                self.dns_initially_good = False
             if not (self.initial_nameserver == MainServerIpAddress or
                     self.initial_nameserver == "127.0.0.1"):
-                self.local_nameserver_good, server = \
-                    self.make_dns_query('@127.0.0.1 google.com')
+                self.local_nameserver_good = results[local_query].resolved
             else:
                 self.local_nameserver_good = self.dns_initially_good
             self.dns_good = self.dns_initially_good
@@ -1564,58 +1700,91 @@ class SystemChecker:
             return 1.0
 
     # ----------------------------------------------------------------------
-    def check_process_usage(self, param='pcpu', limit=80.0, scale_factor=1.0):
+    def check_process_usage(self, snapshot, param='pcpu', limit=80.0, scale_factor=1.0):
+        """
+        :param snapshot: processFunctions.ProcessSnapshot
+        :param param: "pcpu" for the percent of a CPU or "rssize" for the
+            memory in KB
+        """
         try:
-            command = '/bin/ps -e --no-headers --format=%s,pid,user,etime,time,args:40 --sort=-%s' \
-                      % (param, param)
-            processes = localFunctions.run_command(command, reraise_error=True)
             self.problem_processes[param] = {}
-            for process in processes:
-                proc_stats = process.split()
+            for process in snapshot:
                 if param == "pcpu":
-                    try:
-                        value = 1.0
-                        # assure that the process has been running a while and has been using a
-                        # a high percentage of cpu
-                        etime_sec = self.parse_time_string(proc_stats[3])
-                        if etime_sec > 180.0:
-                            atime_sec = self.parse_time_string(proc_stats[4])
-                            if (atime_sec / etime_sec) > 0.7:
-                                value = float(proc_stats[0])
-                    except (IndexError, ValueError):
-                        value = 1.0
+                    value = 1.0
+                    # assure that the process has been running a while and has been using a
+                    # a high percentage of cpu
+                    if snapshot.age(process) > 180.0:
+                        cpu_percent = snapshot.lifetime_cpu_percent(process)
+                        if cpu_percent > 70.0:
+                            value = cpu_percent
                 else:
-                    value = float(proc_stats[0])
+                    value = float(process.rss)
                 if value > limit:
                     scaled_value = value * scale_factor
                     string_value = "%3.1f" % scaled_value
-                    self.problem_processes[param][proc_stats[1]] = \
-                        {'percent usage': string_value, 'user': proc_stats[2],
-                         'command': proc_stats[5]}
+                    self.problem_processes[param][str(process.pid)] = \
+                        {'percent usage': string_value, 'user': process.user,
+                         'command': process.cmdline.split()[0][:40]}
         except Exception as e:
             self.function_errors['processes_check'] = str(e)
 
     # ----------------------------------------------------------------------
-    def check_runaway_processes(self):
+    def check_user_usage(self, snapshot, system_memory):
         """
-        Look for processes using all of a CPU.
+        Look for a single user whose processes together use too much of the
+        server. The CPU use is measured from the snapshot taken when the
+        checks started.
+        :param snapshot: processFunctions.ProcessSnapshot
+        :param system_memory: in KB
         """
+        global UserCpuLimit, UserMemoryLimit
+        try:
+            self.problem_users = {}
+            cpu_capacity = 100.0 * (os.cpu_count() or 1)
+            user_cpu = snapshot.user_cpu_percent(self.process_snapshot)
+            for user, totals in snapshot.user_totals().items():
+                if totals.uid < 1000 or totals.uid == 65534:
+                    # a system user
+                    continue
+                cpu_share = 100.0 * user_cpu.get(user, 0.0) / cpu_capacity
+                memory_share = 100.0 * totals.rss / system_memory
+                if cpu_share > UserCpuLimit or memory_share > UserMemoryLimit:
+                    self.problem_users[user] = {"cpu": "%3.1f" % cpu_share,
+                                                "memory": "%3.1f" % memory_share,
+                                                "processes": totals.process_count}
+        except Exception as e:
+            self.function_errors['processes_check'] = str(e)
 
-        self.check_process_usage("pcpu", 90.0)
+    # ----------------------------------------------------------------------
+    def check_runaway_processes(self):
+        """
+        Look for processes using all of a CPU and users using too much
+        of the server.
+        """
+        global ProcessSampleInterval
+        try:
+            # the CPU use of each user needs a few seconds since the first
+            # snapshot. The checks have usually taken much longer.
+            wait_time = ProcessSampleInterval - (time.monotonic() -
+                                                 self.process_snapshot.time)
+            if wait_time > 0:
+                time.sleep(wait_time)
+            snapshot = processFunctions.ProcessSnapshot()
+        except OSError as e:
+            self.function_errors['processes_check'] = str(e)
+            return
+        self.check_process_usage(snapshot, "pcpu", 90.0)
         try:
-            command_result = localFunctions.run_command("free",
-                                                    reraise_error=True,
-                                                    result_as_list=False)
-
-            values = re.findall(
-                r'(\d+)', command_result, re.MULTILINE)
-            system_memory = float(values[0])
-        except subprocess.SubprocessError:
+            system_memory = float(processFunctions.read_memory_total())
+        except OSError:
+            system_memory = 0.0
+        if not system_memory:
             # if find memory size failed just use standard 16GB
             system_memory = 16246424
         memory_limit = system_memory * 0.4
-        self.check_process_usage("rssize", memory_limit,
+        self.check_process_usage(snapshot, "rssize", memory_limit,
                                  100.0 / system_memory)
+        self.check_user_usage(snapshot, system_memory)
 
     # ----------------------------------------------------------------------
     def check_proxy_server(self, startup_wait=0.0):
@@ -1749,71 +1918,157 @@ class SystemChecker:
         return self.ltsp_image_ok
 
     # ----------------------------------------------------------------------
-    def perform_tests(self):
+    def get_check_steps(self):
         """
+        The registry of all checks in report order. Each check lists the
+        checks whose results it uses so that the others can run at the same
+        time, its cost class and whether it may fix what it finds. The
+        profile selects the checks that are run.
         """
-        self.reporter.report_progress("test start", level=0)
-        self.reporter.report_progress("checking disks")
-        self.check_mounted_partitions()
-        self.reporter.show_percent_complete(2)
-        self.check_disks_health()
-        self.reporter.show_percent_complete(3)
-        self.map_filesystems_disks()
-        self.reporter.show_percent_complete(4)
-        self.check_last_backup_time()
-        self.reporter.show_percent_complete(5)
-        self.check_partitions_free_space()
-        self.check_ltsp_image()
-        self.reporter.report_progress("checking processes")
-        self.check_processes()
-        self.reporter.show_percent_complete(7)
-        self.check_proxy_server()
-        self.check_kahn_academy_server()
-        self.reporter.show_percent_complete(8)
-        self.check_recent_max_loads()
-        self.reporter.show_percent_complete(9)
-        self.reporter.report_progress("checking interfaces")
-        self.initialize_interface_records()
-        self.check_interfaces_state()
-        if self.config.get_value("check_networks"):
-            if self.config.get_value("look_for_local_hosts", True):
-                self.reporter.show_percent_complete(11)
-                self.reporter.report_progress("hosts ping")
-                self.find_hosts_on_interfaces()
-            self.reporter.show_percent_complete(35)
-            if (self.config.get_value("internet_available", True) and
+        progress = checkExecutor.progress_message
+        percent = checkExecutor.percent_complete
+        Step = checkExecutor.CheckStep
+
+        def check_networks():
+            return self.config.get_value("check_networks")
+
+        def internet_interface_running():
+            return (check_networks() and
+                    self.config.get_value("internet_available", True) and
                     self.internet_interface in self.network_interfaces and
-                    self.network_interfaces[self.internet_interface].running):
-                self.find_default_router()
-                self.reporter.show_percent_complete(37)
-                if self.default_router:
-                    self.reporter.report_progress("start internet check",
-                        reformat_text=False, level=1)
-                    self.check_local_dns_server()
-                    self.reporter.show_percent_complete(41)
-                    self.reporter.report_progress("start internet ping check",
-                                                  reformat_text=False, level=2)
-                    self.check_internet_ping()
-                    self.reporter.show_percent_complete(45)
-                    self.reporter.report_progress("start internet name check",
-                                                  reformat_text=False, level=2)
-                    self.check_dns()
-                    if self.dns_good:
-                        self.reporter.show_percent_complete(50)
-                        self.reporter.report_progress("start internet browse check",
-                                                      reformat_text=False, level=2)
-                        self.check_internet_browsing()
-                        self.reporter.show_percent_complete(60)
-                        if self.internet_accessible:
-                            self.reporter.report_progress(
-                                "start internet quality check",
-                                reformat_text=False, level=2)
-                            if self.config.get_value("check_internet_quality",
-                                                     True):
-                                self.check_internet_quality()
-                                self.reporter.show_percent_complete(80)
-        self.reporter.report_progress("checks complete", level=0)
-        self.reporter.show_percent_complete(80)
+                    self.network_interfaces[self.internet_interface].running)
+
+        def internet_accessible():
+            return bool(self.default_router and self.dns_good and
+                        self.internet_accessible)
+
+        return [
+            Step("tests started", before=[progress("test start", level=0)]),
+            Step("get_required_file_systems", self.get_required_file_systems,
+                 before=[progress("checking disks")], cost=checkExecutor.COST_CHEAP,
+                 results=("required_partitions",)),
+            Step("check_mounted_partitions", self.check_mounted_partitions,
+                 depends_on=("get_required_file_systems",), after=[percent(2)],
+                 auto_fix=True),
+            Step("check_disks_health", self.check_disks_health, after=[percent(3)],
+                 timeout=300),
+            Step("map_filesystems_disks", self.map_filesystems_disks,
+                 depends_on=("check_disks_health",), after=[percent(4)]),
+            Step("check_last_backup_time", self.check_last_backup_time,
+                 cost=checkExecutor.COST_CHEAP, ttl=900,
+                 results=("fs_backup_days_ago", "fs_backup_failures",
+                          "full_backup_days_ago", "full_backup_failed",
+                          "last_backup_too_old", "empty_backup_log_file")),
+            Step("check_mirror_progress", self.check_mirror_progress, after=[percent(5)],
+                 cost=checkExecutor.COST_CHEAP, results=("mirror_status",), ttl=60),
+            Step("check_partitions_free_space", self.check_partitions_free_space,
+                 depends_on=("get_required_file_systems", "check_mounted_partitions"),
+                 cost=checkExecutor.COST_CHEAP, ttl=300,
+                 results=("partition_free_space", "partition_full")),
+            Step("check_ltsp_image", self.check_ltsp_image,
+                 results=("ltsp_image_ok", "ltsp_arch"), ttl=3600),
+            Step("check_daemons", self.check_daemons,
+                 before=[progress("checking processes")]),
+            Step("check_processes", self.check_processes,
+                 depends_on=("check_daemons",), after=[percent(7)], auto_fix=True),
+            # squid or ka-lite may have been restarted by check_processes
+            Step("check_proxy_server", self.check_proxy_server,
+                 depends_on=("check_processes",), cost=checkExecutor.COST_NETWORK,
+                 results=("proxy_server_ok",), ttl=300),
+            # this may also mark the proxy server bad so it must follow it
+            Step("check_kahn_academy_server", self.check_kahn_academy_server,
+                 depends_on=("check_processes", "check_proxy_server"), after=[percent(8)],
+                 cost=checkExecutor.COST_NETWORK, ttl=300,
+                 results=("kahn_academy_server_ok", "proxy_server_ok")),
+            Step("check_recent_max_loads", self.check_recent_max_loads,
+                 after=[percent(9)], cost=checkExecutor.COST_CHEAP, ttl=600,
+                 results=("load_monitor_minutes", "load_above_70_minutes",
+                          "load_above_80_minutes")),
+            Step("initialize_interface_records", self.initialize_interface_records,
+                 before=[progress("checking interfaces")], cost=checkExecutor.COST_CHEAP),
+            Step("check_interfaces_state", self.check_interfaces_state,
+                 depends_on=("initialize_interface_records",)),
+            Step("find_hosts_on_interfaces", self.find_hosts_on_interfaces,
+                 depends_on=("check_interfaces_state",),
+                 condition=lambda: (check_networks() and
+                                    self.config.get_value("look_for_local_hosts", True)),
+                 before=[percent(11), progress("hosts ping")], timeout=300,
+                 cost=checkExecutor.COST_SLOW, exclusive=ProbeResource),
+            Step("networks checked", condition=check_networks, after=[percent(35)]),
+            Step("find_default_router", self.find_default_router,
+                 depends_on=("check_interfaces_state",),
+                 condition=internet_interface_running, after=[percent(37)],
+                 cost=checkExecutor.COST_NETWORK, ttl=300,
+                 results=("default_router", "router_ping_successful")),
+            Step("check_local_dns_server", self.check_local_dns_server,
+                 depends_on=("find_default_router",),
+                 condition=lambda: bool(self.default_router),
+                 before=[progress("start internet check", reformat_text=False, level=1)],
+                 after=[percent(41)], auto_fix=True),
+            Step("check_internet_ping", self.check_internet_ping,
+                 depends_on=("find_default_router",),
+                 condition=lambda: bool(self.default_router),
+                 before=[progress("start internet ping check", reformat_text=False,
+                                  level=2)],
+                 after=[percent(45)], cost=checkExecutor.COST_NETWORK,
+                 results=("internet_ping_successful",), ttl=120,
+                 exclusive=ProbeResource),
+            # check_dns flushes and queries the local nameserver
+            Step("check_dns", self.check_dns,
+                 depends_on=("check_local_dns_server",),
+                 condition=lambda: bool(self.default_router),
+                 before=[progress("start internet name check", reformat_text=False,
+                                  level=2)],
+                 cost=checkExecutor.COST_NETWORK, ttl=120,
+                 results=("dns_good", "dns_initially_good", "initial_nameserver",
+                          "internal_dns_good", "local_nameserver_alive",
+                          "local_nameserver_good", "dns_timed_out",
+                          "internet_accessible", "dns_results")),
+            Step("check_internet_browsing", self.check_internet_browsing,
+                 depends_on=("check_dns",),
+                 condition=lambda: bool(self.default_router and self.dns_good),
+                 before=[percent(50), progress("start internet browse check",
+                                               reformat_text=False, level=2)],
+                 after=[percent(60)], cost=checkExecutor.COST_NETWORK, ttl=120,
+                 results=("internet_accessible", "proxy_ok",
+                          "analyze_internet_access_retries")),
+            Step("internet quality", depends_on=("check_internet_browsing",),
+                 condition=internet_accessible,
+                 before=[progress("start internet quality check",
+                                  reformat_text=False, level=2)]),
+            Step("check_internet_quality", self.check_internet_quality,
+                 depends_on=("internet quality",),
+                 condition=lambda: (internet_accessible() and
+                                    self.config.get_value("check_internet_quality",
+                                                          True)),
+                 after=[percent(80)], cost=checkExecutor.COST_SLOW, auto_fix=True,
+                 results=("internet_quality", "internet_quality_stats"), ttl=600,
+                 exclusive=ProbeResource),
+            Step("checks complete",
+                 after=[progress("checks complete", level=0), percent(80)])]
+
+    # ----------------------------------------------------------------------
+    def perform_tests(self):
+        """
+        Run the checks of the profile, several at a time. The report is
+        written in the same order as when they were run one after another.
+        :return: the CheckSteps that were selected, with their status
+        """
+        self.result_cache.load()
+        if self.timer:
+            self.timer.start()
+        executor = checkExecutor.CheckExecutor(
+            self.reporter, self.function_errors,
+            self.config.get_value("max_parallel_checks",
+                                  checkExecutor.DEFAULT_MAX_WORKERS),
+            checker=self, result_cache=self.result_cache,
+            max_age=self.config.get_value("max_result_age", 0),
+            timer=self.timer, cancel_event=self.cancel_event,
+            step_listener=self.step_listener)
+        steps = self.profile.select(self.get_check_steps())
+        self.selected_checks = set([step.name for step in steps])
+        executor.run(steps)
+        return steps
 
     # ----------------------------------------------------------------------
     def handle_failed_processes(self):
@@ -1854,6 +2109,45 @@ class SystemChecker:
             self.reporter.report_fix_result("process restart successful",
                                             fixed=True)
 
+    # ----------------------------------------------------------------------
+    def report_daemons(self):
+        """
+        Report the stopped and flapping daemons found by check_daemons
+        without restarting them.
+        """
+        if self.failed_processes:
+            process_names = ""
+            for process_name, info in self.failed_processes.items():
+                process_names += "\n      %s (%s)" % (info[0], process_name)
+            if len(self.failed_processes) > 1:
+                txt = "stopped processes"
+            else:
+                txt = "stopped process"
+            self.reporter.report_problem(txt, [process_names], False)
+        if self.flapping_processes:
+            self.report_flapping_processes()
+
+    # ----------------------------------------------------------------------
+    def report_flapping_processes(self):
+        """
+        A daemon that crashes and is restarted by systemd again and again looks
+        active. Restarting it once more will not help so only report it.
+        """
+        process_lines = ""
+        for process_name, status in self.flapping_processes.items():
+            if status.seconds_in_state is None:
+                since_text = ""
+            else:
+                since_text = ", last restart %d minutes ago" % (status.seconds_in_state // 60)
+            process_lines += "\n      %s (%s): %s/%s, restarted %d times%s" % (
+                self.daemons_list[process_name][0], process_name, status.active_state,
+                status.sub_state, status.restarts, since_text)
+        self.reporter.report_requires_user_action_problem(
+            "flapping processes", values=[process_lines],
+            action_message_name="flapping processes action",
+            action_values=[" -u ".join(self.flapping_processes.keys())],
+            reformat_text=False)
+
     # ----------------------------------------------------------------------
     def restart_failed_process(self, process_name):
         """
@@ -1931,6 +2225,21 @@ class SystemChecker:
                                                       action_message_name="disk missing action",
                                                       action_values=[disk_name])
 
+    # ----------------------------------------------------------------------
+    def handle_disk_smart_warnings(self):
+        """
+        A disk still passes its SMART self assessment but its history shows
+        that it is wearing out.
+        """
+        for disk in self.disks.values():
+            if disk.smart_warnings and not disk.bad:
+                self.reporter.report_requires_user_action_problem(
+                    "disk smart warning",
+                    values=[disk.name, disk.device, "\n   ".join(disk.smart_warnings)],
+                    action_message_name="disk smart warning action",
+                    action_values=[disk.serial],
+                    reformat_text=False)
+
     # ----------------------------------------------------------------------
     def handle_failed_disks(self):
         """
@@ -1959,28 +2268,15 @@ class SystemChecker:
                                                                           action_message_name="primary disk failure action",
                                                                           action_values=[],
                                                                           increment_problem_count=False)
-                        if os.path.islink(GrubFilename):
-                            try:
-                                os.unlink(GrubFilename)
-                            except OSError:
-                                pass
-                        if not os.path.exists(GrubFilename):
-                            try:
-                                os.symlink(EmergencyGrubFile, GrubFilename)
-                            except OSError:
-                                pass
-                        if not os.path.exists(GrubFilename):
-                            try:
-                                os.symlink(StandardGrubFile, GrubFilename)
-                            except OSError:
-                                pass
+                        if self.profile.allow_fixes:
+                            self.use_emergency_grub_file()
                 else:
                     self.reporter.report_serious_problem("backup disk failure", [disk.device])
                     self.reporter.report_requires_user_action_problem("", values=[],
                                                                       action_message_name="backup disk failure action",
                                                                       action_values=[disk.device],
                                                                       increment_problem_count=False)
-                    if not disk.primary:
+                    if not disk.primary and self.profile.allow_fixes:
                         try:
                             os.unlink(MirrorFilename)
                         except OSError:
@@ -1990,6 +2286,28 @@ class SystemChecker:
                         except OSError:
                             pass
 
+    # ----------------------------------------------------------------------
+    def use_emergency_grub_file(self):
+        """
+        Boot from the second disk when the primary disk is failing.
+        """
+        global GrubFilename, EmergencyGrubFile, StandardGrubFile
+        if os.path.islink(GrubFilename):
+            try:
+                os.unlink(GrubFilename)
+            except OSError:
+                pass
+        if not os.path.exists(GrubFilename):
+            try:
+                os.symlink(EmergencyGrubFile, GrubFilename)
+            except OSError:
+                pass
+        if not os.path.exists(GrubFilename):
+            try:
+                os.symlink(StandardGrubFile, GrubFilename)
+            except OSError:
+                pass
+
     # ----------------------------------------------------------------------
     def handle_backup_too_old(self):
         """
@@ -2052,9 +2370,20 @@ class SystemChecker:
         :param free_space_required:
         :return:
         """
-        self.check_partitions_free_space()
+        self.check_partitions_free_space(max_age=0)
         return self.partition_free_space['/']["percent"] < free_space_required
 
+    # ----------------------------------------------------------------------
+    def report_partitions_full(self):
+        """
+        Report the partitions with less than 10% free without cleaning them.
+        """
+        for mount_point, space in sorted(self.partition_free_space.items()):
+            if space["percent"] < 10.0:
+                self.reporter.report_problem("partition nearly full",
+                                             [mount_point, space["display avail"],
+                                              space["percent"]])
+
     # ----------------------------------------------------------------------
     def handle_partitions_full(self):
         """
@@ -2091,7 +2420,7 @@ class SystemChecker:
                               values=[max_file_size_str])
                         systemCleanup.clean_client_home_teachers_files(max_file_size,
                                                                logger=self.delete_files_info_logger)
-                        self.check_partitions_free_space()
+                        self.check_partitions_free_space(max_age=0)
                         final_partition_free_space = self.partition_free_space['/client_home']["avail"]
                         delta = final_partition_free_space - initial_partition_free_space
                         self.reporter.report_fix_result("cleaning result", values=[
@@ -2126,7 +2455,7 @@ class SystemChecker:
                     dirs_removed, files_removed, invalid_files = \
                         serveStudentUseWeb.noninteractive_clean_students_directories(max_file_size,
                                                              logger=self.delete_files_info_logger)
-                    self.check_partitions_free_space()
+                    self.check_partitions_free_space(max_age=0)
                     size_change_message, delta = localFunctions.change_in_filesystem_size(
                         "/client_home_students",
                         initial_size)
@@ -2169,7 +2498,7 @@ class SystemChecker:
                                               prune_active_owner=True,
                                               other_protected_users=[],
                                               rebuild_student_home=False)
-        self.clean_tmp(False)
+        self.clean_tmp(False, self.get_root_space_needed(10.0))
         systemCleanup.clean_dir("/mnt", exclusions=[], prune_active_owner=False,
                                 other_protected_users=[])
         systemCleanup.clean_dir("/var/crash", exclusions=[], prune_active_owner=False,
@@ -2195,15 +2524,15 @@ class SystemChecker:
             systemCleanup.clean_client_home_local(exclusions=[], prune_active_owner=True,
                                                   other_protected_users=[], rebuild_student_home=True)
             self.clean_squid_mountpoint()
-            self.clean_tmp(False)
+            self.clean_tmp(False, self.get_root_space_needed(target_size))
             if self.root_partition_too_full(target_size):
                 self.clean_sysadmin_and_master()
             if self.root_partition_too_full(target_size):
                 systemCleanup.clean_opt(remove_alt_image=True)
             if self.root_partition_too_full(target_size):
-                self.clean_tmp(True)
+                self.clean_tmp(True, self.get_root_space_needed(target_size))
             if self.root_partition_too_full(target_size):
-                self.clean_var()
+                self.clean_var(self.get_root_space_needed(target_size))
             if self.root_partition_too_full(target_size):
                 systemCleanup.clean_media(exclusions=[],
                                         prune_active_owner=False,
@@ -2242,9 +2571,10 @@ class SystemChecker:
         """
         change = 0
         try:
-            sysadmin_size_before = localFunctions.get_directory_size("/home/sysadmin")
+            sysadmin_size_before = localFunctions.get_directory_size("/home/sysadmin",
+                                                                     self.directory_sizer)
             for directory in ["/home/master/Downloads", "/home/sysadmin/Downloads"]:
-                if self.get_directory_size(directory) > 50:
+                if self.get_directory_size(directory, limit=50) > 50:
                     # If there is only a small amount leave it. It won't help much but
                     # and there may be useful stuff in it
                     command = "/bin/rm -r %s/*" % directory
@@ -2262,7 +2592,10 @@ class SystemChecker:
                 {"video": 1e7, "audio": 3e6, "photo": 1e6, "other": 1})
             serveStudentUseWeb.delete_invalid_files(oversize_files,
                                                     logger=self.delete_files_info_logger)
-            change = sysadmin_size_before - localFunctions.get_directory_size("/home/sysadmin")
+            for directory in ["/home/master", "/home/sysadmin"]:
+                self.directory_sizer.forget(directory)
+            change = sysadmin_size_before - localFunctions.get_directory_size(
+                "/home/sysadmin", self.directory_sizer)
             self.reporter.report_fix_result("sysadmin home cleaned",
                 [localFunctions.convert_to_readable(change, storage_size=True)], fixed=False)
         except Exception as e:
@@ -2270,73 +2603,57 @@ class SystemChecker:
         return change
 
     # ----------------------------------------------------------------------
-    def clean_var(self):
-        """
-        Remove files from /var/tmp and /var/log
-        :return:
-        """
-        for dirname in os.listdir("/var/tmp"):
-            try:
-                if not (dirname.startswith("systemd") or
-                        (time.time() - os.path.getmtime(dirname)) < 180000 or
-                        self.owned_by_active_user(dirname)):
-                    command = "/bin/rm -r %s" % os.path.join("/var/tmp",
-                                                             dirname)
-                    localFunctions.command_run_successful(command)
-            except OSError:
-                pass
-        try:
-            for info in os.walk("/var/log"):
-                for filename in info[2]:
-                    for ext in (".gz", ".1", ".2"):
-                        if filename.endswith(ext) and not filename.startswith(
-                                "loadmonitor.csv"):
-                            os.remove(os.path.join(info[0], filename))
-        except OSError:
-            pass
-
-    # ----------------------------------------------------------------------
-
-    def clean_tmp(self, clean_thorougly=False):
-        """
-        Remove larger files and directories that do not belong to active users. Do not
-        touch smaller files or directories because they may have some current use as flags
-        :return:
-        """
-        try:
-            du_list = localFunctions.run_command("du -sk /tmp/*",
-                                                 result_as_list=True,
-                                                 reraise_error=True,
-                                                 merge_stderr=False)
-            for entry in du_list:
-                try:
-                    entry_info = re.split(r'\s+', str(entry).strip(), 1)
-                    size_in_kb = int(entry_info[0])
-                    name = entry_info[1]
-                    if not clean_thorougly:
-                        # a more relaxed action to clean out stale big files
-                        if (
-                                size_in_kb > 10000 and not self.owned_by_active_user(name)
-                                or name.startswith("rsync-")):
-                            command = "/bin/rm -r %s" % name
-                            localFunctions.command_run_successful(command)
-                    else:
-                        if name.startswith("/tmp/nbd-swap/"):
-                            if size_in_kb > 50000:
-                                command = "/bin/rm -r /tmp/nbd-swap/*"
-                                localFunctions.command_run_successful(command)
-                        elif ((size_in_kb > 8 and not self.owned_by_active_user(
-                                name)) or
-                              # if huge, delete even if owned by an active user -- maybe a runaway
-                              size_in_kb > 100000):
-                            # a more complete cleaning that might mess up things.
-                            command = "/bin/rm -r %s" % name
-                            localFunctions.command_run_successful(command)
-                            self.suggest_reboot = True
-                except (OSError, ValueError, IndexError):
-                    pass
-        except subprocess.CalledProcessError:
-            pass
+    def clean_var(self, bytes_needed=None):
+        """
+        Remove old files and directories from /var/tmp and the rotated logs
+        from /var/log, oldest first.
+        :param bytes_needed: stop when this much space has been freed, None
+            to remove everything that may be removed
+        :return: bytes freed
+        """
+        if bytes_needed == 0:
+            return 0
+        cleaner = fileManagementFunctions.DirectoryCleaner()
+        now = time.time()
+        entries = [e for e in cleaner.scan("/var/tmp")
+                   if not (os.path.basename(e.path).startswith("systemd") or
+                           now - e.newest_mtime < 180000 or
+                           self.uid_of_active_user(e.uid))]
+        entries.extend(cleaner.find_files(
+            "/var/log", lambda name: name.endswith((".gz", ".1", ".2")) and
+            not name.startswith("loadmonitor.csv")))
+        return cleaner.remove(entries, bytes_needed, self.delete_files_info_logger)
+
+    # ----------------------------------------------------------------------
+    def clean_tmp(self, clean_thorougly=False, bytes_needed=None):
+        """
+        Remove larger files and directories that do not belong to active users,
+        oldest first. Do not touch smaller files or directories because they may
+        have some current use as flags. Nothing that a process has open is removed.
+        :param clean_thorougly: also remove small entries and huge entries of
+            active users -- maybe a runaway
+        :param bytes_needed: stop when this much space has been freed, None
+            to remove everything that may be removed
+        :return: bytes freed
+        """
+        if bytes_needed == 0:
+            return 0
+        cleaner = fileManagementFunctions.DirectoryCleaner()
+        entries = []
+        for entry in cleaner.scan("/tmp"):
+            active_owner = self.uid_of_active_user(entry.uid)
+            if not clean_thorougly:
+                # a more relaxed action to clean out stale big files
+                if (entry.size > 10000 * 1024 and not active_owner) or \
+                        os.path.basename(entry.path).startswith("rsync-"):
+                    entries.append(entry)
+            elif (entry.size > 8 * 1024 and not active_owner) or entry.size > 100000 * 1024:
+                # a more complete cleaning that might mess up things.
+                entries.append(entry)
+        bytes_freed = cleaner.remove(entries, bytes_needed, self.delete_files_info_logger)
+        if clean_thorougly and bytes_freed:
+            self.suggest_reboot = True
+        return bytes_freed
 
     # ----------------------------------------------------------------------
     def clean_squid_mountpoint(self):
@@ -2349,33 +2666,44 @@ class SystemChecker:
         time.sleep(2)
         localFunctions.command_run_successful("umount /Squid")
         if not os.path.ismount("/Squid"):
-            localFunctions.command_run_successful("rm -r /Squid/*")
+            cleaner = fileManagementFunctions.DirectoryCleaner()
+            cleaner.remove(cleaner.scan("/Squid"), logger=self.delete_files_info_logger)
         localFunctions.command_run_successful("mount /Squid")
         if os.path.ismount("/Squid"):
             localFunctions.command_run_successful("systemctl start squid")
         if not localFunctions.command_run_successful("systemctl is-active squid"):
             self.rebuild_proxy_server_cache()
 
+    # ----------------------------------------------------------------------
+    def uid_of_active_user(self, uid):
+        return processFunctions.get_user_name(uid) in self.active_users["all users"]
+
     # ----------------------------------------------------------------------
     @staticmethod
-    def get_directory_size(directory_name):
+    def get_root_space_needed(free_space_required):
+        """
+        :param free_space_required: percent of the root partition to be free
+        :return: bytes that must be freed, 0 if there is enough or None if
+            the space could not be read
+        """
+        space = localFunctions.get_filesystem_space("/", max_age=0)
+        if not space:
+            return None
+        needed_kb = free_space_required / 100.0 * (space.used + space.available) - \
+            space.available
+        return max(int(needed_kb * 1024), 0)
+
+    # ----------------------------------------------------------------------
+    def get_directory_size(self, directory_name, limit=0):
         """
         Determine the disk usage of a directories contents.
         :param directory_name:
-        :return: diskspace used in Mbytes integer
+        :param limit: stop measuring when the size is more than this many
+            Mbytes
+        :return: diskspace used in Mbytes integer, rounded up as du -m does
         """
-        size = 0
-        try:
-            command = "du -sm --one-file-system %s" % directory_name
-            command_result = localFunctions.run_command(command,
-                                                        reraise_error=True,
-                                                        result_as_list=False,
-                                                        merge_stderr=False,
-                                                        print_error=False)
-            size = int(command_result.split()[0])
-        except (subprocess.CalledProcessError, ValueError):
-            pass
-        return size
+        size = self.directory_sizer.get_size(directory_name, limit * 2 ** 20)
+        return -(-size // 2 ** 20)
 
     # ----------------------------------------------------------------------
     def check_sysadmin_home_size(self):
@@ -2492,6 +2820,9 @@ class SystemChecker:
                 # all internet works -- don't bother with further analysis
                 return
             if self.internet_accessible:
+                if not self.profile.allow_fixes:
+                    # the proxy server problem is reported with its check
+                    return
                 if not networkFunctions.internet_should_be_off():
                     step = "restart squid"
                     if not (self.restart_proxy_server()):
@@ -2522,7 +2853,12 @@ class SystemChecker:
             # Now lets check DNS.
             if (self.internet_ping_successful and not self.dns_good) or \
                     not self.internal_dns_good:
+                if not self.profile.allow_fixes:
+                    self.reporter.report_problem("nameserver bad")
+                    self.report_dns_results()
+                    return
                 self.reporter.report_fixable_problem("nameserver bad")
+                self.report_dns_results()
                 step = "bind 9 restart"
                 if self.restart_failed_process("bind9"):
                     self.check_dns()
@@ -2540,6 +2876,9 @@ class SystemChecker:
                 return
             if self.internal_dns_good and self.dns_good:
                 # Maybe a problem with shorewall
+                if not self.profile.allow_fixes:
+                    self.reporter.report_problem("internet blocked")
+                    return
                 self.reporter.report_fixable_problem("firewall restart")
                 step = "restart shorewall"
                 if self.restart_failed_process("shorewall"):
@@ -2558,7 +2897,13 @@ class SystemChecker:
             mounted_filesystems = localFunctions.get_mounted_filesystems()
             for partition in self.required_partitions:
                 if partition["mount point"] not in mounted_filesystems:
-                    self.handle_unmounted_filesystem(partition)
+                    if self.profile.allow_fixes:
+                        self.handle_unmounted_filesystem(partition)
+                    else:
+                        self.reporter.report_problem(
+                            "file system not mounted",
+                            [partition["partition"], partition["mount point"],
+                             partition["mount point"]])
         except Exception as e:
             self.function_errors["analyze_mounted_partitions"] = str(e)
 
@@ -2624,6 +2969,17 @@ class SystemChecker:
                             values=[intro],
                             action_message_name="problem memory process action",
                             action_values=[processes_table])
+            if self.problem_users:
+                header = ["    User", "% CPU", "% Memory", "Processes"]
+                data = [["    " + user, val["cpu"] + "%", val["memory"] + "%",
+                         val["processes"]]
+                        for user, val in sorted(self.problem_users.items())]
+                table_format = "html" if self.config.get_value("use_gui") else "plain"
+                self.reporter.report_requires_user_action_problem(
+                    error_message_name="problem user",
+                    values=[],
+                    action_message_name="problem user action",
+                    action_values=[tabulate.tabulate(data, header, table_format)])
         except Exception as e:
             self.function_errors["analyze_problem_processes"] = str(e)
 
@@ -2633,50 +2989,164 @@ class SystemChecker:
         Confirm that all required daemon process are running and restart
         them if necessary. This is best done before runnoing any other tests
         because this may fix problems that would be discovered in these
-        tests.
+        tests. The daemons have been read by check_daemons.
         """
-        self.check_daemons()
         if self.failed_processes:
             self.handle_failed_processes()
             self.requires_daemon_recheck = True
+        if self.flapping_processes:
+            self.report_flapping_processes()
 
     # ----------------------------------------------------------------------
     def analyze_results(self):
         """
         Use the test results to attempt to diagnose or fix problems.
+        Only the results of the checks in the profile are used.
         """
+        ran = self.selected_checks
+        fixes = self.profile.allow_fixes
+        if self.profile.analysis == "internet":
+            self.analyze_internet_results()
+            return
         self.reporter.report_progress("starting analysis", level=0)
         if self.config.get_value("check_networks"):
-            if not self.internet_quality == "Unknown":
-                self.reporter.report_values("internet quality",
-                                            [self.internet_quality], indent=0)
-            self.analyze_local_host_count()
+            self.report_internet_quality()
+            if "find_hosts_on_interfaces" in ran:
+                self.run_analysis_step(self.analyze_local_host_count)
         if self.disk_health_bad:
-            self.handle_failed_disks()
-        if self.full_backup_failed or len(self.fs_backup_failures):
-            self.handle_backup_failed()
-        elif self.last_backup_too_old:
-            self.handle_backup_too_old()
+            self.run_analysis_step(self.handle_failed_disks)
+        if self.disk_smart_warnings:
+            self.run_analysis_step(self.handle_disk_smart_warnings)
+        self.report_mirror_progress()
+        if "check_last_backup_time" in ran:
+            if self.full_backup_failed or len(self.fs_backup_failures):
+                self.run_analysis_step(self.handle_backup_failed)
+            elif self.last_backup_too_old:
+                self.run_analysis_step(self.handle_backup_too_old)
         if self.partition_full:
-            self.handle_partitions_full()
-        if not self.ltsp_image_ok:
-            self.rebuild_ltsp_image()
+            if fixes:
+                self.run_analysis_step(self.handle_partitions_full)
+            else:
+                self.run_analysis_step(self.report_partitions_full)
+        if not self.ltsp_image_ok and "check_ltsp_image" in ran:
+            if fixes:
+                self.run_analysis_step(self.rebuild_ltsp_image)
+            else:
+                self.reporter.report_problem("ltsp image missing")
+        if "check_processes" not in ran:
+            # the daemons have been read but nothing was restarted
+            self.run_analysis_step(self.report_daemons)
         self.reporter.show_percent_complete(90)
-        if not self.proxy_server_ok:
-            self.handle_proxy_server_restart()
-        if not self.kahn_academy_server_ok:
-            self.handle_kahn_academy_server_restart()
-        self.analyze_load_minutes()
-        self.analyze_network_interfaces()
-        self.analyze_mounted_partitions()
-        self.analyze_problem_processes()
+        if not self.proxy_server_ok and "check_proxy_server" in ran:
+            if fixes:
+                self.run_analysis_step(self.handle_proxy_server_restart)
+            else:
+                self.reporter.report_problem("proxy not working")
+        if not self.kahn_academy_server_ok and "check_kahn_academy_server" in ran:
+            if fixes:
+                self.run_analysis_step(self.handle_kahn_academy_server_restart)
+            else:
+                self.reporter.report_problem("kahn not working")
+        self.run_analysis_step(self.analyze_load_minutes)
+        if "check_interfaces_state" in ran:
+            self.run_analysis_step(self.analyze_network_interfaces)
+        if "get_required_file_systems" in ran:
+            self.run_analysis_step(self.analyze_mounted_partitions)
+        self.run_analysis_step(self.analyze_problem_processes)
         if self.config.get_value("check_networks") and \
-                self.config.get_value("internet_available", True):
-            self.analyze_internet_access()
+                self.config.get_value("internet_available", True) and \
+                "find_default_router" in ran:
+            self.run_analysis_step(self.analyze_internet_access)
         self.reporter.report_progress("finished analysis", level=0)
         self.reporter.show_percent_complete(100)
+        self.save_check_results()
         report_errors(self.function_errors)
 
+    # ----------------------------------------------------------------------
+    def run_analysis_step(self, function):
+        """
+        Run one analysis or fix step, timed if timing was requested.
+        Its report records are marked with its name.
+        """
+        self.reporter.set_current_check(function.__name__)
+        try:
+            if self.timer:
+                with self.timer.measure(function.__name__, "analysis"):
+                    function()
+            else:
+                function()
+        finally:
+            self.reporter.set_current_check("")
+
+    # ----------------------------------------------------------------------
+    def save_check_results(self):
+        """
+        Share the check results with other runs. After any fix the system
+        has changed so all cached results are dropped instead.
+        """
+        if self.reporter.fixes_started or self.reporter.problems_fixed:
+            self.result_cache.invalidate()
+        else:
+            self.result_cache.save()
+
+    # ----------------------------------------------------------------------
+    def report_internet_quality(self):
+        """
+        The quality grade with the measured values and the trend of the
+        last week.
+        """
+        if self.internet_quality == "Unknown":
+            return
+        self.reporter.report_values("internet quality", [self.internet_quality], indent=0)
+        stats = self.internet_quality_stats
+        if stats:
+            self.reporter.report_values("internet quality details",
+                                        [stats["loss_percent"], stats["sent"], stats["rtt_p50"],
+                                         stats["rtt_p90"], stats["jitter"]])
+            history = internetQuality.read_history()
+            trend = internetQuality.format_trend(history)
+            if trend:
+                html_trend = self.reporter.generate_text(
+                    "internet quality trend",
+                    [internetQuality.format_trend(history, html=True)]).replace("\n", "<br>", 1)
+                self.reporter.report_values("internet quality trend", [trend],
+                                            html_text=html_trend)
+
+    # ----------------------------------------------------------------------
+    def analyze_internet_results(self):
+        """
+        The analysis for the internet profile, formerly the separate
+        internetCheck program.
+        """
+        self.run_analysis_step(self.analyze_internet_access)
+        self.report_internet_quality()
+        internet_off_text = networkFunctions.internet_should_be_off()
+        if internet_off_text and not networkFunctions.proxy_server_working():
+            self.reporter.report_requires_user_action_problem(error_message_name="internet off",
+                                                values=[internet_off_text],
+                                                action_message_name="internet off action")
+        self.save_check_results()
+        report_errors(self.function_errors)
+
+# ----------------------------------------------------------------------
+def find_system_disks():
+    """
+    The internal sd disks and the nvme disks, sorted by name. USB and
+    optical drives are left out.
+    :return: list of device paths
+    """
+    command = "lsblk -d -n -o NAME |grep -v sr |sort"
+    all_disks = localFunctions.run_command(command, reraise_error=True, merge_stderr=False)
+    system_disks = []
+    for devname in all_disks:
+        if devname.startswith("sd"):
+            command = "find /dev/disk/by-id/ -lname '*%s'| grep 'ata'" %devname
+            if localFunctions.command_run_successful(command):
+                system_disks.append("/dev/%s" %devname)
+        elif devname.startswith("nvme"):
+            system_disks.append("/dev/%s" % devname)
+    return system_disks
+
 # ----------------------------------------------------------------------
 def get_accounts_usage(count=4, sort_by_media_size=False, table_indent=0,
                        show_trash=False, students=False):
@@ -2771,7 +3241,15 @@ def initializeApp():
         sys.path.append("/usr/local/lib/python")
 
 # ----------------------------------------------------------------------
-def runCheck(config, gui_connector=None):
+def runCheck(config, gui_connector=None, cancel_event=None, step_listener=None):
+    """
+    :param config:
+    :param gui_connector: the GuiConnector or the connector of a CheckWorker
+    :param cancel_event: a threading.Event that is set to stop the checks.
+        Nothing is analyzed or fixed after the checks have been cancelled.
+    :param step_listener: a function called with each CheckStep as its
+        status changes
+    """
     config.update_from_gui(gui_connector)
     reporter = sysChkIO.Reporter(config=config,
                                  gui_connector=gui_connector,
@@ -2780,12 +3258,23 @@ def runCheck(config, gui_connector=None):
                                  not (config.get_value("quiet") or
                                       config.get_value("problems_only")),
                                  output_filename=config.get_value(
-                                     "output_filename"))
+                                     "output_filename"),
+                                 records_filename=config.get_value("records_filename"))
     system_checker = SystemChecker(reporter=reporter, config=config)
+    if cancel_event:
+        system_checker.cancel_event = cancel_event
+    system_checker.step_listener = step_listener
     system_checker.perform_tests()
-    system_checker.analyze_results()
-    reporter.report_summary(ProblemReported, system_checker.suggest_reboot)
+    if system_checker.cancel_event.is_set():
+        reporter.report_progress("checks cancelled", level=0)
+    else:
+        system_checker.analyze_results()
+        if system_checker.profile.analysis == "full":
+            reporter.report_summary(ProblemReported, system_checker.suggest_reboot)
     reporter.cleanup()
+    if system_checker.timer:
+        print(system_checker.timer.format_table())
+        system_checker.timer.write_history()
 
 
 # ----------------------------------------------------------------------
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Query the systemCheck daemon (systemCheckDaemon.py) over its Unix socket.
+This module is small and imports nothing from systemCheck so that a client
+starts quickly.
+
+The protocol is one json object on one line each way. Every request has a
+"command":
+    {"command": "status"}
+    {"command": "topology"}
+    {"command": "results", "max_age": 900}
+    {"command": "run", "checks": ["check_dns"]}
+    {"command": "report", "profile": "login-background", "max_age": 900,
+     "settings": {"check_networks": false}}
+and every reply has "ok" and, if it is false, "error". The settings of a
+report change configuration values for that report only.
+"""
+
+import json
+import socket
+import sys
+import localFunctions
+
+PROGRAM_NAME = "systemCheckClient"
+PROGRAM_DESCRIPTION = "Send a request to the systemCheck daemon"
+PROGRAM_VERSION = "1.0"
+SOCKET_FILENAME = "/run/systemcheck/daemon.sock"
+# long enough for a full check that cannot use cached results
+DEFAULT_TIMEOUT = 600
+MAX_MESSAGE_SIZE = 16 * 2 ** 20
+
+
+def read_message(connection):
+    """
+    Read one json line.
+    :return: the decoded object
+    """
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_MESSAGE_SIZE:
+            raise ValueError("message too long")
+    return json.loads(data.decode("utf-8"))
+
+
+def write_message(connection, message):
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def request(message, socket_filename=SOCKET_FILENAME, timeout=DEFAULT_TIMEOUT):
+    """
+    Send a request to the daemon.
+    :param message: dictionary with the "command" and its arguments
+    :param socket_filename:
+    :param timeout: seconds to wait for the reply
+    :return: the reply dictionary or None if the daemon is not running or
+        did not answer
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(socket_filename)
+            write_message(connection, message)
+            return read_message(connection)
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    commandline_parser = localFunctions.initialize_app(PROGRAM_NAME, PROGRAM_VERSION,
+                                                       PROGRAM_DESCRIPTION,
+                                                       perform_parse=False)
+    commandline_parser.add_argument("command",
+                                    choices=("status", "topology", "results", "run",
+                                             "report"))
+    commandline_parser.add_argument("checks", nargs="*",
+                                    help="the checks for the run command")
+    commandline_parser.add_argument("--profile", dest="profile")
+    commandline_parser.add_argument("--max-age", dest="max_age", type=int, default=0)
+    args = commandline_parser.parse_args()
+    query = {"command": args.command, "max_age": args.max_age}
+    if args.checks:
+        query["checks"] = args.checks
+    if args.profile:
+        query["profile"] = args.profile
+    reply = request(query)
+    if reply is None:
+        print("The systemCheck daemon is not running.", file=sys.stderr)
+        sys.exit(1)
+    if args.command == "report" and reply.get("ok"):
+        print(reply["report"]["Report Text"])
+    else:
+        print(json.dumps(reply, indent=2, sort_keys=True))
+    sys.exit(0 if reply.get("ok") else 1)
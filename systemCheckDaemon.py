@@ -0,0 +1,339 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Run systemCheck as a service. The systemCheck module and its configuration
+are loaded once. The disks, mounted filesystems and network interfaces are
+kept in memory and read again only when the kernel reports a block device
+or network device change (udev events) or a mount change.
+
+The checks of the daemon profile (default "login-background", which makes
+no fixes) are run periodically so that the shared result cache is always
+fresh. A change of the disks, mounts or interfaces drops the cached results
+and the checks are run again as soon as the changes settle.
+
+Clients connect to a Unix socket that only root can use and send json
+requests, see systemCheckClient. updateLoginBackground gets its report from
+the daemon when it is running.
+"""
+
+import copy
+import json
+import os
+import os.path
+import select
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+import localFunctions
+import backgroundFunctions
+import checkExecutor
+import networkFunctions
+import smartCollector
+import sysChkIO
+import systemCheck
+import systemCheckClient
+
+PROGRAM_NAME = "systemCheckDaemon"
+PROGRAM_DESCRIPTION = "Run the system checks periodically and answer queries"
+PROGRAM_VERSION = "1.0"
+ERROR_LOGFILE = "/var/log/systemCheck/daemonError.log"
+INFO_LOGFILE = "/var/log/systemCheck/daemonInfo.log"
+DEFAULT_INTERVAL = 600
+DEFAULT_PROFILE = "login-background"
+# seconds without further events before a topology change is acted on
+EVENT_SETTLE_TIME = 5.0
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_SUBSYSTEMS = (b"SUBSYSTEM=block", b"SUBSYSTEM=net")
+MOUNTINFO_FILENAME = "/proc/self/mountinfo"
+InfoLogger = None
+ErrorLogger = None
+
+
+class Topology:
+    """
+    The disks, mounted filesystems and network interfaces of the server.
+    Each SystemChecker of the daemon uses them instead of reading them again.
+    """
+
+    def __init__(self):
+        self.disks = []
+        self.system_disks = []
+        self.mounts = []
+        self.interfaces = {}
+        self.refresh_time = 0.0
+
+    def refresh(self):
+        self.disks = smartCollector.get_disk_devices()
+        try:
+            self.system_disks = systemCheck.find_system_disks()
+        except subprocess.CalledProcessError:
+            self.system_disks = []
+        self.mounts = [{"mount_point": m.mount_point, "device": m.device,
+                        "fs_type": m.fs_type} for m in localFunctions.get_mounts()]
+        addresses = networkFunctions.get_interface_addresses()
+        self.interfaces = {name: [str(a) for a in addresses.get(name, [])]
+                           for name in networkFunctions.list_interfaces()}
+        self.refresh_time = time.time()
+
+    def as_dict(self):
+        return {"disks": self.disks, "system_disks": self.system_disks,
+                "mounts": self.mounts,
+                "interfaces": self.interfaces, "refresh_time": self.refresh_time}
+
+
+class CheckService:
+    """
+    Runs the checks and answers the requests. Only one run of the checks is
+    made at a time; other requests wait for it.
+    """
+
+    def __init__(self, config, profile_name=DEFAULT_PROFILE, interval=DEFAULT_INTERVAL):
+        self.config = config
+        self.profile_name = profile_name
+        self.interval = interval
+        self.topology = Topology()
+        self.result_cache = checkExecutor.ResultCache()
+        self.run_lock = threading.Lock()
+        self.last_run_time = 0.0
+        self.last_run_steps = {}
+        self.topology_changed_time = 0.0
+
+    # ----------------------------------------------------------------------
+    def create_checker(self, profile_name, max_age, settings=None):
+        """
+        A new SystemChecker for each run so that no result of an earlier
+        run is left in it. The configuration is copied, not read again.
+        :param settings: configuration values to change for this run
+        """
+        config = copy.copy(self.config)
+        config.params_dict = dict(self.config.params_dict)
+        for name, value in (settings or {}).items():
+            if name in config.params_dict:
+                config.set_value(name, value)
+        config.set_value("profile", profile_name)
+        config.set_value("max_result_age", max_age)
+        reporter = sysChkIO.Reporter(config, gui_connector=None,
+                                     report_progress_messages=False,
+                                     output_filename="", username="", line_width=400,
+                                     verbose=False, use_stringbuffer=True)
+        checker = systemCheck.SystemChecker(reporter, config)
+        if self.topology.refresh_time:
+            checker.topology = self.topology
+        return checker, reporter
+
+    # ----------------------------------------------------------------------
+    def run_checks(self, profile_name=None, checks=None, max_age=0):
+        """
+        Run the checks without the analysis so nothing is fixed except by a
+        check that fixes what it finds, which the daemon profile excludes.
+        :param profile_name:
+        :param checks: names of the checks to run instead of the profile
+        :param max_age: seconds that cached results may be used
+        :return: dictionary of check name:{"status", "results"}
+        """
+        with self.run_lock:
+            checker, reporter = self.create_checker(profile_name or self.profile_name,
+                                                    max_age)
+            if checks:
+                checker.profile = checkExecutor.CheckProfile("request", "", checks=checks)
+            steps = checker.perform_tests()
+            checker.save_check_results()
+            summary = {}
+            for step in steps:
+                if step.function:
+                    summary[step.name] = {
+                        "status": step.status, "from_cache": step.from_cache,
+                        "results": {name: getattr(checker, name, None)
+                                    for name in step.results}}
+            if not checks:
+                self.last_run_time = time.time()
+                self.last_run_steps = summary
+            return summary
+
+    # ----------------------------------------------------------------------
+    def make_report(self, profile_name, max_age, settings=None):
+        """
+        A complete check with the analysis, as systemCheck makes it.
+        :return: the report info of the reporter with the report text
+        """
+        with self.run_lock:
+            checker, reporter = self.create_checker(profile_name, max_age, settings)
+            checker.perform_tests()
+            checker.analyze_results()
+            report_info = reporter.get_report_info()
+            report_info["Report Text"] = report_info.pop("Report Stringbuffer").getvalue()
+            report_info["Suggest Reboot"] = checker.suggest_reboot
+            return report_info
+
+    # ----------------------------------------------------------------------
+    def run_scheduled_checks(self):
+        try:
+            self.run_checks()
+            InfoLogger.info("Checks of profile %s finished" % self.profile_name)
+        except Exception as e:
+            ErrorLogger.error("Scheduled checks failed: %s"
+                              % localFunctions.generate_exception_string(e))
+
+    # ----------------------------------------------------------------------
+    def topology_changed(self):
+        """
+        A disk, mount or interface has changed so the cached results may
+        be wrong.
+        """
+        self.topology.refresh()
+        self.result_cache.invalidate()
+        self.topology_changed_time = 0.0
+        InfoLogger.info("Topology changed: %d disks, %d mounts, %d interfaces"
+                        % (len(self.topology.disks), len(self.topology.mounts),
+                           len(self.topology.interfaces)))
+
+    # ----------------------------------------------------------------------
+    def handle_request(self, message):
+        """
+        :param message: the decoded request
+        :return: the reply dictionary
+        """
+        command = message.get("command")
+        max_age = int(message.get("max_age", 0))
+        if command == "status":
+            return {"ok": True, "profile": self.profile_name, "interval": self.interval,
+                    "last_run": self.last_run_time,
+                    "running": self.run_lock.locked(),
+                    "topology_refreshed": self.topology.refresh_time,
+                    "checks": self.last_run_steps}
+        elif command == "topology":
+            return {"ok": True, "topology": self.topology.as_dict()}
+        elif command == "results":
+            self.result_cache.load()
+            return {"ok": True, "results": {
+                name: entry for name, entry in self.result_cache.entries.items()
+                if not max_age or time.time() - entry.get("time", 0) <= max_age}}
+        elif command == "run":
+            checks = message.get("checks")
+            if not checks:
+                return {"ok": False, "error": "no checks named"}
+            return {"ok": True, "checks": self.run_checks(checks=checks, max_age=max_age)}
+        elif command == "report":
+            profile_name = message.get("profile", "full")
+            if profile_name not in systemCheck.CheckProfiles:
+                return {"ok": False, "error": "unknown profile %s" % profile_name}
+            return {"ok": True, "report": self.make_report(profile_name, max_age,
+                                                           message.get("settings"))}
+        return {"ok": False, "error": "unknown command %s" % command}
+
+
+def encode_reply_value(value):
+    if isinstance(value, set):
+        return sorted(value)
+    return str(value)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            message = systemCheckClient.read_message(self.request)
+            reply = self.server.service.handle_request(message)
+        except (ValueError, TypeError, AttributeError) as e:
+            reply = {"ok": False, "error": "bad request: %s" % e}
+        except Exception as e:
+            ErrorLogger.error("Request failed: %s"
+                              % localFunctions.generate_exception_string(e))
+            reply = {"ok": False, "error": str(e)}
+        try:
+            self.request.sendall(json.dumps(reply, default=encode_reply_value)
+                                 .encode("utf-8") + b"\n")
+        except OSError:
+            pass
+
+
+class CheckServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_filename, service):
+        os.makedirs(os.path.dirname(socket_filename), 0o755, exist_ok=True)
+        if os.path.exists(socket_filename):
+            os.remove(socket_filename)
+        # only root may connect
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(socket_filename, RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.service = service
+
+
+def open_uevent_socket():
+    """
+    :return: a netlink socket that receives the kernel device events or None
+    """
+    try:
+        uevent_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                      NETLINK_KOBJECT_UEVENT)
+        uevent_socket.bind((0, 1))
+        return uevent_socket
+    except OSError as e:
+        ErrorLogger.error("No device events: %s" % e)
+        return None
+
+
+def main_loop(systemd_connector, service):
+    poller = select.poll()
+    uevent_socket = open_uevent_socket()
+    if uevent_socket:
+        poller.register(uevent_socket, select.POLLIN)
+    # a mount or unmount makes mountinfo report an exceptional condition
+    mountinfo = open(MOUNTINFO_FILENAME, "r")
+    poller.register(mountinfo, select.POLLPRI)
+    scheduled_thread = None
+    next_run = time.time()
+    while True:
+        systemd_connector.update_watchdog()
+        for fd, event in poller.poll(1000):
+            if uevent_socket and fd == uevent_socket.fileno():
+                data = uevent_socket.recv(65536)
+                if any([s in data.split(b"\0") for s in UEVENT_SUBSYSTEMS]):
+                    service.topology_changed_time = time.time()
+            elif fd == mountinfo.fileno():
+                mountinfo.seek(0)
+                mountinfo.read()
+                service.topology_changed_time = time.time()
+        if service.topology_changed_time and \
+                time.time() - service.topology_changed_time > EVENT_SETTLE_TIME:
+            service.topology_changed()
+            next_run = time.time()
+        if time.time() >= next_run and \
+                not (scheduled_thread and scheduled_thread.is_alive()):
+            scheduled_thread = threading.Thread(target=service.run_scheduled_checks,
+                                                name="scheduled checks", daemon=True)
+            scheduled_thread.start()
+            next_run = time.time() + service.interval
+
+
+if __name__ == '__main__':
+    commandline_parser = localFunctions.initialize_app(PROGRAM_NAME, PROGRAM_VERSION,
+                                                       PROGRAM_DESCRIPTION,
+                                                       perform_parse=False)
+    commandline_parser.add_argument("--interval", dest="interval", type=int,
+                                    default=DEFAULT_INTERVAL,
+                                    help="seconds between the periodic checks")
+    commandline_parser.add_argument("--profile", dest="profile", default=DEFAULT_PROFILE,
+                                    choices=sorted(systemCheck.CheckProfiles.keys()),
+                                    help="the checks that are run periodically")
+    commandline_parser.add_argument("--socket", dest="socket_filename",
+                                    default=systemCheckClient.SOCKET_FILENAME)
+    args = commandline_parser.parse_args()
+    localFunctions.confirm_root_user(PROGRAM_NAME)
+    InfoLogger, ErrorLogger = backgroundFunctions.create_loggers(INFO_LOGFILE,
+                                                                 ERROR_LOGFILE)
+    systemCheck.error_logger = systemCheck.setup_error_logger()
+    check_service = CheckService(systemCheck.Configuration(read_command_line=False),
+                                 args.profile, args.interval)
+    check_service.topology.refresh()
+    server = CheckServer(args.socket_filename, check_service)
+    threading.Thread(target=server.serve_forever, name="requests", daemon=True).start()
+    systemd = backgroundFunctions.setup_systemd_and_start(PROGRAM_NAME, InfoLogger,
+                                                          ErrorLogger)
+    main_loop(systemd, check_service)
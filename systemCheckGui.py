@@ -8,7 +8,9 @@
 #
 
 from PyQt4 import QtCore, QtGui
+import checkExecutor
 import systemCheck
+import systemCheckWorker
 
 ActiveGuiConnector = None
 
@@ -65,6 +67,10 @@ class Ui_MainWindow(object):
         self.progressBar.setInvertedAppearance(False)
         self.progressBar.setObjectName(_fromUtf8("progressBar"))
         self.verticalLayout.addWidget(self.progressBar)
+        self.checkList = QtGui.QListWidget(self.centralwidget)
+        self.checkList.setMaximumSize(QtCore.QSize(16777215, 120))
+        self.checkList.setObjectName(_fromUtf8("checkList"))
+        self.verticalLayout.addWidget(self.checkList)
         self.testProgessLabel = QtGui.QLabel(self.centralwidget)
         font = QtGui.QFont()
         font.setFamily(_fromUtf8("DejaVu Sans"))
@@ -94,7 +100,17 @@ class Ui_MainWindow(object):
         self.runButton.setDefault(True)
         self.runButton.setFlat(False)
         self.runButton.setObjectName(_fromUtf8("runButton"))
-        self.verticalLayout.addWidget(self.runButton)
+        self.cancelButton = QtGui.QPushButton(self.centralwidget)
+        self.cancelButton.setMaximumSize(QtCore.QSize(100, 50))
+        self.cancelButton.setFont(font)
+        self.cancelButton.setEnabled(False)
+        self.cancelButton.setObjectName(_fromUtf8("cancelButton"))
+        self.buttonLayout = QtGui.QHBoxLayout()
+        self.buttonLayout.setObjectName(_fromUtf8("buttonLayout"))
+        self.buttonLayout.addWidget(self.runButton)
+        self.buttonLayout.addWidget(self.cancelButton)
+        self.buttonLayout.addStretch()
+        self.verticalLayout.addLayout(self.buttonLayout)
         MainWindow.setCentralWidget(self.centralwidget)
         self.menubar = QtGui.QMenuBar(MainWindow)
         self.menubar.setGeometry(QtCore.QRect(0, 0, 581, 26))
@@ -129,7 +145,9 @@ class Ui_MainWindow(object):
         QtCore.QObject.connect(self.runButton, QtCore.SIGNAL(_fromUtf8("clicked()")), self.statusTextBox.clear)
         QtCore.QObject.connect(self.runButton, QtCore.SIGNAL(_fromUtf8("clicked()")), self.resultsTextBox.clear)
         QtCore.QObject.connect(self.runButton, QtCore.SIGNAL(_fromUtf8("clicked()")), self.progressBar.reset)
+        QtCore.QObject.connect(self.runButton, QtCore.SIGNAL(_fromUtf8("clicked()")), self.checkList.clear)
         QtCore.QObject.connect(self.runButton, QtCore.SIGNAL(_fromUtf8("clicked()")), GuiRunCheck)
+        QtCore.QObject.connect(self.cancelButton, QtCore.SIGNAL(_fromUtf8("clicked()")), GuiCancelCheck)
         QtCore.QObject.connect(self.actionClose, QtCore.SIGNAL(_fromUtf8("activated()")), MainWindow.close)
         QtCore.QMetaObject.connectSlotsByName(MainWindow)
 
@@ -154,6 +172,9 @@ class Ui_MainWindow(object):
 "</style></head><body style=\" font-family:\'DejaVu Sans\'; font-size:13pt; font-weight:600; font-style:normal;\">\n"
 "<p style=\" margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;\"><span style=\" font-weight:400;\">Click to start the System Check</span></p></body></html>", None, QtGui.QApplication.UnicodeUTF8))
         self.runButton.setText(QtGui.QApplication.translate("MainWindow", "Run Test", None, QtGui.QApplication.UnicodeUTF8))
+        self.cancelButton.setToolTip(QtGui.QApplication.translate("MainWindow", "<html><head/><body><p>Stop the checks that have not started yet. No problems are fixed.</p></body></html>", None, QtGui.QApplication.UnicodeUTF8))
+        self.cancelButton.setText(QtGui.QApplication.translate("MainWindow", "Cancel", None, QtGui.QApplication.UnicodeUTF8))
+        self.checkList.setToolTip(QtGui.QApplication.translate("MainWindow", "<html><head/><body><p>The checks and their state as they run.</p></body></html>", None, QtGui.QApplication.UnicodeUTF8))
         self.menuFile.setTitle(QtGui.QApplication.translate("MainWindow", "File", None, QtGui.QApplication.UnicodeUTF8))
         self.actionClose.setText(QtGui.QApplication.translate("MainWindow", "Close", None, QtGui.QApplication.UnicodeUTF8))
         self.menuHelp.setTitle(QtGui.QApplication.translate("MainWindow", "Help", None))
@@ -221,6 +242,13 @@ class GuiConnector:
             "fixing problem":"Blue", "fix result good":"DarkGreen",
             "fix result bad":"DarkOrange", "serious problem":"Red", "values":"DarkSlateGray",
             "no problems":"Green"}
+        self.check_colors = {checkExecutor.PENDING: "DarkGrey", checkExecutor.RUNNING: "Blue",
+            checkExecutor.COMPLETED: "DarkGreen", checkExecutor.SKIPPED: "DarkGrey",
+            checkExecutor.FAILED: "Red", checkExecutor.TIMED_OUT: "DarkOrange",
+            checkExecutor.CANCELLED: "DarkGrey"}
+        self.check_items = {}
+        self.worker = None
+        self.worker_thread = None
         self.initialize_gui_config()
         ActiveGuiConnector = self
 
@@ -247,17 +275,66 @@ class GuiConnector:
     def getGuiConfig(self):
         return self.gui_config
 
-    def update_gui(self):
-        while self.app.hasPendingEvents():
-            self.app.processEvents()
+    def start_check(self):
+        """
+        Run the check in a worker thread. The worker's signals update the
+        window in this thread.
+        """
+        self.generate_gui_config()
+        self.check_items = {}
+        self.worker_thread = QtCore.QThread()
+        self.worker = systemCheckWorker.CheckWorker(self.system_config, self.gui_config)
+        self.worker.moveToThread(self.worker_thread)
+        self.worker.progressText.connect(self.insert_progress_text)
+        self.worker.percentComplete.connect(self.show_percent_complete)
+        self.worker.informationText.connect(self.insert_information_text)
+        self.worker.simpleText.connect(self.insert_simple_text)
+        self.worker.checkStatus.connect(self.show_check_status)
+        self.worker.failed.connect(self.show_check_failure)
+        self.worker.finished.connect(self.check_finished)
+        self.worker.finished.connect(self.worker_thread.quit)
+        self.worker_thread.started.connect(self.worker.run)
+        self.gui.runButton.setEnabled(False)
+        self.gui.cancelButton.setEnabled(True)
+        self.gui.statusbar.showMessage("System Check is running")
+        self.worker_thread.start()
+
+    def cancel_check(self):
+        if self.worker:
+            self.worker.cancel()
+            self.gui.cancelButton.setEnabled(False)
+            self.gui.statusbar.showMessage("Cancelling. Waiting for the running checks to finish.")
+
+    def check_finished(self, cancelled):
+        self.gui.runButton.setEnabled(True)
+        self.gui.cancelButton.setEnabled(False)
+        if cancelled:
+            self.gui.statusbar.showMessage("System Check was cancelled")
+        else:
+            self.gui.progressBar.setValue(100)
+            self.gui.statusbar.showMessage("System Check completed")
+
+    def show_check_failure(self, error_text):
+        self.insert_simple_text("serious problem", "System Check failed: %s" % error_text, True)
+
+    def show_check_status(self, check_name, status, run_time):
+        item = self.check_items.get(check_name)
+        if not item:
+            item = QtGui.QListWidgetItem(self.gui.checkList)
+            self.check_items[check_name] = item
+        text = "%s: %s" % (check_name.replace("_", " "), status)
+        if run_time >= 1.0:
+            text += " (%.0f s)" % run_time
+        item.setText(text)
+        item.setForeground(QtGui.QBrush(QtGui.QColor(self.check_colors.get(status, "DarkGrey"))))
+        if status == checkExecutor.RUNNING:
+            self.gui.checkList.scrollToItem(item)
 
     def insert_progress_text(self, progress_text):
         self.gui.statusTextBox.insertPlainText(progress_text + "\n")
-        self.update_gui()
 
     def show_percent_complete(self, percent_complete):
         self.gui.progressBar.setValue(percent_complete)
-        self.update_gui()
 
     def generate_information_text(self, entry_type, prefix, message_text, emphasized=False):
         if emphasized:
@@ -271,7 +348,6 @@ class GuiConnector:
     def insert_information_text(self, entry_type, prefix, message_text, emphasized=False):
         html_text = self.generate_information_text(entry_type, prefix, message_text, emphasized)
         self.gui.resultsTextBox.insertHtml(html_text)
-        self.update_gui()
 
     def insert_simple_text(self, entry_type, message_text, emphasized=False):
         if emphasized:
@@ -281,12 +357,14 @@ class GuiConnector:
             html_text = '<div style="color:%s">%s</div><br></br>' \
                 %(self.message_colors.get(entry_type, "DarkGrey"), message_text)
         self.gui.resultsTextBox.insertHtml(html_text)
-        self.update_gui()
 
 def GuiRunCheck():
     global ActiveGuiConnector
-    ActiveGuiConnector.generate_gui_config()
-    systemCheck.runCheck(ActiveGuiConnector.system_config, ActiveGuiConnector)
+    ActiveGuiConnector.start_check()
+
+def GuiCancelCheck():
+    global ActiveGuiConnector
+    ActiveGuiConnector.cancel_check()
 
 # if __name__ == "__main__":
 #     import sys
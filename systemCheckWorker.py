@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Run the system check in a worker thread so that the window of
+systemCheckGui stays responsive while slow network or disk checks run.
+
+The CheckWorker is moved to a QThread. Everything the check would write to
+the window is sent as a signal instead, and Qt delivers the signals to the
+window in its own thread. The status of each check is also sent as it
+changes so that the window can show a list of the checks.
+
+Only QtCore is used by the worker so it can be run without a display,
+with a QCoreApplication, or by calling run() directly:
+    worker = systemCheckWorker.CheckWorker(config, {...})
+    worker.checkStatus.connect(print)
+    worker.run()
+"""
+
+import threading
+from PyQt4 import QtCore
+import localFunctions
+import checkExecutor
+import systemCheck
+
+
+class WorkerConnector:
+    """
+    Takes the place of the GuiConnector in the worker thread. The GuiReporter
+    calls it as it would the GuiConnector and each call is passed on as a
+    signal of the worker.
+    """
+
+    def __init__(self, worker, gui_config):
+        self.worker = worker
+        self.gui_config = gui_config
+
+    def insert_progress_text(self, progress_text):
+        self.worker.progressText.emit(progress_text)
+
+    def show_percent_complete(self, percent_complete):
+        self.worker.percentComplete.emit(int(percent_complete))
+
+    def insert_information_text(self, entry_type, prefix, message_text, emphasized=False):
+        self.worker.informationText.emit(entry_type, prefix, message_text, emphasized)
+
+    def insert_simple_text(self, entry_type, message_text, emphasized=False):
+        self.worker.simpleText.emit(entry_type, message_text, emphasized)
+
+
+class CheckWorker(QtCore.QObject):
+    """
+    Run one system check. Create a new worker for each run.
+    """
+    progressText = QtCore.pyqtSignal(str)
+    percentComplete = QtCore.pyqtSignal(int)
+    informationText = QtCore.pyqtSignal(str, str, str, bool)
+    simpleText = QtCore.pyqtSignal(str, str, bool)
+    # check name, status and seconds it ran
+    checkStatus = QtCore.pyqtSignal(str, str, float)
+    # True if the run was cancelled
+    finished = QtCore.pyqtSignal(bool)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, system_config, gui_config, parent=None):
+        """
+        :param system_config: the systemCheck.Configuration
+        :param gui_config: the option values of the window
+        """
+        super().__init__(parent)
+        self.system_config = system_config
+        self.gui_config = gui_config
+        self.cancel_event = threading.Event()
+
+    # ----------------------------------------------------------------------
+    @QtCore.pyqtSlot()
+    def run(self):
+        try:
+            systemCheck.runCheck(self.system_config,
+                                 WorkerConnector(self, self.gui_config),
+                                 cancel_event=self.cancel_event,
+                                 step_listener=self.report_step)
+        except Exception as e:
+            if systemCheck.error_logger:
+                systemCheck.error_logger.error(
+                    "systemCheck failed with unknown error:\n " +
+                    localFunctions.generate_exception_string(e))
+            self.failed.emit(str(e))
+        self.finished.emit(self.cancel_event.is_set())
+
+    # ----------------------------------------------------------------------
+    def cancel(self):
+        """
+        Stop the checks that have not started. This is called directly from
+        the window's thread because the worker thread is busy with the checks.
+        """
+        self.cancel_event.set()
+
+    # ----------------------------------------------------------------------
+    def report_step(self, step):
+        """
+        The step listener of the check executor. It is called from the
+        check threads.
+        """
+        if step.function:
+            run_time = step.run_time if step.status == checkExecutor.COMPLETED else 0.0
+            self.checkStatus.emit(step.name, step.status, run_time)
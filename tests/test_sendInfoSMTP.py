@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Send the outbox of sendInfoSMTP to a small SMTP server on a local port
+instead of the real mail server.
+Run with: python3 -m unittest discover tests
+"""
+
+import email.message
+import logging
+import os
+import os.path
+import socketserver
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sendInfoSMTP
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    """
+    Accepts every message and keeps it in received as (sender, receivers,
+    message text).
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), SmtpHandler)
+        self.received = []
+        self.port = self.server_address[1]
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, text):
+        self.wfile.write((text + "\r\n").encode("ascii"))
+
+    def handle(self):
+        sender = ""
+        receivers = []
+        self.reply("220 localhost stand-in")
+        while True:
+            line = self.rfile.readline().decode("ascii", "replace").strip()
+            command = line[:4].upper()
+            if not line or command == "QUIT":
+                self.reply("221 bye")
+                return
+            if command in ("HELO", "EHLO"):
+                self.reply("250 localhost")
+            elif command == "MAIL":
+                sender = line.split(":", 1)[1].strip(" <>")
+                self.reply("250 ok")
+            elif command == "RCPT":
+                receivers.append(line.split(":", 1)[1].strip(" <>"))
+                self.reply("250 ok")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b".\r\n", b".\n", b""):
+                        break
+                    lines.append(data_line.decode("utf-8", "replace"))
+                self.server.received.append((sender, receivers, "".join(lines)))
+                receivers = []
+                self.reply("250 queued")
+            else:
+                self.reply("250 ok")
+
+
+def create_message(text, size=0):
+    message = email.message.Message()
+    message["Subject"] = text
+    message.set_payload(text + "x" * size)
+    return message
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        sendInfoSMTP.InfoLogger = logging.getLogger("outbox-test-info")
+        sendInfoSMTP.ErrorLogger = logging.getLogger("outbox-test-error")
+        self.directory = tempfile.TemporaryDirectory()
+        self.outbox_directory = os.path.join(self.directory.name, "outbox")
+        self.server = SmtpStandIn()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_parts_sent_to_smtp_server(self):
+        outbox = sendInfoSMTP.Outbox(self.outbox_directory, 1, "127.0.0.1",
+                                     self.server.port)
+        outbox.enqueue("school-report", [create_message("part 1"),
+                                         create_message("part 2")])
+        self.assertEqual(outbox.process(), (1, 0))
+        self.assertEqual(len(self.server.received), 2)
+        sender, receivers, text = self.server.received[0]
+        self.assertEqual(sender, sendInfoSMTP.EMAIL_SENDER)
+        self.assertEqual(receivers, [sendInfoSMTP.EMAIL_RECEIVER])
+        self.assertIn("part 1", text)
+        self.assertEqual(outbox.get_entry_names(), [])
+
+    def test_failed_send_is_retried_later(self):
+        self.server.shutdown()
+        self.server.server_close()
+        outbox = sendInfoSMTP.Outbox(self.outbox_directory, 1, "127.0.0.1",
+                                     self.server.port)
+        entry_name = outbox.enqueue("school-report", [create_message("part 1")])
+        self.assertEqual(outbox.process(now=1000), (0, 1))
+        state = outbox.read_state(entry_name)
+        self.assertEqual(state["attempts"], 1)
+        self.assertEqual(state["next_attempt"], 1000 + sendInfoSMTP.RETRY_BASE_DELAY)
+        # not due yet so nothing is tried
+        self.assertEqual(outbox.process(now=1001), (0, 1))
+        self.assertEqual(outbox.read_state(entry_name)["attempts"], 1)
+
+    def test_size_limit_keeps_exports(self):
+        outbox = sendInfoSMTP.Outbox(self.outbox_directory, 1, "127.0.0.1",
+                                     self.server.port)
+        for entry_id, size, holds_export in (("1-export", 1000, True),
+                                             ("2-other", 1000, False),
+                                             ("3-newest", 1500, False)):
+            entry_name = outbox.enqueue(entry_id, [create_message(entry_id, size)],
+                                        holds_export=holds_export)
+            os.rename(os.path.join(self.outbox_directory, entry_name),
+                      os.path.join(self.outbox_directory, entry_id))
+        sizes = {name: outbox.get_entry_size(name) for name in outbox.get_entry_names()}
+        kept_size = sizes["1-export"] + sizes["3-newest"]
+        outbox.max_size = kept_size + sizes["2-other"] - 1
+        self.assertTrue(outbox.is_full())
+        self.assertEqual(outbox.enforce_size_limit(), ["2-other"])
+        self.assertEqual(outbox.get_entry_names(), ["1-export", "3-newest"])
+        self.assertFalse(outbox.is_full())
+        # the export and the newest entry are kept even over the limit, so
+        # no further export may be queued
+        outbox.max_size = kept_size - 1
+        self.assertEqual(outbox.enforce_size_limit(), [])
+        self.assertTrue(outbox.is_full())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,8 @@ Create a new status image, overlay on login background image, and update lightdm
 
 import argparse
 import enum
+import io
+import json
 import os.path
 import re
 import subprocess
@@ -18,6 +20,7 @@ import localFunctions
 import localFunctionsPy3
 import sysChkIO
 import systemCheck
+import systemCheckClient
 
 JINJA_HTML_TEMPLATE_FILE = 'loginInfoTemplate.html'
 GENERATED_BACKGROUND_IMAGE = "/tmp/info_background.jpg"
@@ -26,8 +29,12 @@ SERVER_LOGIN_BACKGROUND = "ServerLoginBackground.jpg"
 SERVER_LOGIN_DISK2_BACKGROUND = "ServerLoginBackgroundDrive2.jpg"
 SUPPORT_FILES_PATH = "/usr/local/share/share"
 LOGFILE = "/var/log/systemCheck/loginUpdate.log"
+# the report records of the latest check as json lines
+RECORDS_FILE = "/var/log/systemCheck/loginUpdateRecords.jsonl"
 PROGRAM_NAME = "updateLoginBackground"
 VERSION = 0.8
+# seconds that the results of an earlier system check may be reused
+CHECK_RESULT_MAX_AGE = 900
 
 
 class WindowConstants:
@@ -151,6 +158,9 @@ class StatusChecker:
     def setup_SystemCheckConfiguration(self):
         self.systemCheckConfiguration = systemCheck.Configuration(read_command_line=False)
         self.systemCheckConfiguration.params_dict["check_networks"] = False
+        self.systemCheckConfiguration.params_dict["profile"] = "login-background"
+        # results of checks made by systemCheck or the last refresh are used
+        self.systemCheckConfiguration.params_dict["max_result_age"] = CHECK_RESULT_MAX_AGE
         self.systemCheckConfiguration.params_dict["problems_only"] = False
         self.systemCheckConfiguration.params_dict["quiet"] = True
 
@@ -163,17 +173,37 @@ class StatusChecker:
                                                      username="", line_width=400, verbose=False,
                                                      use_stringbuffer=True)
         self.textReporter = self.systemCheckReporter.txt_reporter
-        self.systemChecker = systemCheck.SystemChecker(self.systemCheckReporter,
-                                                       self.systemCheckConfiguration)
+
+    def get_daemon_report(self):
+        """
+        Ask the systemCheck daemon for the report. It has the checks loaded
+        and usually has recent results.
+        :return: the report info or None if the daemon is not running
+        """
+        params = self.systemCheckConfiguration.params_dict
+        reply = systemCheckClient.request(
+            {"command": "report", "profile": params["profile"],
+             "max_age": params["max_result_age"],
+             "settings": {name: params[name]
+                          for name in ("check_networks", "problems_only", "quiet")}})
+        if not (reply and reply.get("ok")):
+            return None
+        report_info = reply["report"]
+        report_info["Report Stringbuffer"] = io.StringIO(report_info.pop("Report Text"))
+        return report_info
 
     def perform_check(self):
         """
         perform the system check and generate the raw results.
         :return:
         """
-        self.systemChecker.perform_tests()
-        self.systemChecker.analyze_results()
-        self.report_info = self.systemCheckReporter.get_report_info()
+        self.report_info = self.get_daemon_report()
+        if self.report_info is None:
+            self.systemChecker = systemCheck.SystemChecker(self.systemCheckReporter,
+                                                           self.systemCheckConfiguration)
+            self.systemChecker.perform_tests()
+            self.systemChecker.analyze_results()
+            self.report_info = self.systemCheckReporter.get_report_info()
 
     def generate_summary(self):
         if self.report_info["Reboot Required"]:
@@ -212,7 +242,7 @@ class StatusChecker:
         self.setup_systemCheck_objects()
         self.perform_check()
         self.process_results()
-        return self.systemCheckReporter.get_report_info()
+        return self.report_info
 
     def get_status_text(self):
         return self.display_status_text
@@ -248,6 +278,18 @@ def write_log(generated_text):
         f.write(print_text)
 
 
+def write_records(records):
+    """
+    Replace the records of the previous check.
+    """
+    try:
+        with open(RECORDS_FILE, "w") as f:
+            for record in records:
+                f.write(json.dumps(record, default=str) + "\n")
+    except OSError:
+        pass
+
+
 def restart_lightdm_when_no_user():
     info = str(localFunctions.run_command("ps -ef",
                                           False, False))
@@ -283,11 +325,14 @@ if __name__ == "__main__":
     else:
         statusChecker = StatusChecker()
         report_info = statusChecker.generate_status_report()
+        records = report_info["Records"]
         if report_info["Problems Fixed"]:
             # write to log file, then rerun to get updated file for the login screen
             write_log(statusChecker.get_status_text())
             statusChecker = StatusChecker()
             problems_fixed = statusChecker.generate_status_report()
+            records += problems_fixed["Records"]
+        write_records(records)
         backgroundGenerator.select_background(get_using_backup_disk())
         backgroundGenerator.create_html_file(statusChecker.get_status(),
                                              statusChecker.get_status_text(),